@@ -0,0 +1,1093 @@
+import hashlib
+import importlib.util
+import marshal
+import os
+import pickle
+import re
+import sys
+import time
+from array import array
+
+# hdl tokens: names (chip names, pins, true/false), numbers, '..' and punctuation
+TOKEN = re.compile(r'\s+|//[^\n]*|/\*.*?\*/|([A-Za-z_]\w*|\d+|\.\.|[{}()\[\];,=:])', re.S)
+
+
+class HDLError(Exception):
+    # raised for chips that cannot be parsed, resolved or simulated
+    pass
+
+
+def mask(width):
+    return (1 << width) - 1
+
+
+class ChipDef:
+    # a parsed CHIP: pins by name -> width, and its parts in file order
+    # each part is (chipName, [(pin, lo, hi, signal, slo, shi)]) where
+    # lo/hi are None for a whole pin and signal may be 'true' / 'false'
+
+    def __init__(self, name, inputs, outputs, parts, filename=None, digest=None):
+        self.name = name
+        self.inputs = inputs
+        self.outputs = outputs
+        self.parts = parts
+        self.filename = filename
+        self.digest = digest  # sha256 of the source, keys the compile cache
+
+
+def tokenize(text, filename):
+    tokens = []
+    pos = 0
+    while pos < len(text):
+        match = TOKEN.match(text, pos)
+        if not match:
+            line = text.count('\n', 0, pos) + 1
+            raise HDLError(f"{filename}:{line}: unexpected '{text[pos]}'")
+        if match.group(1):
+            tokens.append((match.group(1), text.count('\n', 0, pos) + 1))
+        pos = match.end()
+    return tokens
+
+
+def parseHDL(text, filename='<hdl>'):
+    # parse the text of one .hdl file into a ChipDef
+    tokens = tokenize(text, filename)
+    pos = 0
+
+    def peek():
+        return tokens[pos][0] if pos < len(tokens) else None
+
+    def take(expected=None):
+        nonlocal pos
+        if pos >= len(tokens):
+            raise HDLError(f"{filename}: unexpected end of file")
+        value, line = tokens[pos]
+        if expected is not None and value != expected:
+            raise HDLError(f"{filename}:{line}: expected '{expected}', got '{value}'")
+        pos += 1
+        return value
+
+    def number():
+        value = take()
+        if not value.isdigit():
+            raise HDLError(f"{filename}:{tokens[pos - 1][1]}: expected a number, got '{value}'")
+        return int(value)
+
+    def pinList():
+        pins = {}
+        while True:
+            name = take()
+            width = 1
+            if peek() == '[':
+                take('[')
+                width = number()
+                take(']')
+            pins[name] = width
+            if peek() != ',':
+                break
+            take(',')
+        take(';')
+        return pins
+
+    def subscript():
+        # optional [i] or [i..j], returns (lo, hi) or (None, None)
+        if peek() != '[':
+            return None, None
+        take('[')
+        lo = number()
+        hi = lo
+        if peek() == '..':
+            take('..')
+            hi = number()
+        take(']')
+        return lo, hi
+
+    take('CHIP')
+    name = take()
+    take('{')
+    inputs = {}
+    outputs = {}
+    if peek() == 'IN':
+        take('IN')
+        inputs = pinList()
+    if peek() == 'OUT':
+        take('OUT')
+        outputs = pinList()
+
+    parts = []
+    if peek() == 'BUILTIN':
+        # builtin stubs only name the java class, nothing to wire
+        raise HDLError(f"{filename}: '{name}' is a BUILTIN stub")
+    take('PARTS')
+    take(':')
+    while peek() != '}':
+        chipName = take()
+        take('(')
+        connections = []
+        while True:
+            pin = take()
+            lo, hi = subscript()
+            take('=')
+            signal = take()
+            slo, shi = subscript()
+            connections.append((pin, lo, hi, signal, slo, shi))
+            if peek() != ',':
+                break
+            take(',')
+        take(')')
+        take(';')
+        parts.append((chipName, connections))
+    take('}')
+    digest = hashlib.sha256(text.encode()).hexdigest()
+    return ChipDef(name, inputs, outputs, parts, filename, digest)
+
+
+# builtin chips
+#
+# values are unsigned ints of the pin's width. combinational builtins are
+# plain functions from input values to a tuple of output values; clocked
+# ones are classes whose outputs come from state (and, for memories, the
+# address) and change only on tock.
+
+COMBINATIONAL = {
+    # name: (inputs, outputs, function)
+    'Nand': ({'a': 1, 'b': 1}, {'out': 1}, lambda a, b: (1 ^ (a & b),)),
+    'Not': ({'in': 1}, {'out': 1}, lambda x: (1 ^ x,)),
+    'And': ({'a': 1, 'b': 1}, {'out': 1}, lambda a, b: (a & b,)),
+    'Or': ({'a': 1, 'b': 1}, {'out': 1}, lambda a, b: (a | b,)),
+    'Xor': ({'a': 1, 'b': 1}, {'out': 1}, lambda a, b: (a ^ b,)),
+    'Mux': ({'a': 1, 'b': 1, 'sel': 1}, {'out': 1}, lambda a, b, sel: (b if sel else a,)),
+    'DMux': ({'in': 1, 'sel': 1}, {'a': 1, 'b': 1},
+             lambda x, sel: (0, x) if sel else (x, 0)),
+    'Not16': ({'in': 16}, {'out': 16}, lambda x: (x ^ 0xFFFF,)),
+    'And16': ({'a': 16, 'b': 16}, {'out': 16}, lambda a, b: (a & b,)),
+    'Or16': ({'a': 16, 'b': 16}, {'out': 16}, lambda a, b: (a | b,)),
+    'Mux16': ({'a': 16, 'b': 16, 'sel': 1}, {'out': 16}, lambda a, b, sel: (b if sel else a,)),
+    'Or8Way': ({'in': 8}, {'out': 1}, lambda x: (1 if x else 0,)),
+    'Mux4Way16': ({'a': 16, 'b': 16, 'c': 16, 'd': 16, 'sel': 2}, {'out': 16},
+                  lambda a, b, c, d, sel: ((a, b, c, d)[sel],)),
+    'Mux8Way16': ({'a': 16, 'b': 16, 'c': 16, 'd': 16, 'e': 16, 'f': 16, 'g': 16, 'h': 16,
+                   'sel': 3}, {'out': 16},
+                  lambda a, b, c, d, e, f, g, h, sel: ((a, b, c, d, e, f, g, h)[sel],)),
+    'DMux4Way': ({'in': 1, 'sel': 2}, {'a': 1, 'b': 1, 'c': 1, 'd': 1},
+                 lambda x, sel: tuple(x if i == sel else 0 for i in range(4))),
+    'DMux8Way': ({'in': 1, 'sel': 3},
+                 {'a': 1, 'b': 1, 'c': 1, 'd': 1, 'e': 1, 'f': 1, 'g': 1, 'h': 1},
+                 lambda x, sel: tuple(x if i == sel else 0 for i in range(8))),
+    'HalfAdder': ({'a': 1, 'b': 1}, {'sum': 1, 'carry': 1}, lambda a, b: (a ^ b, a & b)),
+    'FullAdder': ({'a': 1, 'b': 1, 'c': 1}, {'sum': 1, 'carry': 1},
+                  lambda a, b, c: (a ^ b ^ c, (a + b + c) >> 1)),
+    'Add16': ({'a': 16, 'b': 16}, {'out': 16}, lambda a, b: ((a + b) & 0xFFFF,)),
+    'Inc16': ({'in': 16}, {'out': 16}, lambda x: ((x + 1) & 0xFFFF,)),
+}
+
+
+def alu(x, y, zx, nx, zy, ny, f, no):
+    if zx:
+        x = 0
+    if nx:
+        x ^= 0xFFFF
+    if zy:
+        y = 0
+    if ny:
+        y ^= 0xFFFF
+    out = (x + y) & 0xFFFF if f else x & y
+    if no:
+        out ^= 0xFFFF
+    return out, 1 if out == 0 else 0, out >> 15
+
+
+COMBINATIONAL['ALU'] = ({'x': 16, 'y': 16, 'zx': 1, 'nx': 1, 'zy': 1, 'ny': 1, 'f': 1, 'no': 1},
+                        {'out': 16, 'zr': 1, 'ng': 1}, alu)
+
+# expressions the code generator inlines instead of calling the function
+# above, per output pin, over the input pins. anything missing (the ALU)
+# is called through its function.
+INLINE = {
+    'Nand': {'out': '1 ^ ({a} & {b})'},
+    'Not': {'out': '1 ^ {in}'},
+    'And': {'out': '{a} & {b}'},
+    'Or': {'out': '{a} | {b}'},
+    'Xor': {'out': '{a} ^ {b}'},
+    'Mux': {'out': '{b} if {sel} else {a}'},
+    'DMux': {'a': '0 if {sel} else {in}', 'b': '{in} if {sel} else 0'},
+    'Not16': {'out': '{in} ^ 65535'},
+    'And16': {'out': '{a} & {b}'},
+    'Or16': {'out': '{a} | {b}'},
+    'Mux16': {'out': '{b} if {sel} else {a}'},
+    'Or8Way': {'out': '1 if {in} else 0'},
+    'Mux4Way16': {'out': '({a}, {b}, {c}, {d})[{sel}]'},
+    'Mux8Way16': {'out': '({a}, {b}, {c}, {d}, {e}, {f}, {g}, {h})[{sel}]'},
+    'DMux4Way': {pin: f'{{in}} if {{sel}} == {i} else 0' for i, pin in enumerate('abcd')},
+    'DMux8Way': {pin: f'{{in}} if {{sel}} == {i} else 0' for i, pin in enumerate('abcdefgh')},
+    'HalfAdder': {'sum': '{a} ^ {b}', 'carry': '{a} & {b}'},
+    'FullAdder': {'sum': '{a} ^ {b} ^ {c}', 'carry': '({a} + {b} + {c}) >> 1'},
+    'Add16': {'out': '({a} + {b}) & 65535'},
+    'Inc16': {'out': '({in} + 1) & 65535'},
+}
+
+
+class Clocked:
+    # base for chips with state; outputs only read the inputs in 'reads'
+    #
+    # evalCode / tickCode / tockCode are what the code generator inlines,
+    # with {s} the instance, {m} its memory array and {pin} the inputs;
+    # None falls back to calling the method
+    inputs = {}
+    outputs = {}
+    reads = ()
+    evalCode = '{s}.value'
+    tickCode = None
+    tockCode = '{s}.value = {s}.next'
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.value = 0
+        self.next = 0
+
+    def eval(self, *ins):
+        return (self.value,)
+
+    def tick(self, *ins):
+        pass
+
+    def tock(self):
+        self.value = self.next
+
+    # tst access to the chip's state, e.g. DRegister[] or RAM16K[5]
+    def peek(self, index=None):
+        return self.value
+
+    def poke(self, value, index=None):
+        self.value = self.next = value & mask(16)
+
+
+class DFF(Clocked):
+    inputs = {'in': 1}
+    outputs = {'out': 1}
+    tickCode = '{s}.next = {in}'
+
+    def tick(self, x):
+        self.next = x
+
+
+class Bit(Clocked):
+    inputs = {'in': 1, 'load': 1}
+    outputs = {'out': 1}
+    tickCode = '{s}.next = {in} if {load} else {s}.value'
+
+    def tick(self, x, load):
+        self.next = x if load else self.value
+
+
+class Register(Clocked):
+    inputs = {'in': 16, 'load': 1}
+    outputs = {'out': 16}
+    tickCode = '{s}.next = {in} if {load} else {s}.value'
+
+    def tick(self, x, load):
+        self.next = x if load else self.value
+
+
+class ARegister(Register):
+    pass
+
+
+class DRegister(Register):
+    pass
+
+
+class PC(Clocked):
+    inputs = {'in': 16, 'load': 1, 'inc': 1, 'reset': 1}
+    outputs = {'out': 16}
+    tickCode = ('{s}.next = 0 if {reset} else {in} if {load} else '
+                '({s}.value + 1) & 65535 if {inc} else {s}.value')
+
+    def tick(self, x, load, inc, reset):
+        if reset:
+            self.next = 0
+        elif load:
+            self.next = x
+        elif inc:
+            self.next = (self.value + 1) & 0xFFFF
+        else:
+            self.next = self.value
+
+
+class Memory(Clocked):
+    # RAMn, Screen, ROM32K: out follows the address, writes land on tock
+    size = 0
+    evalCode = '{m}[{address}]'
+    tickCode = '{s}.pending = ({address}, {in}) if {load} else None'
+    tockCode = None
+
+    def reset(self):
+        self.memory = array('H', bytes(2 * self.size))
+        self.pending = None
+
+    def eval(self, *ins):
+        return (self.memory[ins[-1]],)
+
+    def tick(self, x, load, address):
+        self.pending = (address, x) if load else None
+
+    def tock(self):
+        if self.pending:
+            address, value = self.pending
+            self.memory[address] = value
+            self.pending = None
+
+    def peek(self, index=0):
+        return self.memory[index]
+
+    def poke(self, value, index=0):
+        self.memory[index] = value & 0xFFFF
+
+
+def ramClass(name, bits):
+    return type(name, (Memory,), {
+        'inputs': {'in': 16, 'load': 1, 'address': bits},
+        'outputs': {'out': 16},
+        'reads': ('address',),
+        'size': 1 << bits,
+    })
+
+
+class ROM32K(Memory):
+    inputs = {'address': 15}
+    outputs = {'out': 16}
+    reads = ('address',)
+    size = 32768
+    tickCode = ''
+    tockCode = ''
+
+    def tick(self, address):
+        pass
+
+    def tock(self):
+        pass
+
+    def load(self, words):
+        self.memory[:len(words)] = array('H', [word & 0xFFFF for word in words])
+
+
+class Keyboard(Clocked):
+    inputs = {}
+    outputs = {'out': 16}
+    tickCode = ''
+    tockCode = ''
+
+
+CLOCKED = {
+    'DFF': DFF,
+    'Bit': Bit,
+    'Register': Register,
+    'ARegister': ARegister,
+    'DRegister': DRegister,
+    'PC': PC,
+    'RAM8': ramClass('RAM8', 3),
+    'RAM64': ramClass('RAM64', 6),
+    'RAM512': ramClass('RAM512', 9),
+    'RAM4K': ramClass('RAM4K', 12),
+    'RAM16K': ramClass('RAM16K', 14),
+    'Screen': ramClass('Screen', 13),
+    'Keyboard': Keyboard,
+    'ROM32K': ROM32K,
+}
+
+
+class Library:
+    # finds chips: .hdl files in the search directories, then builtins
+    #
+    # like the java simulator, a chip's parts come from its own directory
+    # when there is an .hdl for them and are builtin otherwise, so 05/CPU
+    # runs on builtin ALU/PC rather than on 02/ and 03/ down to Nand.
+    # extra directories put other projects' chips in play.
+
+    def __init__(self, directories=()):
+        self.directories = list(directories)
+        self.cache = {}
+
+    def find(self, name):
+        # a ChipDef, or the builtin's entry, for a chip name
+        if name in self.cache:
+            return self.cache[name]
+        for directory in self.directories:
+            path = os.path.join(directory, name + '.hdl')
+            if os.path.isfile(path):
+                with open(path) as file:
+                    chip = parseHDL(file.read(), path)
+                if chip.name != name:
+                    raise HDLError(f"{path} defines CHIP {chip.name}, expected {name}")
+                self.cache[name] = chip
+                return chip
+        if name in COMBINATIONAL or name in CLOCKED:
+            self.cache[name] = name
+            return name
+        raise HDLError(f"chip '{name}' not found")
+
+    def pins(self, name):
+        # (inputs, outputs) widths of any chip
+        chip = self.find(name)
+        if isinstance(chip, ChipDef):
+            return chip.inputs, chip.outputs
+        if chip in COMBINATIONAL:
+            return COMBINATIONAL[chip][:2]
+        return CLOCKED[chip].inputs, CLOCKED[chip].outputs
+
+
+# a signal is a list of pieces (net, netLo, width, pinLo): bits
+# pinLo..pinLo+width-1 of the pin live in bits netLo.. of net.
+# net None is a constant, netLo then holds its value.
+
+def sliceSignal(pieces, lo, width):
+    # the pieces covering bits lo..lo+width-1, renumbered from 0
+    result = []
+    for net, netLo, size, pinLo in pieces:
+        start = max(lo, pinLo)
+        end = min(lo + width, pinLo + size)
+        if start >= end:
+            continue
+        if net is None:
+            value = (netLo >> (start - pinLo)) & mask(end - start)
+            result.append((None, value, end - start, start - lo))
+        else:
+            result.append((net, netLo + start - pinLo, end - start, start - lo))
+    return result
+
+
+def constant(value, width):
+    return [(None, mask(width) if value else 0, width, 0)]
+
+
+class Gate:
+    # one builtin instance in the flat netlist
+
+    __slots__ = ('name', 'path', 'function', 'state', 'sources', 'sinks', 'reads')
+
+    def __init__(self, name, path, function, state, sources, sinks, reads):
+        self.name = name
+        self.path = path  # e.g. 'CPU.ALU' for error messages and lookups
+        self.function = function  # combinational function, or None
+        self.state = state  # Clocked instance, or None
+        self.sources = sources  # per input pin, list of pieces
+        self.sinks = sinks  # per output pin, list of pieces
+        self.reads = reads  # input indexes the outputs depend on
+
+
+class Netlist:
+    # a chip flattened down to builtin gates over numbered nets
+
+    def __init__(self, name, library):
+        self.library = library
+        self.widths = []
+        self.gates = []
+        inputs, outputs = library.pins(name)
+        self.inputs = {}
+        self.outputs = {}
+        scope = {}
+        for pin, width in inputs.items():
+            net = self.newNet(width)
+            self.inputs[pin] = net
+            scope[pin] = [(net, 0, width, 0)]
+        sinks = {}
+        for pin, width in outputs.items():
+            net = self.newNet(width)
+            self.outputs[pin] = net
+            sinks[pin] = [(net, 0, width, 0)]
+        self.expand(name, name, scope, sinks, (name,))
+        self.order = self.sort()
+
+    def newNet(self, width):
+        self.widths.append(width)
+        return len(self.widths) - 1
+
+    def expand(self, name, path, sources, sinks, stack):
+        # add the gates of chip 'name' whose inputs read 'sources' and
+        # whose outputs write 'sinks' (both pin -> pieces)
+        chip = self.library.find(name)
+        if not isinstance(chip, ChipDef):
+            self.addBuiltin(chip, path, sources, sinks)
+            return
+
+        # internal pins are defined by the part outputs that write them
+        internal = {}
+        for partName, connections in chip.parts:
+            if partName in stack:
+                raise HDLError(f"{chip.filename}: {partName} is used inside itself")
+            _, partOutputs = self.library.pins(partName)
+            for pin, lo, hi, signal, slo, shi in connections:
+                if pin not in partOutputs:
+                    continue
+                if signal in chip.outputs or signal in ('true', 'false'):
+                    continue
+                if signal in chip.inputs:
+                    raise HDLError(f"{chip.filename}: input pin '{signal}' cannot be written")
+                if slo is not None:
+                    raise HDLError(f"{chip.filename}: internal pin '{signal}' cannot be subscripted")
+                if signal in internal:
+                    raise HDLError(f"{chip.filename}: internal pin '{signal}' has more than one source")
+                width = partOutputs[pin] if lo is None else hi - lo + 1
+                internal[signal] = [(self.newNet(width), 0, width, 0)]
+
+        for partName, connections in chip.parts:
+            partInputs, partOutputs = self.library.pins(partName)
+            partSources = {pin: constant(0, width) for pin, width in partInputs.items()}
+            partSinks = {pin: [] for pin in partOutputs}
+            for pin, lo, hi, signal, slo, shi in connections:
+                where = f"{chip.filename}: {partName}({pin}={signal})"
+                if pin in partInputs:
+                    width = partInputs[pin]
+                    if lo is None:
+                        lo, hi = 0, width - 1
+                    if not 0 <= lo <= hi < width:
+                        raise HDLError(f"{where}: sub-bus out of range")
+                    if signal in ('true', 'false'):
+                        value = constant(signal == 'true', hi - lo + 1)
+                    else:
+                        if signal in sources:
+                            value = sources[signal]
+                            available = chip.inputs[signal]
+                        elif signal in internal:
+                            value = internal[signal]
+                            available = sum(piece[2] for piece in value)
+                        elif signal in chip.outputs:
+                            raise HDLError(f"{where}: output pin '{signal}' cannot be read")
+                        else:
+                            raise HDLError(f"{where}: '{signal}' has no source")
+                        if slo is None:
+                            slo, shi = 0, available - 1
+                        if not 0 <= slo <= shi < available:
+                            raise HDLError(f"{where}: sub-bus out of range")
+                        if shi - slo != hi - lo:
+                            raise HDLError(f"{where}: width mismatch")
+                        value = sliceSignal(value, slo, shi - slo + 1)
+                    # replace bits lo..hi of the pin with the new pieces
+                    kept = sliceSignal(partSources[pin], 0, lo) + [
+                        (net, netLo, size, pinLo + hi + 1) for net, netLo, size, pinLo
+                        in sliceSignal(partSources[pin], hi + 1, width - hi - 1)]
+                    partSources[pin] = kept + [(net, netLo, size, pinLo + lo)
+                                               for net, netLo, size, pinLo in value]
+                elif pin in partOutputs:
+                    width = partOutputs[pin]
+                    if lo is None:
+                        lo, hi = 0, width - 1
+                    if not 0 <= lo <= hi < width:
+                        raise HDLError(f"{where}: sub-bus out of range")
+                    if signal in ('true', 'false'):
+                        continue
+                    if signal in chip.outputs:
+                        target = sinks[signal]
+                        available = chip.outputs[signal]
+                        if slo is None:
+                            slo, shi = 0, available - 1
+                        if not 0 <= slo <= shi < available:
+                            raise HDLError(f"{where}: sub-bus out of range")
+                        if shi - slo != hi - lo:
+                            raise HDLError(f"{where}: width mismatch")
+                        target = sliceSignal(target, slo, shi - slo + 1)
+                    else:
+                        target = internal[signal]
+                    partSinks[pin] += [(net, netLo, size, pinLo + lo)
+                                       for net, netLo, size, pinLo in target]
+                else:
+                    raise HDLError(f"{where}: {partName} has no pin '{pin}'")
+            self.expand(partName, f"{path}.{partName}", partSources, partSinks,
+                        stack + (partName,))
+
+    def addBuiltin(self, name, path, sources, sinks):
+        if name in COMBINATIONAL:
+            inputs, outputs, function = COMBINATIONAL[name]
+            state = None
+            reads = tuple(range(len(inputs)))
+        else:
+            cls = CLOCKED[name]
+            inputs, outputs = cls.inputs, cls.outputs
+            function = None
+            state = cls()
+            reads = tuple(i for i, pin in enumerate(inputs) if pin in cls.reads)
+        self.gates.append(Gate(name, path, function, state,
+                               [sources[pin] for pin in inputs],
+                               [sinks[pin] for pin in outputs], reads))
+
+    def sort(self):
+        # gates in an order where every combinational input is computed first
+        writers = {}
+        for index, gate in enumerate(self.gates):
+            for pieces in gate.sinks:
+                for net, _, _, _ in pieces:
+                    writers.setdefault(net, []).append(index)
+
+        order = []
+        mark = [0] * len(self.gates)  # 0 new, 1 in progress, 2 done
+        for start in range(len(self.gates)):
+            if mark[start]:
+                continue
+            # iterative dfs so deep chips do not hit the recursion limit
+            stack = [(start, iter(self.dependencies(start, writers)))]
+            mark[start] = 1
+            while stack:
+                index, pending = stack[-1]
+                for dep in pending:
+                    if mark[dep] == 1:
+                        raise HDLError(f"combinational loop through {self.gates[dep].path}")
+                    if not mark[dep]:
+                        mark[dep] = 1
+                        stack.append((dep, iter(self.dependencies(dep, writers))))
+                        break
+                else:
+                    stack.pop()
+                    mark[index] = 2
+                    order.append(index)
+        return [self.gates[index] for index in order]
+
+    def dependencies(self, index, writers):
+        gate = self.gates[index]
+        deps = set()
+        for i in gate.reads:
+            for net, _, _, _ in gate.sources[i]:
+                if net is not None:
+                    deps.update(writers.get(net, ()))
+        deps.discard(index)
+        return deps
+
+
+def gather(values, pieces):
+    value = 0
+    for net, netLo, width, pinLo in pieces:
+        if net is None:
+            value |= netLo << pinLo
+        else:
+            value |= ((values[net] >> netLo) & ((1 << width) - 1)) << pinLo
+    return value
+
+
+def scatter(values, pieces, value, widths):
+    for net, netLo, width, pinLo in pieces:
+        bits = (value >> pinLo) & ((1 << width) - 1)
+        if netLo == 0 and width == widths[net]:
+            values[net] = bits
+        else:
+            keep = values[net] & ~(((1 << width) - 1) << netLo)
+            values[net] = keep | (bits << netLo)
+
+
+def interpret(netlist, values):
+    # evaluate the gates one at a time, the reference for generated code
+    widths = netlist.widths
+    for gate in netlist.order:
+        ins = [gather(values, pieces) for pieces in gate.sources]
+        if gate.function is not None:
+            outs = gate.function(*ins)
+        else:
+            outs = gate.state.eval(*ins)
+        for pieces, value in zip(gate.sinks, outs):
+            scatter(values, pieces, value, widths)
+
+
+def interpretTick(netlist, values):
+    for gate in netlist.order:
+        if gate.state is not None:
+            gate.state.tick(*[gather(values, pieces) for pieces in gate.sources])
+
+
+def interpretTock(netlist):
+    for gate in netlist.order:
+        if gate.state is not None:
+            gate.state.tock()
+
+
+# code generation
+#
+# a netlist becomes three python functions: evaluate(v) runs every gate
+# in order with each net in a local n<net>, tick(v) samples the clocked
+# parts' inputs and tock() commits them. v is the list of net values,
+# only pins and the nets tick reads are written back to it.
+
+CODEGEN_VERSION = 1  # bump when the generated code changes, invalidates caches
+ATOM = re.compile(r'\w+$')
+
+# compiled chips by cache key, shared by every Simulator in the process
+COMPILED = {}
+
+
+def pieceSource(pieces, widths):
+    # python expression for the value a list of pieces gathers
+    terms = []
+    value = 0
+    for net, netLo, width, pinLo in pieces:
+        if net is None:
+            value |= netLo << pinLo
+            continue
+        term = f"n{net}"
+        if netLo:
+            term = f"({term} >> {netLo})"
+        if netLo + width < widths[net]:
+            term = f"({term} & {mask(width)})"
+        if pinLo:
+            term = f"({term} << {pinLo})"
+        terms.append(term)
+    if value or not terms:
+        terms.append(str(value))
+    return " | ".join(terms)
+
+
+def pinNames(gate):
+    # ([input pins], {output pin: width}) of a gate's builtin
+    if gate.state is not None:
+        return list(gate.state.inputs), gate.state.outputs
+    inputs, outputs, _ = COMBINATIONAL[gate.name]
+    return list(inputs), outputs
+
+
+def operands(gate, prefix, lines, widths, pins=None):
+    # {pin: atom} for the gate's inputs, spilling compound ones to locals
+    names = pinNames(gate)[0]
+    result = {}
+    for name, pieces in zip(names, gate.sources):
+        if pins is not None and name not in pins:
+            continue
+        source = pieceSource(pieces, widths)
+        if not ATOM.match(source):
+            lines.append(f"{prefix}_{name} = {source}")
+            source = f"{prefix}_{name}"
+        result[name] = source
+    return result
+
+
+def generateSource(netlist):
+    # source text of evaluate / tick / tock for a netlist
+    widths = netlist.widths
+    clocked = {id(gate): k for k, gate in enumerate(
+        gate for gate in netlist.order if gate.state is not None)}
+    inputs = set(netlist.inputs.values())
+
+    # nets with one whole-width writer are assigned, the rest start at 0
+    # and get their bits or-ed in
+    writers = {}
+    for gate in netlist.order:
+        for pieces in gate.sinks:
+            for net, netLo, width, _ in pieces:
+                writers.setdefault(net, []).append(netLo == 0 and width == widths[net])
+    partial = {net for net, whole in writers.items() if len(whole) > 1 or not whole[0]}
+
+    sampled = set()
+    for gate in netlist.order:
+        if gate.state is not None:
+            for pieces in gate.sources:
+                sampled.update(net for net, _, _, _ in pieces if net is not None)
+    kept = (set(netlist.outputs.values()) | sampled) - inputs
+
+    body = [f"n{net} = v[{net}]" for net in sorted(inputs)]
+    body += [f"n{net} = 0" for net in range(len(widths))
+             if net not in inputs and (net in partial or net not in writers)]
+    for j, gate in enumerate(netlist.order):
+        outputs = pinNames(gate)[1]
+        if gate.state is not None:
+            k = clocked[id(gate)]
+            ops = operands(gate, f"g{j}", body, widths, gate.state.reads)
+            exprs = [gate.state.evalCode.format(s=f"s{k}", m=f"m{k}", **ops)]
+        elif gate.name in INLINE:
+            ops = operands(gate, f"g{j}", body, widths)
+            exprs = [INLINE[gate.name][pin].format(**ops) for pin in outputs]
+        else:
+            ops = operands(gate, f"g{j}", body, widths)
+            body.append(f"o{j} = f{gate.name}({', '.join(ops.values())})")
+            exprs = [f"o{j}[{i}]" for i in range(len(outputs))]
+
+        for pin, expr, pieces in zip(outputs, exprs, gate.sinks):
+            if not pieces:
+                continue
+            net, netLo, width, pinLo = pieces[0]
+            if len(pieces) == 1 and net not in partial and width == outputs[pin]:
+                body.append(f"n{net} = {expr}")
+                continue
+            body.append(f"o{j}_{pin} = {expr}")
+            for net, netLo, width, pinLo in pieces:
+                bits = f"o{j}_{pin}"
+                if pinLo:
+                    bits = f"({bits} >> {pinLo})"
+                bits = f"({bits} & {mask(width)})"
+                if net in partial:
+                    body.append(f"n{net} |= {bits} << {netLo}" if netLo else f"n{net} |= {bits}")
+                else:
+                    body.append(f"n{net} = {bits}")
+    body += [f"v[{net}] = n{net}" for net in sorted(kept)]
+
+    tick = [f"n{net} = v[{net}]" for net in sorted(sampled)]
+    tock = []
+    for j, gate in enumerate(netlist.order):
+        if gate.state is None:
+            continue
+        k = clocked[id(gate)]
+        state = gate.state
+        if state.tickCode is None:
+            ops = operands(gate, f"g{j}", tick, widths)
+            tick.append(f"s{k}.tick({', '.join(ops.values())})")
+        elif state.tickCode:
+            ops = operands(gate, f"g{j}", tick, widths)
+            tick.append(state.tickCode.format(s=f"s{k}", m=f"m{k}", **ops))
+        if state.tockCode is None:
+            tock.append(f"s{k}.tock()")
+        elif state.tockCode:
+            tock.append(state.tockCode.format(s=f"s{k}", m=f"m{k}"))
+
+    lines = []
+    for header, statements in (("def evaluate(v):", body), ("def tick(v):", tick),
+                               ("def tock():", tock)):
+        lines.append(header)
+        lines += ["    " + statement for statement in statements or ["pass"]]
+        lines.append("")
+    return "\n".join(lines)
+
+
+class CompiledChip:
+    # generated code for a chip and what binding it to fresh state needs:
+    # pin nets, net widths and the (builtin, path) of every clocked part
+
+    def __init__(self, name, inputs, outputs, widths, clocked, gates, code):
+        self.name = name
+        self.inputs = inputs
+        self.outputs = outputs
+        self.widths = widths
+        self.clocked = clocked
+        self.gates = gates
+        self.code = code
+
+    @classmethod
+    def fromNetlist(cls, name, netlist):
+        source = generateSource(netlist)
+        code = compile(source, f"<hsim {name}>", 'exec')
+        clocked = [(gate.name, gate.path) for gate in netlist.order if gate.state is not None]
+        return cls(name, netlist.inputs, netlist.outputs, netlist.widths, clocked,
+                   len(netlist.gates), code)
+
+    def save(self, filename):
+        data = {'name': self.name, 'inputs': self.inputs, 'outputs': self.outputs,
+                'widths': self.widths, 'clocked': self.clocked, 'gates': self.gates,
+                'code': marshal.dumps(self.code)}
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        temporary = f"{filename}.{os.getpid()}"
+        with open(temporary, 'wb') as file:
+            pickle.dump(data, file)
+        os.replace(temporary, filename)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'rb') as file:
+            data = pickle.load(file)
+        return cls(data['name'], data['inputs'], data['outputs'], data['widths'],
+                   data['clocked'], data['gates'], marshal.loads(data['code']))
+
+    def bind(self, states):
+        # (evaluate, tick, tock) running on the given clocked part states
+        namespace = {f"f{name}": function for name, (_, _, function) in COMBINATIONAL.items()}
+        for k, state in enumerate(states):
+            namespace[f"s{k}"] = state
+            if isinstance(state, Memory):
+                namespace[f"m{k}"] = state.memory
+        exec(self.code, namespace)
+        return namespace['evaluate'], namespace['tick'], namespace['tock']
+
+
+def chipKey(name, library):
+    # hash of every .hdl the chip is built from, plus the generator version
+    digests = {}
+    pending = [name]
+    while pending:
+        chip = library.find(pending.pop())
+        if isinstance(chip, ChipDef):
+            if chip.name not in digests:
+                digests[chip.name] = chip.digest
+                pending += [part for part, _ in chip.parts]
+        else:
+            digests[chip] = 'builtin'
+    text = repr((CODEGEN_VERSION, importlib.util.MAGIC_NUMBER, name, sorted(digests.items())))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def compileChip(name, library, cache=True):
+    # CompiledChip for a chip, from memory, the __pycache__ next to its
+    # .hdl, or by flattening and generating code
+    key = chipKey(name, library)
+    if key in COMPILED:
+        return COMPILED[key]
+    top = library.find(name)
+    filename = None
+    if cache and isinstance(top, ChipDef) and top.filename:
+        filename = os.path.join(os.path.dirname(top.filename), '__pycache__',
+                                f"{name}.{key[:16]}.hsim")
+    chip = None
+    if filename and os.path.isfile(filename):
+        try:
+            chip = CompiledChip.load(filename)
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError, KeyError):
+            chip = None  # stale or damaged, regenerate
+    if chip is None:
+        chip = CompiledChip.fromNetlist(name, Netlist(name, library))
+        if filename:
+            try:
+                chip.save(filename)
+            except OSError:
+                pass  # read-only tree, keep the in-memory copy
+    COMPILED[key] = chip
+    return chip
+
+
+class Simulator:
+    # runs a chip: set inputs, eval, tick / tock, read outputs
+    #
+    # by default the whole netlist runs as generated python code; with
+    # compiled=False the flattened gates are interpreted one by one
+
+    def __init__(self, name, library, compiled=True, cache=True):
+        if compiled:
+            chip = compileChip(name, library, cache)
+            self.parts = [(part, path, CLOCKED[part]()) for part, path in chip.clocked]
+            self.evaluate, self.sample, self.commit = chip.bind(
+                [state for _, _, state in self.parts])
+        else:
+            chip = Netlist(name, library)
+            self.parts = [(gate.name, gate.path, gate.state) for gate in chip.order
+                          if gate.state is not None]
+            self.evaluate = lambda values: interpret(chip, values)
+            self.sample = lambda values: interpretTick(chip, values)
+            self.commit = lambda: interpretTock(chip)
+        self.inputs = chip.inputs
+        self.outputs = chip.outputs
+        self.widths = chip.widths
+        self.gates = chip.gates if compiled else len(chip.gates)
+        self.values = [0] * len(self.widths)
+        self.time = 0
+        self.eval()
+
+    def pinWidth(self, pin):
+        if pin in self.inputs:
+            return self.widths[self.inputs[pin]]
+        if pin in self.outputs:
+            return self.widths[self.outputs[pin]]
+        raise HDLError(f"no pin named '{pin}'")
+
+    def set(self, pin, value):
+        if pin not in self.inputs:
+            raise HDLError(f"no input pin named '{pin}'")
+        net = self.inputs[pin]
+        self.values[net] = value & mask(self.widths[net])
+
+    def get(self, pin):
+        # unsigned value of a pin
+        net = self.inputs.get(pin, self.outputs.get(pin))
+        if net is None:
+            raise HDLError(f"no pin named '{pin}'")
+        return self.values[net]
+
+    def eval(self):
+        self.evaluate(self.values)
+
+    def tick(self):
+        # first half of a cycle: clocked chips sample their inputs
+        self.evaluate(self.values)
+        self.sample(self.values)
+
+    def tock(self):
+        # second half: the sampled values appear on the outputs
+        self.commit()
+        self.time += 1
+        self.evaluate(self.values)
+
+    def part(self, name):
+        # the state of the builtin part called name (e.g. 'RAM16K', 'PC')
+        found = [(path, state) for part, path, state in self.parts if part == name]
+        if not found:
+            raise HDLError(f"no builtin part named '{name}'")
+        if len(found) > 1:
+            raise HDLError(f"more than one {name}: "
+                           + ", ".join(path for path, _ in found))
+        return found[0][1]
+
+
+def parseValue(text):
+    # decimal, or %B / %X / %D prefixed like in .tst files
+    if text[:2].upper() == '%B':
+        return int(text[2:], 2)
+    if text[:2].upper() == '%X':
+        return int(text[2:], 16)
+    if text[:2].upper() == '%D':
+        return int(text[2:])
+    return int(text)
+
+
+def main():
+    # evaluate a chip once for the given inputs
+    usage = ("Usage: python hsim.py <Chip.hdl> [-lib DIR]... [-set PIN=VALUE]... "
+             "[-ticks N] [-interpret]")
+    if len(sys.argv) < 2:
+        print(usage)
+        sys.exit(1)
+
+    inputFile = sys.argv[1]
+    if not os.path.isfile(inputFile) or not inputFile.endswith('.hdl'):
+        print(f"Error: '{inputFile}' is not an .hdl file")
+        sys.exit(1)
+
+    directories = [os.path.dirname(os.path.abspath(inputFile))]
+    sets = []
+    ticks = 0
+    compiled = True
+
+    args = sys.argv[2:]
+    i = 0
+    try:
+        while i < len(args):
+            arg = args[i]
+            if arg == '-lib':
+                directories.append(args[i + 1])
+                i += 2
+            elif arg == '-set':
+                pin, value = args[i + 1].split('=')
+                sets.append((pin, parseValue(value)))
+                i += 2
+            elif arg == '-ticks':
+                ticks = int(args[i + 1])
+                i += 2
+            elif arg == '-interpret':
+                compiled = False
+                i += 1
+            else:
+                raise ValueError(f"unknown option '{arg}'")
+    except (IndexError, ValueError) as e:
+        print(f"Error: {e}")
+        print(usage)
+        sys.exit(1)
+
+    name = os.path.splitext(os.path.basename(inputFile))[0]
+    try:
+        start = time.perf_counter()
+        simulator = Simulator(name, Library(directories), compiled)
+        built = time.perf_counter() - start
+        for pin, value in sets:
+            simulator.set(pin, value)
+        simulator.eval()
+        start = time.perf_counter()
+        for _ in range(ticks):
+            simulator.tick()
+            simulator.tock()
+        elapsed = time.perf_counter() - start
+    except HDLError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    print(f"{name}: {simulator.gates} builtin gates, {len(simulator.widths)} nets, "
+          f"built in {built:.3f}s")
+    if ticks:
+        print(f"{ticks} cycles in {elapsed:.3f}s ({ticks / elapsed:.0f} cycles/s)")
+    for pin in list(simulator.inputs) + list(simulator.outputs):
+        width = simulator.pinWidth(pin)
+        value = simulator.get(pin)
+        print(f"{pin} = {value:0{width}b} ({value})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,510 @@
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from hsim import HDLError, Library, Simulator, mask, parseValue
+
+# the cpu emulator and assembler live with project 6
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '06'))
+from hemu import Emulator, loadProgram, wrap  # noqa: E402
+
+# script tokens: quoted strings, separators, braces and plain words
+SCRIPT_TOKEN = re.compile(r'\s+|//[^\n]*|/\*.*?\*/|("[^"]*")|([,;!{}])|([^\s,;!{}"]+)', re.S)
+
+# variables: a pin or register name, optionally indexed, e.g. RAM16K[3] or PC[]
+VARIABLE = re.compile(r'([A-Za-z_]\w*)(?:\[(\d*)\])?$')
+
+# output-list entries: name%Fleft.width.right
+COLUMN = re.compile(r'(.+)%([BXDS])(\d+)\.(\d+)\.(\d+)$')
+
+CONDITIONS = {
+    '=': lambda x, y: x == y,
+    '<>': lambda x, y: x != y,
+    '<': lambda x, y: x < y,
+    '>': lambda x, y: x > y,
+    '<=': lambda x, y: x <= y,
+    '>=': lambda x, y: x >= y,
+}
+
+
+class TestError(Exception):
+    # raised for scripts that cannot be run
+    pass
+
+
+class Command:
+    # one script command: its words and where it came from
+    def __init__(self, words, line):
+        self.words = words
+        self.line = line
+
+
+class Loop:
+    # repeat N { ... }, repeat { ... } or while a <op> b { ... }
+    def __init__(self, count, condition, body, line):
+        self.count = count
+        self.condition = condition
+        self.body = body
+        self.line = line
+
+
+def parseScript(text, filename='<tst>'):
+    # parse a .tst script into a list of Commands and Loops
+    tokens = []
+    pos = 0
+    while pos < len(text):
+        match = SCRIPT_TOKEN.match(text, pos)
+        if not match:
+            line = text.count('\n', 0, pos) + 1
+            raise TestError(f"{filename}:{line}: unexpected '{text[pos]}'")
+        token = match.group(1) or match.group(2) or match.group(3)
+        if token:
+            tokens.append((token, text.count('\n', 0, pos) + 1))
+        pos = match.end()
+
+    def block(pos, nested):
+        commands = []
+        words = []
+        line = None
+        while pos < len(tokens):
+            token, tokenLine = tokens[pos]
+            pos += 1
+            if token in ',;!':
+                if words:
+                    commands.append(Command(words, line))
+                words = []
+            elif token == '{':
+                commands.append(loopHeader(words, line or tokenLine))
+                commands[-1].body, pos = block(pos, True)
+                words = []
+            elif token == '}':
+                if not nested:
+                    raise TestError(f"{filename}:{tokenLine}: unmatched '}}'")
+                if words:
+                    commands.append(Command(words, line))
+                return commands, pos
+            else:
+                if not words:
+                    line = tokenLine
+                words.append(token)
+        if nested:
+            raise TestError(f"{filename}: missing '}}'")
+        if words:
+            commands.append(Command(words, line))
+        return commands, pos
+
+    def loopHeader(words, line):
+        if words[:1] == ['repeat'] and len(words) <= 2:
+            return Loop(int(words[1]) if len(words) == 2 else None, None, None, line)
+        if words[:1] == ['while'] and len(words) == 4 and words[2] in CONDITIONS:
+            return Loop(None, words[1:], None, line)
+        raise TestError(f"{filename}:{line}: bad loop '{' '.join(words)}'")
+
+    return block(0, False)[0]
+
+
+def findFile(name, directories):
+    # a file from the script's directory or the -lib directories;
+    # a missing .hack is assembled from a .asm of the same name
+    for directory in directories:
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            return path
+    if name.endswith('.hack'):
+        return findFile(name[:-5] + '.asm', directories)
+    raise TestError(f"'{name}' not found")
+
+
+def signed(value, width):
+    # 16-bit buses print as two's complement in %D
+    if width == 16 and value & 0x8000:
+        return value - 0x10000
+    return value
+
+
+class Column:
+    # one output-list entry and how to print it
+
+    def __init__(self, text, bits):
+        # bits(name) gives the width used when no format is given
+        match = COLUMN.match(text)
+        if match:
+            self.name, self.format = match.group(1), match.group(2)
+            self.left, self.width, self.right = (int(match.group(i)) for i in (3, 4, 5))
+        elif '%' not in text:
+            self.name, self.format = text, 'B'
+            self.left, self.width, self.right = 1, bits(text), 1
+        else:
+            raise TestError(f"bad output-list entry '{text}'")
+
+    def header(self):
+        space = self.left + self.width + self.right
+        name = self.name[:space]
+        before = (space - len(name)) // 2
+        return ' ' * before + name + ' ' * (space - before - len(name))
+
+    def cell(self, value, bits):
+        width = self.width
+        if self.format == 'S':
+            text = str(value).ljust(width)
+        elif self.format == 'B':
+            text = format(value & mask(bits), 'b').zfill(width)[-width:]
+        elif self.format == 'X':
+            text = format(value & mask(bits), 'X').zfill(width)[-width:]
+        else:
+            text = str(signed(value & mask(bits), bits)).rjust(width)
+        return ' ' * self.left + text + ' ' * self.right
+
+
+class HDLTarget:
+    # drives hsim for 'load Chip.hdl' scripts
+
+    def __init__(self, path, directories):
+        name = os.path.splitext(os.path.basename(path))[0]
+        self.directories = directories
+        self.simulator = Simulator(name, Library([os.path.dirname(path)] + directories[1:]))
+        self.half = False
+
+    def time(self):
+        return f"{self.simulator.time}+" if self.half else str(self.simulator.time)
+
+    def get(self, variable):
+        # (value, bits) of a pin, a pin bit or a builtin part's state
+        name, index = self.split(variable)
+        simulator = self.simulator
+        if name in simulator.inputs or name in simulator.outputs:
+            if index:
+                return (simulator.get(name) >> int(index)) & 1, 1
+            return simulator.get(name), simulator.pinWidth(name)
+        part = simulator.part(name)
+        bits = list(part.outputs.values())[0] if part.outputs else 16
+        return part.peek(int(index) if index else None), bits
+
+    def set(self, variable, value):
+        name, index = self.split(variable)
+        simulator = self.simulator
+        if name in simulator.inputs:
+            if index:
+                bit = 1 << int(index)
+                old = simulator.get(name)
+                value = old | bit if value & 1 else old & ~bit
+            simulator.set(name, value)
+        else:
+            simulator.part(name).poke(value, int(index) if index else None)
+
+    def split(self, variable):
+        match = VARIABLE.match(variable)
+        if not match:
+            raise TestError(f"bad variable '{variable}'")
+        return match.group(1), match.group(2)
+
+    def command(self, words):
+        simulator = self.simulator
+        if words == ['eval']:
+            simulator.eval()
+        elif words == ['tick']:
+            simulator.tick()
+            self.half = True
+        elif words == ['tock']:
+            simulator.tock()
+            self.half = False
+        elif words == ['ticktock']:
+            simulator.tick()
+            simulator.tock()
+            self.half = False
+        elif len(words) == 3 and words[1] == 'load':
+            # builtin part command, e.g. ROM32K load Max.hack
+            part = simulator.part(words[0])
+            if not hasattr(part, 'load'):
+                raise TestError(f"{words[0]} cannot load programs")
+            part.load(loadProgram(findFile(words[2], self.directories)))
+            simulator.eval()
+        else:
+            return False
+        return True
+
+
+class CPUTarget:
+    # drives the hemu cpu emulator for 'load Prog.asm' / 'load Prog.hack'
+
+    REGISTERS = ('A', 'D', 'PC')
+
+    def __init__(self, path, directories):
+        self.emulator = Emulator(loadProgram(path), engine='interp')
+        self.ticks = 0
+        self.half = False
+
+    def time(self):
+        return f"{self.ticks}+" if self.half else str(self.ticks)
+
+    def get(self, variable):
+        emulator = self.emulator
+        if variable in self.REGISTERS:
+            return getattr(emulator, variable.lower()), 16
+        match = VARIABLE.match(variable)
+        if match and match.group(2) and match.group(1) in ('RAM', 'ROM'):
+            memory = emulator.ram if match.group(1) == 'RAM' else emulator.rom
+            return memory[int(match.group(2)) & 0x7FFF], 16
+        raise TestError(f"unknown variable '{variable}'")
+
+    def set(self, variable, value):
+        emulator = self.emulator
+        if variable == 'PC':
+            emulator.pc = value & 0x7FFF
+        elif variable in self.REGISTERS:
+            setattr(emulator, variable.lower(), wrap(value))
+        else:
+            match = VARIABLE.match(variable)
+            if not (match and match.group(2) and match.group(1) == 'RAM'):
+                raise TestError(f"unknown variable '{variable}'")
+            emulator.ram[int(match.group(2)) & 0x7FFF] = wrap(value)
+
+    def command(self, words):
+        if words == ['tick']:
+            self.half = True
+        elif words in (['tock'], ['ticktock']):
+            if self.emulator.pc < len(self.emulator.program):
+                self.emulator.interpret(1)
+            self.ticks += 1
+            self.half = False
+        else:
+            return False
+        return True
+
+
+class TestRun:
+    # executes one script, comparing every output line as it is produced
+
+    def __init__(self, path, directories=(), limit=1000000):
+        self.path = path
+        self.directory = os.path.dirname(os.path.abspath(path))
+        self.directories = [self.directory] + list(directories)
+        self.limit = limit
+        self.target = None
+        self.outputName = None
+        self.compare = None
+        self.columns = []
+        self.lines = []
+        self.echoes = []
+
+    def run(self):
+        # returns None when every compared line matched, else the failure
+        with open(self.path) as file:
+            script = parseScript(file.read(), self.path)
+        return self.execute(script)
+
+    def execute(self, commands):
+        for command in commands:
+            if isinstance(command, Loop):
+                iterations = 0
+                while True:
+                    if command.count is not None:
+                        if iterations == command.count:
+                            break
+                    elif command.condition is not None and not self.holds(command.condition):
+                        break
+                    elif iterations >= self.limit:
+                        raise TestError(f"line {command.line}: loop still running after "
+                                        f"{self.limit} iterations (waiting for input?)")
+                    failure = self.execute(command.body)
+                    if failure:
+                        return failure
+                    iterations += 1
+            else:
+                failure = self.step(command)
+                if failure:
+                    return failure
+        return None
+
+    def holds(self, condition):
+        left, op, right = condition
+        return CONDITIONS[op](self.value(left), self.value(right))
+
+    def value(self, text):
+        try:
+            return parseValue(text)
+        except ValueError:
+            value, bits = self.variable(text)
+            return signed(value & mask(bits), bits)
+
+    def variable(self, name):
+        if self.target is None:
+            raise TestError("no program or chip loaded")
+        if name == 'time':
+            return self.target.time(), 0
+        return self.target.get(name)
+
+    def step(self, command):
+        words = command.words
+        name = words[0]
+        if name == 'load':
+            if len(words) < 2:
+                raise TestError("vm emulator scripts are not supported")
+            path = findFile(words[1], self.directories)
+            if path.endswith('.hdl'):
+                self.target = HDLTarget(path, self.directories)
+            elif path.endswith(('.asm', '.hack')):
+                self.target = CPUTarget(path, self.directories)
+            else:
+                raise TestError("vm emulator scripts are not supported")
+        elif name == 'output-file':
+            self.outputName = words[1]
+        elif name == 'compare-to':
+            path = os.path.join(self.directory, words[1])
+            if os.path.isfile(path):
+                with open(path) as file:
+                    self.compare = [line.rstrip() for line in file]
+        elif name == 'output-list':
+            self.columns = [Column(text, lambda name: self.variable(name)[1])
+                            for text in words[1:]]
+            return self.emit('|' + '|'.join(column.header() for column in self.columns) + '|',
+                             command)
+        elif name == 'output':
+            cells = []
+            for column in self.columns:
+                value, bits = self.variable(column.name)
+                cells.append(column.cell(value, bits))
+            return self.emit('|' + '|'.join(cells) + '|', command)
+        elif name == 'set':
+            if len(words) != 3:
+                raise TestError(f"line {command.line}: set needs a variable and a value")
+            if self.target is None:
+                raise TestError("no program or chip loaded")
+            self.target.set(words[1], parseValue(words[2]))
+        elif name == 'echo':
+            self.echoes.append(' '.join(words[1:]).strip('"'))
+        elif name in ('clear-echo', 'breakpoint', 'clear-breakpoints'):
+            pass
+        elif self.target is None or not self.target.command(words):
+            raise TestError(f"line {command.line}: unknown command '{' '.join(words)}'")
+        return None
+
+    def emit(self, line, command):
+        # record an output line and check it against the .cmp
+        self.lines.append(line)
+        if self.compare is None:
+            return None
+        number = len(self.lines)
+        if number > len(self.compare):
+            return f"line {number} has no counterpart in the compare file"
+        expected = self.compare[number - 1]
+        actual = line.rstrip()
+        if len(expected) != len(actual) or any(e != a and e != '*'
+                                               for e, a in zip(expected, actual)):
+            return (f"comparison failure at line {number} (script line {command.line})\n"
+                    f"  expected {expected}\n  got      {actual}")
+        return None
+
+
+def runScript(job):
+    # worker: run one script, returns (path, status, message, seconds)
+    path, directories, outDir, limit = job
+    start = time.perf_counter()
+    run = TestRun(path, directories, limit)
+    try:
+        failure = run.run()
+    except (TestError, HDLError, ValueError, KeyError, OSError) as e:
+        status, message = ('skip' if 'not supported' in str(e) else 'error'), str(e)
+    else:
+        if failure:
+            status, message = 'fail', failure
+        elif run.compare is None:
+            status, message = 'ran', f"{len(run.lines)} lines, no compare file"
+        else:
+            status, message = 'pass', f"{len(run.lines)} lines"
+    if outDir and run.outputName and run.lines:
+        with open(os.path.join(outDir, run.outputName), 'w') as file:
+            file.write('\n'.join(run.lines) + '\n')
+    return path, status, message, time.perf_counter() - start
+
+
+def listScripts(inputPath):
+    # a .tst file, or every .tst under a directory in path order
+    if os.path.isfile(inputPath):
+        return [inputPath]
+    scripts = []
+    for root, _, files in os.walk(inputPath):
+        scripts += [os.path.join(root, f) for f in files if f.endswith('.tst')]
+    return sorted(scripts)
+
+
+def main():
+    # run .tst scripts in parallel and summarize
+    usage = ("Usage: python htst.py <file.tst|directory>... [-lib DIR]... [-j N] "
+             "[-out DIR] [-limit N]")
+    if len(sys.argv) < 2:
+        print(usage)
+        sys.exit(1)
+
+    inputs = []
+    directories = []
+    jobs = os.cpu_count() or 1
+    outDir = None
+    limit = 1000000
+
+    args = sys.argv[1:]
+    i = 0
+    try:
+        while i < len(args):
+            arg = args[i]
+            if arg == '-lib':
+                directories.append(os.path.abspath(args[i + 1]))
+                i += 2
+            elif arg == '-j':
+                jobs = int(args[i + 1])
+                i += 2
+            elif arg == '-out':
+                outDir = args[i + 1]
+                i += 2
+            elif arg == '-limit':
+                limit = int(args[i + 1])
+                i += 2
+            elif arg.startswith('-'):
+                raise ValueError(f"unknown option '{arg}'")
+            else:
+                if not os.path.exists(arg):
+                    raise ValueError(f"path '{arg}' not found")
+                inputs.append(arg)
+                i += 1
+    except (IndexError, ValueError) as e:
+        print(f"Error: {e}")
+        print(usage)
+        sys.exit(1)
+
+    scripts = [script for path in inputs for script in listScripts(path)]
+    if not scripts:
+        print("Error: no .tst files found")
+        sys.exit(1)
+    if outDir:
+        os.makedirs(outDir, exist_ok=True)
+
+    start = time.perf_counter()
+    work = [(script, directories, outDir, limit) for script in scripts]
+    if jobs > 1 and len(scripts) > 1:
+        with ProcessPoolExecutor(jobs) as pool:
+            results = list(pool.map(runScript, work))
+    else:
+        results = [runScript(job) for job in work]
+    elapsed = time.perf_counter() - start
+
+    counts = {}
+    for path, status, message, seconds in results:
+        counts[status] = counts.get(status, 0) + 1
+        print(f"{status.upper():5} {seconds:7.3f}s  {path}")
+        if status in ('fail', 'error'):
+            for line in message.splitlines():
+                print(f"              {line}")
+
+    busy = sum(result[3] for result in results)
+    summary = ", ".join(f"{counts[status]} {status}" for status in
+                        ('pass', 'fail', 'error', 'ran', 'skip') if status in counts)
+    print(f"\n{len(results)} scripts: {summary} "
+          f"in {elapsed:.3f}s ({busy:.3f}s of work on {jobs} workers)")
+    if counts.get('fail') or counts.get('error'):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+from hsim import COMBINATIONAL, HDLError, Library, Netlist, gather, mask, scatter
+
+
+def vectorAlu(x, y, zx, nx, zy, ny, f, no):
+    x = np.where(zx, 0, x)
+    x = np.where(nx, x ^ 0xFFFF, x)
+    y = np.where(zy, 0, y)
+    y = np.where(ny, y ^ 0xFFFF, y)
+    out = np.where(f, (x + y) & 0xFFFF, x & y)
+    out = np.where(no, out ^ 0xFFFF, out)
+    return out, (out == 0).astype(np.int64), out >> 15
+
+
+def select(sel, *choices):
+    # choices[sel] per lane, sel and the choices may be plain ints
+    return np.choose(np.asarray(sel), np.broadcast_arrays(*choices))
+
+
+# the builtin functions over numpy int64 lanes. the ones in hsim that only
+# use bitwise operators already work on arrays; these replace the ones
+# that branch on a value
+VECTOR = dict((name, function) for name, (_, _, function) in COMBINATIONAL.items())
+VECTOR.update({
+    'Mux': lambda a, b, sel: (np.where(sel, b, a),),
+    'DMux': lambda x, sel: (x & (sel ^ 1), x & sel),
+    'Mux16': lambda a, b, sel: (np.where(sel, b, a),),
+    'Or8Way': lambda x: ((np.asarray(x) != 0).astype(np.int64),),
+    'Mux4Way16': lambda a, b, c, d, sel: (select(sel, a, b, c, d),),
+    'Mux8Way16': lambda a, b, c, d, e, f, g, h, sel: (select(sel, a, b, c, d, e, f, g, h),),
+    'DMux4Way': lambda x, sel: tuple(x * (np.asarray(sel) == i) for i in range(4)),
+    'DMux8Way': lambda x, sel: tuple(x * (np.asarray(sel) == i) for i in range(8)),
+    'ALU': vectorAlu,
+})
+
+
+class TruthTable:
+    # evaluates a combinational chip on many input combinations at once
+    #
+    # every net holds one int64 lane per combination, so a single pass
+    # over the flattened gates computes the whole table. nets are dropped
+    # after their last reader to keep wide chips within memory.
+
+    def __init__(self, name, library):
+        self.name = name
+        self.netlist = netlist = Netlist(name, library)
+        clocked = [gate.path for gate in netlist.gates if gate.state is not None]
+        if clocked:
+            raise HDLError(f"{name} is not combinational ({clocked[0]} is clocked)")
+        self.inputs, self.outputs = library.pins(name)
+
+        lastRead = {}
+        for index, gate in enumerate(netlist.order):
+            for pieces in gate.sources:
+                for net, _, _, _ in pieces:
+                    if net is not None:
+                        lastRead[net] = index
+        kept = set(netlist.outputs.values())
+        self.release = [[] for _ in netlist.order]
+        for net, index in lastRead.items():
+            if net not in kept:
+                self.release[index].append(net)
+
+    def bits(self):
+        return sum(self.inputs.values())
+
+    def lanes(self, maxBits=20, seed=0):
+        # {pin: array} of every input combination, pins in declaration
+        # order from the low bits up; chips with more input bits than
+        # maxBits get 2**maxBits random combinations instead
+        n = self.bits()
+        if n <= maxBits:
+            index = np.arange(1 << n, dtype=np.int64)
+            lanes = {}
+            for pin, width in self.inputs.items():
+                lanes[pin] = index & mask(width)
+                index = index >> width
+            return lanes, True
+        rng = np.random.default_rng(seed)
+        return {pin: rng.integers(0, 1 << width, 1 << maxBits, dtype=np.int64)
+                for pin, width in self.inputs.items()}, False
+
+    def evaluate(self, lanes):
+        # {output pin: array} for {input pin: array}
+        netlist = self.netlist
+        values = [0] * len(netlist.widths)
+        for pin, net in netlist.inputs.items():
+            values[net] = lanes[pin]
+        for gate, release in zip(netlist.order, self.release):
+            outs = VECTOR[gate.name](*[gather(values, pieces) for pieces in gate.sources])
+            for net in release:
+                values[net] = 0
+            for pieces, value in zip(gate.sinks, outs):
+                scatter(values, pieces, value, netlist.widths)
+        size = len(next(iter(lanes.values()))) if lanes else 1
+        return {pin: np.broadcast_to(np.asarray(values[net], dtype=np.int64), (size,))
+                for pin, net in netlist.outputs.items()}
+
+
+def reference(name, lanes):
+    # outputs of the builtin chip of the same name, or None
+    if name not in VECTOR:
+        return None
+    inputs, outputs, _ = COMBINATIONAL[name]
+    size = len(next(iter(lanes.values())))
+    outs = VECTOR[name](*[lanes[pin] for pin in inputs])
+    return {pin: np.broadcast_to(np.asarray(out, dtype=np.int64), (size,))
+            for pin, out in zip(outputs, outs)}
+
+
+def parseCell(text, width):
+    # a .cmp value: binary when it has the pin's width in 0/1 digits,
+    # decimal otherwise; None for '*' don't cares
+    text = text.strip()
+    if not text or '*' in text:
+        return None
+    if width > 1 and len(text) == width and set(text) <= {'0', '1'}:
+        return int(text, 2)
+    return int(text) & mask(width)
+
+
+def readCompare(filename, inputs, outputs):
+    # ({input: array}, {output: (array, cared)}) from a .cmp file
+    with open(filename) as file:
+        rows = [line.strip().strip('|').split('|') for line in file if line.strip()]
+    names = [name.strip() for name in rows[0]]
+    widths = {**inputs, **outputs}
+    unknown = [name for name in names if name not in widths]
+    if unknown:
+        raise HDLError(f"{filename}: column '{unknown[0]}' is not a pin")
+    missing = [pin for pin in inputs if pin not in names]
+    if missing:
+        raise HDLError(f"{filename}: no column for input '{missing[0]}'")
+    cells = {name: [parseCell(row[i], widths[name]) for row in rows[1:]]
+             for i, name in enumerate(names)}
+    lanes = {pin: np.array([value or 0 for value in cells[pin]], dtype=np.int64)
+             for pin in inputs}
+    expected = {pin: (np.array([value or 0 for value in cells[pin]], dtype=np.int64),
+                      np.array([value is not None for value in cells[pin]]))
+                for pin in outputs if pin in cells}
+    return lanes, expected
+
+
+def describe(lanes, i):
+    return ", ".join(f"{pin}={int(values[i])}" for pin, values in lanes.items())
+
+
+def check(table, lanes, expected, show=3, chunk=1 << 16):
+    # [(pin, mismatches, [examples])] for outputs differing from expected,
+    # expected maps pins to arrays or to (array, cared) pairs. lanes are
+    # evaluated chunk at a time so wide chips stay within memory
+    size = len(next(iter(lanes.values()))) if lanes else 1
+    counts = {}
+    examples = {}
+    for start in range(0, size, chunk):
+        part = {pin: values[start:start + chunk] for pin, values in lanes.items()}
+        actual = table.evaluate(part)
+        for pin, want in expected.items():
+            cared = None
+            if isinstance(want, tuple):
+                want, cared = want
+                cared = cared[start:start + chunk]
+            want = want[start:start + chunk]
+            bad = actual[pin] != want
+            if cared is not None:
+                bad &= cared
+            count = int(bad.sum())
+            if count:
+                counts[pin] = counts.get(pin, 0) + count
+                found = examples.setdefault(pin, [])
+                for i in np.flatnonzero(bad)[:show - len(found)]:
+                    found.append(f"{describe(part, i)}: {pin}={int(actual[pin][i])}, "
+                                 f"expected {int(want[i])}")
+    return [(pin, counts[pin], examples[pin]) for pin in expected if pin in counts]
+
+
+def verify(path, directories, compare=None, maxBits=20):
+    # (status, message) for one .hdl against its .cmp or the builtin model
+    name = os.path.splitext(os.path.basename(path))[0]
+    table = TruthTable(name, Library([os.path.dirname(os.path.abspath(path))] + directories))
+    if compare:
+        lanes, expected = readCompare(compare, table.inputs, table.outputs)
+        what = f"{len(next(iter(lanes.values())))} rows of {os.path.basename(compare)}"
+    else:
+        lanes, complete = table.lanes(maxBits)
+        expected = reference(name, lanes)
+        if expected is None:
+            return 'skip', f"no builtin {name} to compare with, use -cmp"
+        what = (f"all {1 << table.bits()} inputs" if complete
+                else f"{1 << maxBits} random inputs of 2^{table.bits()}")
+    failures = check(table, lanes, expected)
+    if not failures:
+        return 'pass', what
+    lines = [f"{what}:"]
+    for pin, count, examples in failures:
+        lines.append(f"  {pin} wrong on {count}")
+        lines += [f"    {example}" for example in examples]
+    return 'fail', "\n".join(lines)
+
+
+def main():
+    # verify combinational chips exhaustively against builtins or a .cmp
+    usage = ("Usage: python hverify.py <Chip.hdl|directory> [-lib DIR]... [-cmp FILE] "
+             "[-bits N]")
+    if len(sys.argv) < 2:
+        print(usage)
+        sys.exit(1)
+
+    inputPath = sys.argv[1]
+    if not os.path.exists(inputPath):
+        print(f"Error: Path '{inputPath}' not found")
+        sys.exit(1)
+
+    directories = []
+    compare = None
+    maxBits = 20
+
+    args = sys.argv[2:]
+    i = 0
+    try:
+        while i < len(args):
+            arg = args[i]
+            if arg == '-lib':
+                directories.append(args[i + 1])
+                i += 2
+            elif arg == '-cmp':
+                compare = args[i + 1]
+                i += 2
+            elif arg == '-bits':
+                maxBits = int(args[i + 1])
+                i += 2
+            else:
+                raise ValueError(f"unknown option '{arg}'")
+    except (IndexError, ValueError) as e:
+        print(f"Error: {e}")
+        print(usage)
+        sys.exit(1)
+
+    if os.path.isdir(inputPath):
+        if compare:
+            print("Error: -cmp needs a single .hdl file")
+            sys.exit(1)
+        paths = sorted(os.path.join(inputPath, f) for f in os.listdir(inputPath)
+                       if f.endswith('.hdl'))
+    else:
+        paths = [inputPath]
+
+    failed = False
+    for path in paths:
+        start = time.perf_counter()
+        try:
+            status, message = verify(path, directories, compare, maxBits)
+        except (HDLError, OSError, ValueError) as e:
+            status, message = 'skip', str(e)
+        elapsed = time.perf_counter() - start
+        first, *rest = message.splitlines()
+        print(f"{status.upper():5} {elapsed:7.3f}s  {os.path.basename(path)}: {first}")
+        for line in rest:
+            print(f"              {line}")
+        failed |= status == 'fail'
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -123,6 +123,10 @@ class Code:
             'A-D': '0000111',
             'D&A': '0000000',
             'D|A': '0010101',
+            # commutative spellings (hvm emits M=M+D etc.)
+            'A+D': '0000010',
+            'A&D': '0000000',
+            'A|D': '0010101',
             # a=1 computations (M versions)
             'M': '1110000',
             '!M': '1110001',
@@ -133,7 +137,10 @@ class Code:
             'D-M': '1010011',
             'M-D': '1000111',
             'D&M': '1000000',
-            'D|M': '1010101'
+            'D|M': '1010101',
+            'M+D': '1000010',
+            'M&D': '1000000',
+            'M|D': '1010101'
         }
 
     def dest(self, mnemonic):
@@ -187,14 +194,8 @@ class SymbolTable:
         return self.table.get(symbol, None)
 
 
-def assemble(input_file):
-    # two-pass assembly: build symbols then generate code
-
-    parser = Parser(input_file)
-    code = Code()
-    symbol_table = SymbolTable()
-
-    # first pass: scan for labels
+def scanLabels(parser, symbol_table):
+    # first pass: add every (label) to the symbol table at its rom address
     rom_address = 0
     parser.command_index = -1
 
@@ -210,6 +211,29 @@ def assemble(input_file):
             # count actual instructions
             rom_address += 1
 
+    return rom_address
+
+
+def labelTable(input_file):
+    # map each (label) in an asm file to its rom address
+    # used by the emulator tools to name rom locations
+    symbol_table = SymbolTable()
+    predefined = set(symbol_table.table)
+    scanLabels(Parser(input_file), symbol_table)
+    return {symbol: address for symbol, address in symbol_table.table.items()
+            if symbol not in predefined}
+
+
+def assemble(input_file):
+    # two-pass assembly: build symbols then generate code
+
+    parser = Parser(input_file)
+    code = Code()
+    symbol_table = SymbolTable()
+
+    # first pass: scan for labels
+    scanLabels(parser, symbol_table)
+
     # second pass: generate binary code
     output_lines = []
     variable_address = 16  # variables start at RAM[16]
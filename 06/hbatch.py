@@ -0,0 +1,204 @@
+import itertools
+import os
+import sys
+import time
+
+import numpy as np
+
+from hemu import RAM_SIZE, loadProgram, Instruction
+
+
+class BatchEmulator:
+    # runs one hack program on N machines in lockstep
+    #
+    # ram is an (N, 32K) int16 array and A, D, PC are length-N vectors.
+    # each step picks the lowest pc among the running machines and
+    # executes that instruction for every machine sitting on it, so
+    # diverged branches are handled with masks and machines that left a
+    # loop early simply wait for the others to catch up.
+
+    def __init__(self, words, machines):
+        self.program = [Instruction(word) for word in words]
+        self.machines = machines
+        self.ram = np.zeros((machines, RAM_SIZE), dtype=np.int16)
+        self.a = np.zeros(machines, dtype=np.int16)
+        self.d = np.zeros(machines, dtype=np.int16)
+        self.pc = np.zeros(machines, dtype=np.int32)
+        self.halted = np.zeros(machines, dtype=bool)
+        self.cycles = np.zeros(machines, dtype=np.int64)
+        self.steps = 0
+
+    def alu(self, instruction, x, y):
+        # vectorized alu from the comp control bits, int16 math wraps
+        bits = (instruction.value >> 6) & 0x3F
+        if bits & 0x20:
+            x = np.zeros_like(x)
+        if bits & 0x10:
+            x = ~x
+        if bits & 0x08:
+            y = np.zeros_like(y)
+        if bits & 0x04:
+            y = ~y
+        out = x + y if bits & 0x02 else x & y
+        if bits & 0x01:
+            out = ~out
+        return out
+
+    def run(self, maxSteps=None):
+        # lockstep loop, returns the number of lockstep steps taken
+        # stops when every machine has halted or left the program
+        program = self.program
+        size = len(program)
+        ram = self.ram
+        everyone = np.arange(self.machines)
+        steps = 0
+
+        while maxSteps is None or steps < maxSteps:
+            running = ~self.halted & (self.pc < size)
+            if not running.any():
+                break
+            pc = int(self.pc[running].min())
+            chosen = running & (self.pc == pc)
+            if chosen.all():
+                rows = everyone
+            else:
+                rows = np.flatnonzero(chosen)
+            instruction = program[pc]
+
+            if instruction.isA:
+                self.a[rows] = instruction.value
+                self.pc[rows] = pc + 1
+            else:
+                a = self.a[rows]
+                addresses = a & 0x7FFF
+                if instruction.useM:
+                    y = ram[rows, addresses]
+                else:
+                    y = a
+                out = self.alu(instruction, self.d[rows], y)
+
+                if instruction.destM:
+                    ram[rows, addresses] = out
+                if instruction.destA:
+                    self.a[rows] = out
+                if instruction.destD:
+                    self.d[rows] = out
+
+                jump = instruction.jump
+                if jump:
+                    taken = np.zeros(len(rows), dtype=bool)
+                    if jump & 4:
+                        taken |= out < 0
+                    if jump & 2:
+                        taken |= out == 0
+                    if jump & 1:
+                        taken |= out > 0
+                    targets = addresses.astype(np.int32)
+                    self.pc[rows] = np.where(taken, targets, pc + 1)
+                    if instruction.halt:
+                        # same test as hemu.isHaltLoop, per machine
+                        loops = targets == pc
+                        prev = program[pc - 1] if pc else None
+                        if prev is not None and prev.isA and prev.value == pc - 1:
+                            loops |= targets == pc - 1
+                        self.halted[rows[taken & loops]] = True
+                else:
+                    self.pc[rows] = pc + 1
+
+            self.cycles[rows] += 1
+            steps += 1
+
+        self.steps += steps
+        return steps
+
+
+def parseSweep(text):
+    # 'ADDR=FIRST:LAST' -> (addr, range of values)
+    address, span = text.split('=')
+    first, last = span.split(':')
+    return int(address), range(int(first), int(last) + 1)
+
+
+def main():
+    # run a hack program over every combination of swept inputs
+    usage = ("Usage: python hbatch.py <program.hack|program.asm> "
+             "-sweep ADDR=FIRST:LAST... [-expect ADDR=EXPR]... [-steps N]")
+    if len(sys.argv) < 2:
+        print(usage)
+        sys.exit(1)
+
+    inputFile = sys.argv[1]
+    if not os.path.exists(inputFile):
+        print(f"Error: File '{inputFile}' not found")
+        sys.exit(1)
+
+    sweeps = []
+    expects = []
+    maxSteps = None
+
+    args = sys.argv[2:]
+    i = 0
+    try:
+        while i < len(args):
+            arg = args[i]
+            if arg == '-sweep':
+                sweeps.append(parseSweep(args[i + 1]))
+                i += 2
+            elif arg == '-expect':
+                address, expr = args[i + 1].split('=', 1)
+                expects.append((int(address), expr))
+                i += 2
+            elif arg == '-steps':
+                maxSteps = int(args[i + 1])
+                i += 2
+            else:
+                raise ValueError(f"unknown option '{arg}'")
+    except (IndexError, ValueError) as e:
+        print(f"Error: {e}")
+        print(usage)
+        sys.exit(1)
+
+    if not sweeps:
+        print("Error: at least one -sweep is required")
+        print(usage)
+        sys.exit(1)
+
+    combos = list(itertools.product(*[values for _, values in sweeps]))
+    batch = BatchEmulator(loadProgram(inputFile), len(combos))
+    inputs = np.array(combos, dtype=np.int64)
+    for column, (address, _) in enumerate(sweeps):
+        batch.ram[:, address] = inputs[:, column].astype(np.int16)
+    before = batch.ram[:, :16].astype(np.int64)
+
+    start = time.perf_counter()
+    steps = batch.run(maxSteps)
+    elapsed = time.perf_counter() - start
+
+    print(f"Ran {len(combos)} machines for {steps} lockstep steps "
+          f"({int(batch.cycles.sum())} instructions) in {elapsed:.3f}s")
+    stuck = int((~batch.halted).sum())
+    if stuck:
+        print(f"{stuck} machines did not halt")
+
+    # expressions see the starting R0..R15 and wrap to 16 bits
+    names = {f"R{r}": before[:, r] for r in range(16)}
+    failed = False
+    for address, expr in expects:
+        expected = (eval(expr, {"np": np}, names) + 32768) % 65536 - 32768
+        actual = batch.ram[:, address].astype(np.int64)
+        bad = np.flatnonzero(actual != expected)
+        if len(bad):
+            failed = True
+            first = bad[0]
+            print(f"RAM[{address}] != {expr} on {len(bad)} machines, "
+                  f"e.g. inputs {combos[first]}: got {actual[first]}, "
+                  f"expected {expected[first]}")
+        else:
+            print(f"RAM[{address}] == {expr} on all {len(combos)} machines")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
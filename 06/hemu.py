@@ -0,0 +1,618 @@
+import hashlib
+import os
+import struct
+import sys
+import time
+from array import array
+
+from hasm import assemble, labelTable
+
+RAM_SIZE = 32768
+ROM_SIZE = 32768
+SCREEN = 16384
+KBD = 24576
+
+# jump bits (j1 j2 j3) are taken when out < 0, out == 0, out > 0
+JLT = 4
+JEQ = 2
+JGT = 1
+
+# snapshot file: header then the 32K ram words, all little-endian
+SNAPSHOT_MAGIC = b'HACKSNAP'
+SNAPSHOT_HEADER = struct.Struct('<8s32sqhhi')  # magic, rom digest, cycles, A, D, PC
+
+
+def wrap(value):
+    # wrap a python int to a signed 16-bit hack word
+    return ((value + 32768) & 0xFFFF) - 32768
+
+
+# alu by comp bits (zx nx zy ny f no), x is D and y is A or M.
+# only the ops that can leave the 16-bit range need wrap()
+ALU_OPS = {
+    0b101010: lambda x, y: 0,
+    0b111111: lambda x, y: 1,
+    0b111010: lambda x, y: -1,
+    0b001100: lambda x, y: x,
+    0b110000: lambda x, y: y,
+    0b001101: lambda x, y: ~x,
+    0b110001: lambda x, y: ~y,
+    0b001111: lambda x, y: wrap(-x),
+    0b110011: lambda x, y: wrap(-y),
+    0b011111: lambda x, y: wrap(x + 1),
+    0b110111: lambda x, y: wrap(y + 1),
+    0b001110: lambda x, y: wrap(x - 1),
+    0b110010: lambda x, y: wrap(y - 1),
+    0b000010: lambda x, y: wrap(x + y),
+    0b010011: lambda x, y: wrap(x - y),
+    0b000111: lambda x, y: wrap(y - x),
+    0b000000: lambda x, y: x & y,
+    0b010101: lambda x, y: x | y,
+}
+
+
+def aluOp(bits):
+    # return the alu function for a comp field
+    # unlisted bit patterns are still legal hardware, so fall back to
+    # simulating the alu control bits directly
+    if bits in ALU_OPS:
+        return ALU_OPS[bits]
+
+    zx, nx, zy, ny, f, no = [(bits >> shift) & 1 for shift in range(5, -1, -1)]
+
+    def alu(x, y):
+        if zx:
+            x = 0
+        if nx:
+            x = ~x
+        if zy:
+            y = 0
+        if ny:
+            y = ~y
+        out = x + y if f else x & y
+        if no:
+            out = ~out
+        return wrap(out)
+
+    return alu
+
+
+class Instruction:
+    # one pre-decoded rom word
+    __slots__ = ('isA', 'value', 'useM', 'alu', 'destA', 'destD', 'destM',
+                 'jump', 'halt')
+
+    def __init__(self, word):
+        word &= 0xFFFF
+        self.isA = not word & 0x8000
+        self.value = word
+        self.useM = bool(word & 0x1000)
+        self.alu = None if self.isA else aluOp((word >> 6) & 0x3F)
+        self.destA = bool(word & 0x20)
+        self.destD = bool(word & 0x10)
+        self.destM = bool(word & 0x08)
+        self.jump = word & 0x07
+        # unconditional jump with no dest, a halt loop when it targets itself
+        self.halt = (not self.isA and self.jump == 7
+                     and not (self.destA or self.destD or self.destM))
+
+
+def loadProgram(filename):
+    # read a program as a list of 16-bit words
+    # accepts .hack text, packed .hack (big-endian words) or .asm
+    if filename.endswith('.asm'):
+        return [int(line, 2) for line in assemble(filename)]
+
+    with open(filename, 'rb') as file:
+        data = file.read()
+
+    if not data.strip(b'01 \t\r\n'):
+        # text format: one 16-char binary word per line
+        return [int(line, 2) for line in data.split() if line]
+
+    # packed format: two bytes per word
+    if len(data) % 2:
+        raise ValueError(f"packed program '{filename}' has an odd byte count")
+    words = array('H', data)
+    if sys.byteorder == 'little':
+        words.byteswap()
+    return list(words)
+
+
+def savePacked(words, filename):
+    # write words in the packed .hack format read by loadProgram
+    packed = array('H', [word & 0xFFFF for word in words])
+    if sys.byteorder == 'little':
+        packed.byteswap()
+    with open(filename, 'wb') as file:
+        packed.tofile(file)
+
+
+def isHaltLoop(program, pc, target):
+    # '0;JMP' back to itself, or to the '@X' right before it
+    if target == pc:
+        return True
+    if target == pc - 1:
+        prev = program[target]
+        return prev.isA and prev.value == target
+    return False
+
+
+# alu by comp bits as python source, {x} is D and {y} is A or M
+ALU_SOURCE = {
+    0b101010: ('0', False),
+    0b111111: ('1', False),
+    0b111010: ('-1', False),
+    0b001100: ('{x}', False),
+    0b110000: ('{y}', False),
+    0b001101: ('~{x}', False),
+    0b110001: ('~{y}', False),
+    0b001111: ('-{x}', True),
+    0b110011: ('-{y}', True),
+    0b011111: ('{x} + 1', True),
+    0b110111: ('{y} + 1', True),
+    0b001110: ('{x} - 1', True),
+    0b110010: ('{y} - 1', True),
+    0b000010: ('{x} + {y}', True),
+    0b010011: ('{x} - {y}', True),
+    0b000111: ('{y} - {x}', True),
+    0b000000: ('{x} & {y}', False),
+    0b010101: ('{x} | {y}', False),
+}
+
+# python test on 'out' for each jump field
+JUMP_SOURCE = {
+    1: 'out > 0',
+    2: 'out == 0',
+    3: 'out >= 0',
+    4: 'out < 0',
+    5: 'out != 0',
+    6: 'out <= 0',
+}
+
+
+class BlockCompiler:
+    # translates rom into python functions, one per block entry point
+    #
+    # blocks are split at labels, static jump targets, breakpoints and
+    # after every jump. the function generated for a block keeps A and D
+    # in locals and follows its not-taken branches and static jumps into
+    # the next blocks, so a whole trace runs per call. each exit returns
+    # (a, d, nextPc, executed); executed is negated when the program hit
+    # a halt loop. dynamic jump targets that are not leaders simply get
+    # their own function compiled on first use.
+
+    TRACE_LIMIT = 256
+
+    def __init__(self, program, labels=(), breakpoints=()):
+        self.program = program
+        self.breakpoints = set(breakpoints)
+        self.leaders = set(labels) | self.breakpoints
+        self.leaders.add(0)
+        for address, instruction in enumerate(program):
+            if instruction.isA or not instruction.jump:
+                continue
+            self.leaders.add(address + 1)
+            prev = program[address - 1] if address else None
+            if prev is not None and prev.isA:
+                self.leaders.add(prev.value)
+
+    def compile(self, start):
+        # return (function, longest exit) for the trace starting at start
+        program = self.program
+        size = len(program)
+        lines = [f"def block_{start}(ram, a, d):"]
+        namespace = {}
+        known = None  # A value when it is a compile-time constant
+        visited = set()
+        pc = start
+        count = 0
+        longest = 0
+
+        while True:
+            if (pc >= size or pc in visited or count >= self.TRACE_LIMIT
+                    or (pc in self.breakpoints and pc != start)):
+                # leave the trace, the dispatcher picks up at pc
+                aValue = 'a' if known is None else str(known)
+                lines.append(f"    return {aValue}, d, {pc}, {count}")
+                longest = max(longest, count)
+                break
+            if pc in self.leaders:
+                visited.add(pc)
+
+            instruction = program[pc]
+            count += 1
+            if instruction.isA:
+                known = instruction.value
+                pc += 1
+                continue
+
+            target, known = self.emit(lines, namespace, instruction, known, pc, count)
+            if not instruction.jump:
+                pc += 1
+                continue
+            longest = max(longest, count)
+            if instruction.jump != 7:
+                # not taken, carry on with the next block
+                pc += 1
+            elif target is not None and not instruction.halt:
+                # static unconditional jump, inline the target block
+                pc = target
+            else:
+                break
+
+        source = "\n".join(lines) + "\n"
+        exec(compile(source, f"<block {start}>", "exec"), namespace)
+        return namespace[f"block_{start}"], longest
+
+    def emit(self, lines, namespace, instruction, known, pc, count):
+        # append one c-instruction at pc, count is the trace length so far
+        # returns (static jump target or None, new known A value)
+        address = 'a & 32767' if known is None else str(known)
+        aValue = 'a' if known is None else str(known)
+        y = f"ram[{address}]" if instruction.useM else aValue
+
+        bits = (instruction.value >> 6) & 0x3F
+        if bits in ALU_SOURCE:
+            template, wraps = ALU_SOURCE[bits]
+            expr = template.format(x='d', y=y)
+            if wraps:
+                expr = f"(({expr}) + 32768 & 65535) - 32768"
+        else:
+            # odd comp bits fall back to the interpreter's alu
+            name = f"alu_{pc}"
+            namespace[name] = instruction.alu
+            expr = f"{name}(d, {y})"
+
+        dests = []
+        if instruction.destM:
+            dests.append(f"ram[{address}]")
+        if instruction.destD:
+            dests.append("d")
+        if instruction.destA:
+            dests.append("a")
+
+        if instruction.jump and known is None:
+            # jump target is the A value before this instruction
+            lines.append("    target = a & 32767")
+        if instruction.jump:
+            lines.append(f"    out = {expr}")
+            for dest in dests:
+                lines.append(f"    {dest} = out")
+        elif len(dests) == 1:
+            lines.append(f"    {dests[0]} = {expr}")
+        elif dests:
+            # M is written through the old A, so it goes first
+            lines.append(f"    out = {expr}")
+            for dest in dests:
+                lines.append(f"    {dest} = out")
+
+        target = known
+        newKnown = known
+        if instruction.destA:
+            newKnown = None
+
+        if instruction.jump:
+            # exits need A in the local, not just as a constant
+            exitA = 'a' if newKnown is None else str(newKnown)
+            targetValue = 'target' if target is None else str(target)
+            if instruction.halt:
+                prev = self.program[pc - 1] if pc else None
+                selfLoop = prev is not None and prev.isA and prev.value == pc - 1
+                if target is None:
+                    test = f"target == {pc}"
+                    if selfLoop:
+                        test += f" or target == {pc - 1}"
+                    lines.append(f"    if {test}:")
+                    lines.append(f"        return {exitA}, d, target, {-count}")
+                elif target == pc or (target == pc - 1 and selfLoop):
+                    lines.append(f"    return {exitA}, d, {target}, {-count}")
+                    return None, newKnown
+            if instruction.jump == 7:
+                if target is None or instruction.halt:
+                    lines.append(f"    return {exitA}, d, {targetValue}, {count}")
+            else:
+                lines.append(f"    if {JUMP_SOURCE[instruction.jump]}:")
+                lines.append(f"        return {exitA}, d, {targetValue}, {count}")
+        return target, newKnown
+
+
+class Emulator:
+    # hack cpu with 32K rom and 32K ram
+
+    def __init__(self, words=None, engine='blocks'):
+        self.rom = array('h', bytes(2 * ROM_SIZE))
+        self.ram = array('h', bytes(2 * RAM_SIZE))
+        self.program = []
+        self.labels = {}
+        self.engine = engine
+        self.blocks = None
+        self.compiler = None
+        self.reset()
+        if words is not None:
+            self.load(words)
+
+    def reset(self):
+        # clear registers, keep rom and ram
+        self.a = 0
+        self.d = 0
+        self.pc = 0
+        self.cycles = 0
+
+    def load(self, words, labels=None):
+        # copy words into rom and pre-decode every instruction once
+        if len(words) > ROM_SIZE:
+            raise ValueError(f"program has {len(words)} instructions, "
+                             f"rom holds {ROM_SIZE}")
+        self.rom = array('h', bytes(2 * ROM_SIZE))
+        for address, word in enumerate(words):
+            self.rom[address] = wrap(word)
+        self.program = [Instruction(word) for word in words]
+        self.labels = labels or {}
+        self.blocks = None
+
+    def loadFile(self, filename):
+        # load .hack or .asm, keeping labels when they are available
+        labels = labelTable(filename) if filename.endswith('.asm') else None
+        self.load(loadProgram(filename), labels)
+
+    def digest(self):
+        # identifies the loaded program, snapshots only resume on the same one
+        return hashlib.sha256(self.rom[:len(self.program)].tobytes()).digest()
+
+    def saveSnapshot(self, filename):
+        # write ram, registers and pc so a later run can pick up from here
+        ram = array('h', self.ram)
+        if sys.byteorder == 'big':
+            ram.byteswap()
+        with open(filename, 'wb') as file:
+            file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, self.digest(), self.cycles,
+                                            self.a, self.d, self.pc))
+            ram.tofile(file)
+
+    def loadSnapshot(self, filename):
+        # restore a saveSnapshot file taken with the same program loaded
+        with open(filename, 'rb') as file:
+            header = file.read(SNAPSHOT_HEADER.size)
+            data = file.read()
+        if len(header) != SNAPSHOT_HEADER.size or len(data) != 2 * RAM_SIZE:
+            raise ValueError(f"'{filename}' is not a snapshot")
+        magic, digest, cycles, a, d, pc = SNAPSHOT_HEADER.unpack(header)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"'{filename}' is not a snapshot")
+        if digest != self.digest():
+            raise ValueError(f"'{filename}' was taken with a different program")
+        ram = array('h', data)
+        if sys.byteorder == 'big':
+            ram.byteswap()
+        self.ram[:] = ram
+        self.cycles, self.a, self.d, self.pc = cycles, a, d, pc
+
+    def address(self, name):
+        # resolve a label name or a number to a rom address
+        if name in self.labels:
+            return self.labels[name]
+        return int(name)
+
+    def step(self):
+        # execute one instruction, return False when halted
+        return self.interpret(1) == 1
+
+    def run(self, maxSteps=None, breakpoints=()):
+        # run with the selected engine, returns instructions executed
+        # stops on a halt loop, a breakpoint, running off the end of
+        # the program, or after maxSteps instructions
+        if self.engine == 'blocks':
+            return self.runBlocks(maxSteps, breakpoints)
+        return self.interpret(maxSteps, breakpoints)
+
+    def runBlocks(self, maxSteps=None, breakpoints=()):
+        # execute compiled blocks, finishing with the interpreter when
+        # the step limit could fall inside a block
+        breaks = set(breakpoints)
+        if self.blocks is None or breaks != self.compiler.breakpoints:
+            # breakpoints must end traces, so recompile lazily
+            self.compiler = BlockCompiler(self.program, self.labels.values(), breaks)
+            self.blocks = [None] * len(self.program)
+
+        blocks = self.blocks
+        compiler = self.compiler
+        ram = self.ram
+        size = len(self.program)
+        limit = maxSteps if maxSteps is not None else -1
+        a, d, pc = self.a, self.d, self.pc
+        count = 0
+        partial = False
+
+        if limit < 0 and not breaks:
+            # common case, nothing to check between traces
+            while pc < size:
+                block = blocks[pc]
+                if block is None:
+                    block = blocks[pc] = compiler.compile(pc)
+                a, d, pc, executed = block[0](ram, a, d)
+                if executed < 0:
+                    # ran into a halt loop
+                    count -= executed
+                    break
+                count += executed
+        else:
+            while pc < size:
+                if breaks and pc in breaks and count:
+                    break
+                block = blocks[pc]
+                if block is None:
+                    block = blocks[pc] = compiler.compile(pc)
+                if limit >= 0 and count + block[1] > limit:
+                    partial = True
+                    break
+                a, d, pc, executed = block[0](ram, a, d)
+                if executed < 0:
+                    count -= executed
+                    break
+                count += executed
+
+        self.a, self.d, self.pc = a, d, pc
+        self.cycles += count
+        if partial:
+            count += self.interpret(limit - count, breaks)
+        return count
+
+    def interpret(self, maxSteps=None, breakpoints=()):
+        # plain fetch-execute loop over the decoded instructions
+        program = self.program
+        ram = self.ram
+        size = len(program)
+        breaks = set(breakpoints)
+        limit = maxSteps if maxSteps is not None else -1
+        a, d, pc = self.a, self.d, self.pc
+        count = 0
+
+        while count != limit and pc < size:
+            if breaks and pc in breaks and count:
+                break
+            instruction = program[pc]
+
+            if instruction.isA:
+                a = instruction.value
+                pc += 1
+            else:
+                if instruction.useM:
+                    out = instruction.alu(d, ram[a & 0x7FFF])
+                else:
+                    out = instruction.alu(d, a)
+
+                target = a
+                if instruction.destM:
+                    ram[a & 0x7FFF] = out
+                if instruction.destA:
+                    a = out
+                if instruction.destD:
+                    d = out
+
+                jump = instruction.jump
+                if jump and jump & (JLT if out < 0 else JEQ if out == 0 else JGT):
+                    target &= 0x7FFF
+                    if instruction.halt and isHaltLoop(program, pc, target):
+                        count += 1
+                        pc = target
+                        break
+                    pc = target
+                else:
+                    pc += 1
+            count += 1
+
+        self.a, self.d, self.pc = a, d, pc
+        self.cycles += count
+        return count
+
+
+def parseRange(text):
+    # 'n' or 'n-m' -> (first, last)
+    if '-' in text:
+        first, last = text.split('-', 1)
+        return int(first), int(last)
+    return int(text), int(text)
+
+
+def main():
+    # run a hack program headlessly
+    usage = ("Usage: python hemu.py <program.hack|program.asm> [-steps N] "
+             "[-until LABEL] [-set ADDR=VALUE]... [-dump ADDR[-ADDR]]... "
+             "[-engine blocks|interp] [-resume FILE] [-save FILE] [-bench]")
+    if len(sys.argv) < 2:
+        print(usage)
+        sys.exit(1)
+
+    inputFile = sys.argv[1]
+    if not os.path.exists(inputFile):
+        print(f"Error: File '{inputFile}' not found")
+        sys.exit(1)
+
+    maxSteps = None
+    until = []
+    sets = []
+    dumps = []
+    bench = False
+    engine = 'blocks'
+    resume = None
+    save = None
+
+    args = sys.argv[2:]
+    i = 0
+    try:
+        while i < len(args):
+            arg = args[i]
+            if arg == '-steps':
+                maxSteps = int(args[i + 1])
+                i += 2
+            elif arg == '-until':
+                until.append(args[i + 1])
+                i += 2
+            elif arg == '-set':
+                address, value = args[i + 1].split('=')
+                sets.append((int(address), int(value)))
+                i += 2
+            elif arg == '-dump':
+                dumps.append(parseRange(args[i + 1]))
+                i += 2
+            elif arg == '-engine':
+                engine = args[i + 1]
+                if engine not in ('blocks', 'interp'):
+                    raise ValueError(f"unknown engine '{engine}'")
+                i += 2
+            elif arg == '-resume':
+                resume = args[i + 1]
+                i += 2
+            elif arg == '-save':
+                save = args[i + 1]
+                i += 2
+            elif arg == '-bench':
+                bench = True
+                i += 1
+            else:
+                raise ValueError(f"unknown option '{arg}'")
+    except (IndexError, ValueError) as e:
+        print(f"Error: {e}")
+        print(usage)
+        sys.exit(1)
+
+    try:
+        emulator = Emulator(engine=engine)
+        emulator.loadFile(inputFile)
+        breakpoints = [emulator.address(name) for name in until]
+    except (ValueError, KeyError) as e:
+        print(f"Error loading '{inputFile}': {e}")
+        sys.exit(1)
+
+    if resume:
+        # -set still applies on top of the restored ram
+        try:
+            emulator.loadSnapshot(resume)
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+
+    for address, value in sets:
+        emulator.ram[address] = wrap(value)
+
+    start = time.perf_counter()
+    executed = emulator.run(maxSteps, breakpoints)
+    elapsed = time.perf_counter() - start
+
+    print(f"Stopped at pc={emulator.pc} after {executed} instructions")
+    if save:
+        emulator.saveSnapshot(save)
+        print(f"Saved snapshot to '{save}'")
+    for first, last in dumps:
+        for address in range(first, last + 1):
+            print(f"RAM[{address}] = {emulator.ram[address]}")
+
+    if bench:
+        rate = executed / elapsed if elapsed > 0 else 0
+        print(f"Ran {executed} instructions in {elapsed:.3f}s "
+              f"({rate:,.0f} instructions/sec)")
+
+
+if __name__ == "__main__":
+    main()
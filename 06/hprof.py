@@ -0,0 +1,281 @@
+import os
+import re
+import sys
+import time
+from bisect import bisect_right
+
+from hemu import Emulator, JLT, JEQ, JGT, isHaltLoop, wrap
+
+# labels hvm's CodeWriter emits: '(Class.function)' for writeFunction,
+# '(RETURN_n)' after every writeCall, 'Class.function$label' inside them
+RETURN_LABEL = re.compile(r'RETURN_\d+$')
+BOOTSTRAP = '(bootstrap)'
+
+
+def functionLabels(labels):
+    # {rom address: function name} for the writeFunction labels
+    return {address: name for name, address in labels.items()
+            if '.' in name and '$' not in name}
+
+
+class Profiler(Emulator):
+    # exact cycle profiler for hvm-generated programs
+    #
+    # every executed rom address is counted, and a shadow call stack is
+    # kept from the control flow itself: a taken jump to a function label
+    # is a call, a taken jump to a RETURN_n label is a return. cycles are
+    # charged to the whole stack, which gives inclusive totals, caller /
+    # callee edges and flame-graph folded stacks without walking frames.
+
+    def __init__(self, words=None):
+        super().__init__(words, engine='interp')
+
+    def load(self, words, labels=None):
+        super().load(words, labels)
+        entries = functionLabels(self.labels)
+        self.entries = entries
+        self.returns = {address for name, address in self.labels.items()
+                        if RETURN_LABEL.match(name)}
+        self.starts = sorted(entries)
+        self.counts = [0] * len(self.program)
+        self.calls = {}  # function -> times entered
+        self.stacks = {}  # tuple of functions -> cycles spent with it on top
+        self.stack = ()
+
+    def owner(self, address):
+        # function whose code holds the rom address
+        i = bisect_right(self.starts, address)
+        if i == 0:
+            return BOOTSTRAP
+        return self.entries[self.starts[i - 1]]
+
+    def profile(self, maxSteps=None, breakpoints=()):
+        # interpret like Emulator.interpret, counting as we go
+        program = self.program
+        ram = self.ram
+        size = len(program)
+        breaks = set(breakpoints)
+        limit = maxSteps if maxSteps is not None else -1
+        counts = self.counts
+        entries = self.entries
+        returns = self.returns
+        calls = self.calls
+        stacks = self.stacks
+        stack = self.stack
+        a, d, pc = self.a, self.d, self.pc
+        count = 0
+        mark = 0  # count when the stack last changed
+
+        while count != limit and pc < size:
+            if breaks and pc in breaks and count:
+                break
+            instruction = program[pc]
+            counts[pc] += 1
+
+            if instruction.isA:
+                a = instruction.value
+                pc += 1
+            else:
+                if instruction.useM:
+                    out = instruction.alu(d, ram[a & 0x7FFF])
+                else:
+                    out = instruction.alu(d, a)
+
+                target = a
+                if instruction.destM:
+                    ram[a & 0x7FFF] = out
+                if instruction.destA:
+                    a = out
+                if instruction.destD:
+                    d = out
+
+                jump = instruction.jump
+                if jump and jump & (JLT if out < 0 else JEQ if out == 0 else JGT):
+                    target &= 0x7FFF
+                    if instruction.halt and isHaltLoop(program, pc, target):
+                        count += 1
+                        pc = target
+                        break
+                    if target in entries:
+                        stacks[stack] = stacks.get(stack, 0) + count + 1 - mark
+                        mark = count + 1
+                        name = entries[target]
+                        calls[name] = calls.get(name, 0) + 1
+                        stack = stack + (name,)
+                    elif target in returns and stack:
+                        stacks[stack] = stacks.get(stack, 0) + count + 1 - mark
+                        mark = count + 1
+                        stack = stack[:-1]
+                    pc = target
+                else:
+                    pc += 1
+            count += 1
+
+        stacks[stack] = stacks.get(stack, 0) + count - mark
+        self.stack = stack
+        self.a, self.d, self.pc = a, d, pc
+        self.cycles += count
+        return count
+
+    def flatProfile(self):
+        # [(function, self cycles)] from the rom address counts, hottest first
+        totals = {}
+        for address, hits in enumerate(self.counts):
+            if hits:
+                name = self.owner(address)
+                totals[name] = totals.get(name, 0) + hits
+        return sorted(totals.items(), key=lambda item: -item[1])
+
+    def callGraph(self):
+        # inclusive cycles per function and per caller -> callee edge
+        # a function counts once per stack, so recursion is not doubled
+        inclusive = {}
+        edges = {}
+        for stack, cycles in self.stacks.items():
+            for name in set(stack):
+                inclusive[name] = inclusive.get(name, 0) + cycles
+            for edge in set(zip(stack, stack[1:])):
+                edges[edge] = edges.get(edge, 0) + cycles
+        return inclusive, edges
+
+    def foldedStacks(self):
+        # 'outer;inner cycles' lines for flamegraph.pl / speedscope
+        lines = []
+        for stack, cycles in sorted(self.stacks.items()):
+            if cycles:
+                lines.append(f"{';'.join(stack) or BOOTSTRAP} {cycles}")
+        return lines
+
+    def hotAddresses(self, n):
+        # [(address, hits, 'label+offset')] for the n most executed addresses
+        names = sorted((address, name) for name, address in self.labels.items())
+        starts = [address for address, _ in names]
+        hot = sorted(range(len(self.counts)), key=lambda pc: -self.counts[pc])[:n]
+        result = []
+        for address in hot:
+            if not self.counts[address]:
+                break
+            i = bisect_right(starts, address)
+            if i:
+                base, name = names[i - 1]
+                where = name if base == address else f"{name}+{address - base}"
+            else:
+                where = str(address)
+            result.append((address, self.counts[address], where))
+        return result
+
+
+def percent(part, whole):
+    return 100.0 * part / whole if whole else 0.0
+
+
+def main():
+    # profile a hack program and print where the cycles went
+    usage = ("Usage: python hprof.py <program.asm|program.hack> [-steps N] "
+             "[-until LABEL] [-set ADDR=VALUE]... [-top N] [-graph] "
+             "[-hot N] [-folded FILE]")
+    if len(sys.argv) < 2:
+        print(usage)
+        sys.exit(1)
+
+    inputFile = sys.argv[1]
+    if not os.path.exists(inputFile):
+        print(f"Error: File '{inputFile}' not found")
+        sys.exit(1)
+
+    maxSteps = None
+    until = []
+    sets = []
+    top = 20
+    graph = False
+    hot = 0
+    folded = None
+
+    args = sys.argv[2:]
+    i = 0
+    try:
+        while i < len(args):
+            arg = args[i]
+            if arg == '-steps':
+                maxSteps = int(args[i + 1])
+                i += 2
+            elif arg == '-until':
+                until.append(args[i + 1])
+                i += 2
+            elif arg == '-set':
+                address, value = args[i + 1].split('=')
+                sets.append((int(address), int(value)))
+                i += 2
+            elif arg == '-top':
+                top = int(args[i + 1])
+                i += 2
+            elif arg == '-graph':
+                graph = True
+                i += 1
+            elif arg == '-hot':
+                hot = int(args[i + 1])
+                i += 2
+            elif arg == '-folded':
+                folded = args[i + 1]
+                i += 2
+            else:
+                raise ValueError(f"unknown option '{arg}'")
+    except (IndexError, ValueError) as e:
+        print(f"Error: {e}")
+        print(usage)
+        sys.exit(1)
+
+    try:
+        profiler = Profiler()
+        profiler.loadFile(inputFile)
+        breakpoints = [profiler.address(name) for name in until]
+    except (ValueError, KeyError) as e:
+        print(f"Error loading '{inputFile}': {e}")
+        sys.exit(1)
+    if not profiler.entries:
+        print("Note: no function labels (is this hvm output as .asm?), "
+              "only rom addresses can be reported")
+
+    for address, value in sets:
+        profiler.ram[address] = wrap(value)
+
+    start = time.perf_counter()
+    executed = profiler.profile(maxSteps, breakpoints)
+    elapsed = time.perf_counter() - start
+    print(f"Profiled {executed} instructions in {elapsed:.3f}s, "
+          f"stopped at pc={profiler.pc}")
+
+    inclusive, edges = profiler.callGraph()
+    print()
+    print(f"{'self':>10} {'self%':>6} {'total':>10} {'total%':>6} {'calls':>8}  function")
+    for name, cycles in profiler.flatProfile()[:top]:
+        total = inclusive.get(name, cycles)
+        print(f"{cycles:>10} {percent(cycles, executed):>5.1f}% "
+              f"{total:>10} {percent(total, executed):>5.1f}% "
+              f"{profiler.calls.get(name, 0):>8}  {name}")
+
+    if graph:
+        print()
+        print("call graph (inclusive cycles per callee)")
+        for name, total in sorted(inclusive.items(), key=lambda item: -item[1])[:top]:
+            print(f"{total:>10} {percent(total, executed):>5.1f}%  {name}")
+            callees = [(callee, cycles) for (caller, callee), cycles in edges.items()
+                       if caller == name]
+            for callee, cycles in sorted(callees, key=lambda item: -item[1]):
+                print(f"{cycles:>18}  -> {callee}")
+
+    if hot:
+        print()
+        print("hottest rom addresses")
+        for address, hits, where in profiler.hotAddresses(hot):
+            print(f"{address:>6} {hits:>10}  {where}")
+
+    if folded:
+        with open(folded, 'w') as file:
+            for line in profiler.foldedStacks():
+                file.write(line + "\n")
+        print(f"\nWrote folded stacks to '{folded}'")
+
+
+if __name__ == "__main__":
+    main()
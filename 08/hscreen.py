@@ -0,0 +1,303 @@
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+from hvme import Program, VMEmulator, VMError, listVMFiles
+
+SCREEN = 16384
+KBD = 24576
+WIDTH = 512
+HEIGHT = 256
+
+# bit i of a screen word is pixel x = 16 * column + i
+BITS = (1 << np.arange(16)).astype(np.uint16)
+
+
+def render(ram):
+    # 256x512 bool array, True where the pixel is black
+    # works on any 32K hack ram (array('h'), numpy row, ...) without copying
+    words = np.frombuffer(ram, dtype=np.uint16, count=KBD - SCREEN, offset=2 * SCREEN)
+    return ((words.reshape(HEIGHT, WIDTH // 16, 1) & BITS) != 0).reshape(HEIGHT, WIDTH)
+
+
+def toImage(pixels):
+    # black on white, like the emulator window
+    return Image.fromarray(np.where(pixels, 0, 255).astype(np.uint8))
+
+
+def loadReference(filename):
+    # reference screenshot as a grayscale array
+    return np.asarray(Image.open(filename).convert('L'))
+
+
+def fitAxis(ours, ref, scales, offsets):
+    # best (correlation, scale, offset) so that ref[r] ~ ours[(r - offset) / scale]
+    # both are (bands, length) dark-pixel profiles along the same axis
+    n = ours.shape[1]
+    positions = np.arange(ref.shape[1])
+    target = (ref - ref.mean(axis=1, keepdims=True)).ravel()
+    best = (-2.0, 1.0, 0.0)
+    for scale in scales:
+        index = ((positions[None, :] - offsets[:, None]) / scale).astype(int)
+        inside = (index >= 0) & (index < n)
+        predicted = ours[:, np.clip(index, 0, n - 1)] * inside  # (bands, offsets, length)
+        predicted = predicted - predicted.mean(axis=2, keepdims=True)
+        predicted = predicted.transpose(1, 0, 2).reshape(len(offsets), -1)
+        corr = predicted @ target / (np.sqrt((predicted ** 2).sum(axis=1) * (target ** 2).sum()) + 1e-9)
+        i = int(corr.argmax())
+        if corr[i] > best[0]:
+            best = (float(corr[i]), float(scale), float(offsets[i]))
+    return best
+
+
+def searchAxis(ours, ref):
+    # coarse grid first, then refine around the best match
+    _, scale, offset = fitAxis(ours, ref, np.arange(0.3, 1.5, 0.01), np.arange(-20.0, 40.0, 1.0))
+    return fitAxis(ours, ref, np.arange(scale - 0.02, scale + 0.02, 0.001),
+                   np.arange(offset - 3.0, offset + 3.0, 0.25))
+
+
+def register(pixels, reference):
+    # (sx, ox, sy, oy) placing the 512x256 screen inside a scaled screenshot
+    #
+    # reference gifs are window grabs: shrunk, with a border, and not always
+    # scaled the same in x and y. rows are matched first from per-row dark
+    # pixel counts, then columns per band of rows, since a single column
+    # profile of a text screen is too periodic to pin down.
+    ours = pixels.astype(float)
+    dark = (reference < 128).astype(float)
+    _, sy, oy = searchAxis(ours.sum(axis=1)[None, :], dark.sum(axis=1)[None, :])
+
+    rows = ((np.arange(reference.shape[0]) - oy) / sy).astype(int)
+    bands = [band for band in np.array_split(np.flatnonzero((rows >= 0) & (rows < HEIGHT)), 8)
+             if len(band)]
+    _, sx, ox = searchAxis(np.array([ours[rows[band]].sum(axis=0) for band in bands]),
+                           np.array([dark[band].sum(axis=0) for band in bands]))
+    return sx, ox, sy, oy
+
+
+def grow(mask):
+    # mask dilated by one pixel in every direction
+    padded = np.pad(mask, 1)
+    out = mask.copy()
+    h, w = mask.shape
+    for dy in range(3):
+        for dx in range(3):
+            out |= padded[dy:dy + h, dx:dx + w]
+    return out
+
+
+class ScreenDiff:
+    # pixel mismatches between a rendered screen and a reference image,
+    # in reference image coordinates
+
+    def __init__(self, pixels, reference):
+        self.reference = reference
+        if reference.shape == (HEIGHT, WIDTH):
+            # a capture of our own: compare exactly
+            self.geometry = (1.0, 0.0, 1.0, 0.0)
+            self.area = np.ones(reference.shape, dtype=bool)
+            ref = reference < 128
+            self.missing = ref & ~pixels
+            self.extra = pixels & ~ref
+            self.dark = int(ref.sum())
+            return
+
+        # a scaled screenshot: place our screen over it, shrink with area
+        # averaging, and allow one pixel of slack for the resampling
+        self.geometry = sx, ox, sy, oy = register(pixels, reference)
+        w, h = round(WIDTH * sx), round(HEIGHT * sy)
+        x0, y0 = round(ox), round(oy)
+        small = np.asarray(toImage(pixels).resize((w, h), Image.BOX))
+        canvas = np.full(reference.shape, 255, dtype=np.uint8)
+        self.area = np.zeros(reference.shape, dtype=bool)
+        ys = slice(max(y0, 0), min(y0 + h, reference.shape[0]))
+        xs = slice(max(x0, 0), min(x0 + w, reference.shape[1]))
+        canvas[ys, xs] = small[ys.start - y0:ys.stop - y0, xs.start - x0:xs.stop - x0]
+        self.area[ys, xs] = True
+
+        refDark = (reference < 100) & self.area
+        self.missing = refDark & ~grow(canvas < 200)
+        self.extra = (canvas < 100) & ~grow((reference < 160) & self.area)
+        self.dark = int(refDark.sum())
+
+    @property
+    def count(self):
+        return int(self.missing.sum() + self.extra.sum())
+
+    def box(self):
+        # (left, top, right, bottom) around every mismatch, None if none
+        ys, xs = np.nonzero(self.missing | self.extra)
+        if not len(ys):
+            return None
+        return int(xs.min()), int(ys.min()), int(xs.max()), int(ys.max())
+
+    def report(self):
+        sx, ox, sy, oy = self.geometry
+        lines = [f"{self.count} mismatched pixels "
+                 f"({int(self.missing.sum())} missing, {int(self.extra.sum())} extra) "
+                 f"against {self.dark} dark reference pixels"]
+        if self.geometry != (1.0, 0.0, 1.0, 0.0):
+            lines.append(f"screen placed at ({ox:.2f}, {oy:.2f}) scaled {sx:.3f} x {sy:.3f}")
+        if self.count:
+            lines.append("mismatches within (left, top, right, bottom) = %s" % (self.box(),))
+        return "\n".join(lines)
+
+    def save(self, filename):
+        # faded reference, missing pixels red, extra pixels blue
+        faded = 255 - (255 - self.reference.astype(np.uint16)) // 3
+        image = np.stack([faded] * 3, axis=-1).astype(np.uint8)
+        image[self.missing] = (255, 0, 0)
+        image[self.extra] = (0, 0, 255)
+        Image.fromarray(image).save(filename)
+
+
+def main():
+    # run a vm program and capture or check its screen
+    usage = ("Usage: python hscreen.py <file_or_directory> [-native [CLASS,...]] "
+             "[-steps N] [-until FUNCTION] [-resume FILE] [-out FILE] "
+             "[-compare REF [-diff FILE] [-allow N]] [-frames N DIR]")
+    if len(sys.argv) < 2:
+        print(usage)
+        sys.exit(1)
+
+    inputPath = sys.argv[1]
+    if not os.path.exists(inputPath):
+        print(f"Error: Path '{inputPath}' not found")
+        sys.exit(1)
+
+    native = None
+    maxSteps = None
+    until = []
+    resume = None
+    out = None
+    compare = None
+    diffFile = None
+    allow = 0
+    frameEvery = None
+    frameDir = None
+
+    args = sys.argv[2:]
+    i = 0
+    try:
+        while i < len(args):
+            arg = args[i]
+            if arg == '-native':
+                native = []
+                i += 1
+                if i < len(args) and not args[i].startswith('-'):
+                    native = args[i].split(',')
+                    i += 1
+            elif arg == '-steps':
+                maxSteps = int(args[i + 1])
+                i += 2
+            elif arg == '-until':
+                until.append(args[i + 1])
+                i += 2
+            elif arg == '-resume':
+                resume = args[i + 1]
+                i += 2
+            elif arg == '-out':
+                out = args[i + 1]
+                i += 2
+            elif arg == '-compare':
+                compare = args[i + 1]
+                i += 2
+            elif arg == '-diff':
+                diffFile = args[i + 1]
+                i += 2
+            elif arg == '-allow':
+                allow = int(args[i + 1])
+                i += 2
+            elif arg == '-frames':
+                frameEvery = int(args[i + 1])
+                frameDir = args[i + 2]
+                i += 3
+            else:
+                raise ValueError(f"unknown option '{arg}'")
+    except (IndexError, ValueError) as e:
+        print(f"Error: {e}")
+        print(usage)
+        sys.exit(1)
+
+    try:
+        program = Program(listVMFiles(inputPath))
+        emulator = VMEmulator(program)
+        if maxSteps is None and not until and 'Sys.halt' in program.functions:
+            # the jack Sys.halt spins forever, stop when it is entered
+            until = ['Sys.halt']
+        breakpoints = []
+        for name in until:
+            if name not in program.functions:
+                raise VMError(f"no function named '{name}'")
+            breakpoints.append(program.functions[name])
+        if native is not None:
+            from hvmos import NativeOS
+            nativeOS = NativeOS(emulator)
+            emulator.installNatives(nativeOS.functions(native or None))
+        if resume:
+            emulator.loadSnapshot(resume)
+        elif native is not None and 'Sys.init' not in program.functions:
+            nativeOS.boot()
+            emulator.bootstrap('Main.main')
+        else:
+            emulator.bootstrap()
+
+        start = time.perf_counter()
+        if frameEvery:
+            # render every frameEvery commands, keeping only changed frames
+            os.makedirs(frameDir, exist_ok=True)
+            frames = 0
+            last = None
+            executed = 0
+            renderTime = 0.0
+            while maxSteps is None or executed < maxSteps:
+                chunk = frameEvery if maxSteps is None else min(frameEvery, maxSteps - executed)
+                ran = emulator.run(chunk, breakpoints)
+                executed += ran
+                began = time.perf_counter()
+                pixels = render(emulator.ram)
+                if last is None or not np.array_equal(pixels, last):
+                    toImage(pixels).save(os.path.join(frameDir, f"frame_{frames:05d}.png"))
+                    frames += 1
+                    last = pixels
+                renderTime += time.perf_counter() - began
+                if ran < chunk or emulator.halted:
+                    break
+            print(f"Wrote {frames} changed frames to '{frameDir}' "
+                  f"({renderTime:.3f}s of capture)")
+        else:
+            executed = emulator.run(maxSteps, breakpoints)
+        elapsed = time.perf_counter() - start
+    except (VMError, OSError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    where = program.names[emulator.pc] if emulator.pc < len(program.names) else None
+    print(f"Stopped at command {emulator.pc} ({where or 'end'}) after {executed} commands "
+          f"in {elapsed:.3f}s")
+
+    pixels = render(emulator.ram)
+    if out:
+        toImage(pixels).save(out)
+        print(f"Wrote screen to '{out}'")
+
+    if compare:
+        try:
+            diff = ScreenDiff(pixels, loadReference(compare))
+        except OSError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        print(diff.report())
+        if diffFile:
+            diff.save(diffFile)
+            print(f"Wrote differences to '{diffFile}'")
+        if diff.count > allow:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
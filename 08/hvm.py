@@ -57,6 +57,12 @@ class Parser:
         else:
             return 'C_UNKNOWN'
 
+    def peek(self):
+        # the words of the next command, empty at the end
+        if self.hasMoreCommands():
+            return self.commands[self.command_index + 1].split()
+        return []
+
     def arg1(self):
         # extract first arg
         if self.commandType() == 'C_ARITHMETIC':
@@ -71,6 +77,13 @@ class Parser:
         return None
 
 
+# base pointer of each segment addressed through one
+SEGMENT_BASES = {'local': 'LCL', 'argument': 'ARG', 'this': 'THIS', 'that': 'THAT'}
+
+# pops to segments whose entries sit at fixed addresses
+DIRECT_POPS = (['pop', 'static'], ['pop', 'temp'], ['pop', 'pointer'])
+
+
 class CodeWriter:
     # generates assembly from VM commands
 
@@ -236,6 +249,39 @@ class CodeWriter:
             self.output_file.write(f"@{self.filename}.{index}\n")
             self.output_file.write("M=D\n")
 
+    def directAddress(self, segment, index):
+        # the fixed address of a static, temp or pointer entry
+        if segment == 'static':
+            return f"{self.filename}.{index}"
+        if segment == 'temp':
+            return str(5 + index)
+        return "THIS" if index == 0 else "THAT"
+
+    def writeMove(self, segment, index, target, targetIndex):
+        # push segment index then pop target targetIndex, with target
+        # static, temp or pointer: the value goes through D instead of
+        # the stack. the compiler copies arguments into statics and zeroes
+        # them this way in the functions that keep their variables there
+        address = self.directAddress(target, targetIndex)
+        if segment == 'constant' and index <= 1:
+            self.output_file.write(f"@{address}\n")
+            self.output_file.write(f"M={index}\n")
+            return
+        if segment == 'constant':
+            self.output_file.write(f"@{index}\n")
+            self.output_file.write("D=A\n")
+        elif segment in SEGMENT_BASES:
+            self.output_file.write(f"@{SEGMENT_BASES[segment]}\n")
+            self.output_file.write("D=M\n")
+            self.output_file.write(f"@{index}\n")
+            self.output_file.write("A=D+A\n")
+            self.output_file.write("D=M\n")
+        else:
+            self.output_file.write(f"@{self.directAddress(segment, index)}\n")
+            self.output_file.write("D=M\n")
+        self.output_file.write(f"@{address}\n")
+        self.output_file.write("M=D\n")
+
     def pushFromSeg(self, segName, index):
         # push val from memory segment
         # get base addr
@@ -474,6 +520,11 @@ def translateVMFile(vmFile, codeWriter):
 
         if cmdType == 'C_ARITHMETIC':
             codeWriter.writeArithmetic(parser.arg1())
+        elif cmdType == 'C_PUSH' and parser.peek()[:2] in DIRECT_POPS:
+            # a push straight into a fixed address skips the stack
+            segment, index = parser.arg1(), parser.arg2()
+            parser.advance()
+            codeWriter.writeMove(segment, index, parser.arg1(), parser.arg2())
         elif cmdType in ['C_PUSH', 'C_POP']:
             codeWriter.writePushPop(cmdType, parser.arg1(), parser.arg2())
         elif cmdType == 'C_LABEL':
@@ -0,0 +1,583 @@
+import hashlib
+import os
+import struct
+import sys
+import time
+from array import array
+
+from hvm import Parser
+
+RAM_SIZE = 32768
+
+# same fixed addresses as CodeWriter / the hack assembler
+SP = 0
+LCL = 1
+ARG = 2
+THIS = 3
+THAT = 4
+TEMP = 5
+STATIC = 16
+
+# snapshot file: header then the 32K ram words, all little-endian
+SNAPSHOT_MAGIC = b'VMSNAP\0\0'
+SNAPSHOT_HEADER = struct.Struct('<8s32sqi?')  # magic, program digest, steps, pc, halted
+
+# opcodes, roughly in order of how often compiled jack runs them
+PUSH_CONSTANT = 0
+PUSH_LOCAL = 1
+PUSH_ARGUMENT = 2
+POP_LOCAL = 3
+PUSH_THIS = 4
+PUSH_THAT = 5
+PUSH_STATIC = 6
+POP_STATIC = 7
+ADD = 8
+SUB = 9
+IF_GOTO = 10
+GOTO = 11
+NOT = 12
+LT = 13
+GT = 14
+EQ = 15
+AND = 16
+OR = 17
+NEG = 18
+POP_ARGUMENT = 19
+POP_THIS = 20
+POP_THAT = 21
+PUSH_TEMP = 22
+POP_TEMP = 23
+PUSH_POINTER = 24
+POP_POINTER = 25
+CALL = 26
+FUNCTION = 27
+RETURN = 28
+HALT = 29
+CALL_NATIVE = 30
+
+PUSH_OPS = {
+    'constant': PUSH_CONSTANT,
+    'local': PUSH_LOCAL,
+    'argument': PUSH_ARGUMENT,
+    'this': PUSH_THIS,
+    'that': PUSH_THAT,
+    'temp': PUSH_TEMP,
+    'pointer': PUSH_POINTER,
+    'static': PUSH_STATIC,
+}
+
+POP_OPS = {
+    'local': POP_LOCAL,
+    'argument': POP_ARGUMENT,
+    'this': POP_THIS,
+    'that': POP_THAT,
+    'temp': POP_TEMP,
+    'pointer': POP_POINTER,
+    'static': POP_STATIC,
+}
+
+ARITHMETIC_OPS = {
+    'add': ADD,
+    'sub': SUB,
+    'neg': NEG,
+    'eq': EQ,
+    'gt': GT,
+    'lt': LT,
+    'and': AND,
+    'or': OR,
+    'not': NOT,
+}
+
+
+def wrap(value):
+    # wrap a python int to a signed 16-bit hack word
+    return ((value + 32768) & 0xFFFF) - 32768
+
+
+class VMError(Exception):
+    # raised for programs the emulator cannot load or run
+    pass
+
+
+class Program:
+    # vm files pre-decoded into (opcode, arg1, arg2) tuples
+    #
+    # labels and call targets are resolved to command indexes up front
+    # and static variables get the ram addresses the assembler would
+    # give them (first reference first, files in translation order).
+
+    def __init__(self, vmFiles):
+        self.commands = []
+        self.functions = {}  # name -> command index
+        self.names = []  # function name for each command
+        self.statics = {}  # 'File.i' -> ram address
+        labels = {}
+        pending = []  # (command index, label or function name)
+
+        for vmFile in vmFiles:
+            parser = Parser(vmFile)
+            fileName = os.path.splitext(os.path.basename(vmFile))[0]
+            currentFunction = None
+
+            while parser.hasMoreCommands():
+                parser.advance()
+                cmdType = parser.commandType()
+                index = len(self.commands)
+
+                if cmdType == 'C_ARITHMETIC':
+                    self.append((ARITHMETIC_OPS[parser.arg1()], 0, 0), currentFunction)
+                elif cmdType == 'C_PUSH':
+                    segment, value = parser.arg1(), parser.arg2()
+                    if segment not in PUSH_OPS:
+                        raise VMError(f"{vmFile}: unknown segment '{segment}'")
+                    self.append((PUSH_OPS[segment], self.segmentArg(segment, value, fileName), 0), currentFunction)
+                elif cmdType == 'C_POP':
+                    segment, value = parser.arg1(), parser.arg2()
+                    if segment not in POP_OPS:
+                        raise VMError(f"{vmFile}: cannot pop to '{segment}'")
+                    self.append((POP_OPS[segment], self.segmentArg(segment, value, fileName), 0), currentFunction)
+                elif cmdType == 'C_LABEL':
+                    # labels take no command, they name the next one
+                    labels[self.scoped(currentFunction, parser.arg1())] = index
+                elif cmdType == 'C_GOTO':
+                    pending.append((index, self.scoped(currentFunction, parser.arg1())))
+                    self.append((GOTO, 0, 0), currentFunction)
+                elif cmdType == 'C_IF':
+                    pending.append((index, self.scoped(currentFunction, parser.arg1())))
+                    self.append((IF_GOTO, 0, 0), currentFunction)
+                elif cmdType == 'C_FUNCTION':
+                    currentFunction = parser.arg1()
+                    self.functions[currentFunction] = index
+                    self.append((FUNCTION, parser.arg2(), 0), currentFunction)
+                elif cmdType == 'C_CALL':
+                    pending.append((index, parser.arg1()))
+                    self.append((CALL, parser.arg1(), parser.arg2()), currentFunction)
+                elif cmdType == 'C_RETURN':
+                    self.append((RETURN, 0, 0), currentFunction)
+                else:
+                    raise VMError(f"{vmFile}: unknown command '{parser.current_command}'")
+
+        # resolve jumps now that every label and function is known
+        for index, name in pending:
+            op, arg1, arg2 = self.commands[index]
+            if op == CALL:
+                if name in self.functions:
+                    self.commands[index] = (CALL, self.functions[name], arg2)
+                else:
+                    # left as a name, an error only if it is ever called
+                    self.commands[index] = (CALL, name, arg2)
+            elif name not in labels:
+                raise VMError(f"undefined label '{name}'")
+            elif op == GOTO and labels[name] == index:
+                # 'label X / goto X' spins forever
+                self.commands[index] = (HALT, 0, 0)
+            else:
+                self.commands[index] = (op, labels[name], 0)
+
+    def append(self, command, functionName):
+        self.commands.append(command)
+        self.names.append(functionName)
+
+    def scoped(self, functionName, label):
+        # labels are scoped to their function, like CodeWriter does
+        if functionName:
+            return f"{functionName}${label}"
+        return label
+
+    def segmentArg(self, segment, index, fileName):
+        # pre-compute fixed addresses for the direct segments
+        if segment == 'temp':
+            return TEMP + index
+        if segment == 'pointer':
+            return THIS + index
+        if segment == 'static':
+            return self.staticAddress(f"{fileName}.{index}")
+        return index
+
+    def staticAddress(self, symbol):
+        # ram address of a 'File.i' static, handing out the next free one
+        # for symbols the program never mentions
+        if symbol not in self.statics:
+            self.statics[symbol] = STATIC + len(self.statics)
+        return self.statics[symbol]
+
+
+def listVMFiles(inputPath):
+    # a .vm file, or every .vm file of a directory in hvm's order
+    if os.path.isfile(inputPath):
+        if not inputPath.endswith('.vm'):
+            raise VMError("Input file must have .vm extension")
+        return [inputPath]
+    vmFiles = sorted(f for f in os.listdir(inputPath) if f.endswith('.vm'))
+    if not vmFiles:
+        raise VMError(f"No .vm files found in directory '{inputPath}'")
+    return [os.path.join(inputPath, f) for f in vmFiles]
+
+
+class VMEmulator:
+    # executes pre-decoded vm commands over a hack-layout ram
+
+    def __init__(self, program):
+        self.program = program
+        self.commands = program.commands
+        self.ram = array('h', bytes(2 * RAM_SIZE))
+        self.pc = 0
+        self.steps = 0
+        self.halted = False
+
+    def installNatives(self, functions):
+        # route calls to the named functions to python callables instead
+        # of their vm code. each callable takes the call's arguments and
+        # returns the value to push, and may set self.halted to stop.
+        # returns how many call sites were replaced
+        commands = list(self.program.commands)
+        replaced = 0
+        for index, (op, arg1, arg2) in enumerate(commands):
+            if op != CALL:
+                continue
+            name = arg1 if arg1.__class__ is str else self.program.names[arg1]
+            if name in functions:
+                commands[index] = (CALL_NATIVE, functions[name], arg2)
+                replaced += 1
+        self.commands = commands
+        return replaced
+
+    def bootstrap(self, entry='Sys.init'):
+        # same as CodeWriter.writeInit: SP = 256, call Sys.init
+        if entry not in self.program.functions:
+            raise VMError(f"bootstrap needs a {entry} function")
+        ram = self.ram
+        ram[SP] = 256
+        # the frame of a call from outside the program
+        for offset, value in enumerate([-1, ram[LCL], ram[ARG], ram[THIS], ram[THAT]]):
+            ram[256 + offset] = value
+        ram[SP] = 261
+        ram[ARG] = 256
+        ram[LCL] = 261
+        self.pc = self.program.functions[entry]
+
+    def digest(self):
+        # identifies the program and its static layout, snapshots only
+        # resume on the same one (with or without natives installed)
+        text = repr((self.program.commands, sorted(self.program.statics.items())))
+        return hashlib.sha256(text.encode()).digest()
+
+    def saveSnapshot(self, filename):
+        # write ram and pc so a later run can pick up from here,
+        # e.g. from Main.main after Sys.init has done all the os setup
+        ram = array('h', self.ram)
+        if sys.byteorder == 'big':
+            ram.byteswap()
+        with open(filename, 'wb') as file:
+            file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, self.digest(), self.steps,
+                                            self.pc, self.halted))
+            ram.tofile(file)
+
+    def loadSnapshot(self, filename):
+        # restore a saveSnapshot file taken with the same program loaded
+        with open(filename, 'rb') as file:
+            header = file.read(SNAPSHOT_HEADER.size)
+            data = file.read()
+        if len(header) != SNAPSHOT_HEADER.size or len(data) != 2 * RAM_SIZE:
+            raise VMError(f"'{filename}' is not a snapshot")
+        magic, digest, steps, pc, halted = SNAPSHOT_HEADER.unpack(header)
+        if magic != SNAPSHOT_MAGIC:
+            raise VMError(f"'{filename}' is not a snapshot")
+        if digest != self.digest():
+            raise VMError(f"'{filename}' was taken with a different program")
+        ram = array('h', data)
+        if sys.byteorder == 'big':
+            ram.byteswap()
+        self.ram[:] = ram
+        self.steps, self.pc, self.halted = steps, pc, halted
+
+    def callNative(self, name, nArgs):
+        # hook for calls to functions that are not in the program
+        raise VMError(f"call to undefined function '{name}'")
+
+    def run(self, maxSteps=None, breakpoints=()):
+        # run vm commands, returns the number executed
+        # stops on a halt loop (or a native halt), on entering a breakpoint
+        # function index, when falling off the end, or after maxSteps commands
+        if self.halted:
+            return 0
+        commands = self.commands
+        ram = self.ram
+        size = len(commands)
+        breaks = set(breakpoints)
+        limit = maxSteps if maxSteps is not None else -1
+        pc = self.pc
+        count = 0
+
+        while count != limit and pc < size:
+            if breaks and pc in breaks and count:
+                break
+            op, arg1, arg2 = commands[pc]
+            pc += 1
+            count += 1
+
+            if op == PUSH_CONSTANT:
+                sp = ram[SP]
+                ram[sp] = arg1
+                ram[SP] = sp + 1
+            elif op == PUSH_LOCAL:
+                sp = ram[SP]
+                ram[sp] = ram[ram[LCL] + arg1]
+                ram[SP] = sp + 1
+            elif op == PUSH_ARGUMENT:
+                sp = ram[SP]
+                ram[sp] = ram[ram[ARG] + arg1]
+                ram[SP] = sp + 1
+            elif op == POP_LOCAL:
+                sp = ram[SP] - 1
+                ram[SP] = sp
+                ram[ram[LCL] + arg1] = ram[sp]
+            elif op == PUSH_THIS:
+                sp = ram[SP]
+                ram[sp] = ram[(ram[THIS] + arg1) & 0x7FFF]
+                ram[SP] = sp + 1
+            elif op == PUSH_THAT:
+                sp = ram[SP]
+                ram[sp] = ram[(ram[THAT] + arg1) & 0x7FFF]
+                ram[SP] = sp + 1
+            elif op == PUSH_STATIC or op == PUSH_TEMP or op == PUSH_POINTER:
+                sp = ram[SP]
+                ram[sp] = ram[arg1]
+                ram[SP] = sp + 1
+            elif op == POP_STATIC or op == POP_TEMP or op == POP_POINTER:
+                sp = ram[SP] - 1
+                ram[SP] = sp
+                ram[arg1] = ram[sp]
+            elif op == ADD:
+                sp = ram[SP] - 1
+                ram[SP] = sp
+                ram[sp - 1] = wrap(ram[sp - 1] + ram[sp])
+            elif op == SUB:
+                sp = ram[SP] - 1
+                ram[SP] = sp
+                ram[sp - 1] = wrap(ram[sp - 1] - ram[sp])
+            elif op == IF_GOTO:
+                sp = ram[SP] - 1
+                ram[SP] = sp
+                if ram[sp]:
+                    pc = arg1
+            elif op == GOTO:
+                pc = arg1
+            elif op == NOT:
+                sp = ram[SP] - 1
+                ram[sp] = ~ram[sp]
+            elif op == LT or op == GT or op == EQ:
+                # hvm compares the wrapped difference x - y, so do the same
+                sp = ram[SP] - 1
+                ram[SP] = sp
+                diff = wrap(ram[sp - 1] - ram[sp])
+                if op == LT:
+                    result = diff < 0
+                elif op == GT:
+                    result = diff > 0
+                else:
+                    result = diff == 0
+                ram[sp - 1] = -1 if result else 0
+            elif op == AND:
+                sp = ram[SP] - 1
+                ram[SP] = sp
+                ram[sp - 1] = ram[sp - 1] & ram[sp]
+            elif op == OR:
+                sp = ram[SP] - 1
+                ram[SP] = sp
+                ram[sp - 1] = ram[sp - 1] | ram[sp]
+            elif op == NEG:
+                sp = ram[SP] - 1
+                ram[sp] = wrap(-ram[sp])
+            elif op == POP_ARGUMENT:
+                sp = ram[SP] - 1
+                ram[SP] = sp
+                ram[ram[ARG] + arg1] = ram[sp]
+            elif op == POP_THIS:
+                sp = ram[SP] - 1
+                ram[SP] = sp
+                ram[(ram[THIS] + arg1) & 0x7FFF] = ram[sp]
+            elif op == POP_THAT:
+                sp = ram[SP] - 1
+                ram[SP] = sp
+                ram[(ram[THAT] + arg1) & 0x7FFF] = ram[sp]
+            elif op == CALL:
+                if arg1.__class__ is str:
+                    # not part of the program, let a subclass handle it
+                    self.pc = pc
+                    self.callNative(arg1, arg2)
+                    continue
+                sp = ram[SP]
+                ram[sp] = pc
+                ram[sp + 1] = ram[LCL]
+                ram[sp + 2] = ram[ARG]
+                ram[sp + 3] = ram[THIS]
+                ram[sp + 4] = ram[THAT]
+                ram[ARG] = sp - arg2
+                sp += 5
+                ram[LCL] = sp
+                ram[SP] = sp
+                pc = arg1
+            elif op == CALL_NATIVE:
+                # no frame: pop the arguments, push what python returned
+                sp = ram[SP] - arg2
+                ram[sp] = arg1(*ram[sp:sp + arg2])
+                ram[SP] = sp + 1
+                if self.halted:
+                    break
+            elif op == FUNCTION:
+                sp = ram[SP]
+                for i in range(arg1):
+                    ram[sp + i] = 0
+                ram[SP] = sp + arg1
+            elif op == RETURN:
+                frame = ram[LCL]
+                pc = ram[frame - 5]
+                argBase = ram[ARG]
+                ram[argBase] = ram[ram[SP] - 1]
+                ram[SP] = argBase + 1
+                ram[THAT] = ram[frame - 1]
+                ram[THIS] = ram[frame - 2]
+                ram[ARG] = ram[frame - 3]
+                ram[LCL] = ram[frame - 4]
+                if pc < 0:
+                    # returned out of the bootstrap frame
+                    pc = size
+            elif op == HALT:
+                pc -= 1
+                self.halted = True
+                break
+
+        self.pc = pc
+        self.steps += count
+        return count
+
+
+def parseRange(text):
+    # 'n' or 'n-m' -> (first, last)
+    if '-' in text:
+        first, last = text.split('-', 1)
+        return int(first), int(last)
+    return int(text), int(text)
+
+
+def main():
+    # run a vm program headlessly
+    usage = ("Usage: python hvme.py <file_or_directory> [-y|-n] [-steps N] "
+             "[-native [CLASS,...]] [-until FUNCTION] [-set ADDR=VALUE]... "
+             "[-dump ADDR[-ADDR]]... [-resume FILE] [-save FILE] [-bench]")
+    if len(sys.argv) < 2:
+        print(usage)
+        sys.exit(1)
+
+    inputPath = sys.argv[1]
+    if not os.path.exists(inputPath):
+        print(f"Error: Path '{inputPath}' not found")
+        sys.exit(1)
+
+    writeBootstrap = True
+    maxSteps = None
+    until = []
+    sets = []
+    dumps = []
+    bench = False
+    native = None  # os classes to run natively, [] for all of them
+    resume = None
+    save = None
+
+    args = sys.argv[2:]
+    i = 0
+    try:
+        while i < len(args):
+            arg = args[i]
+            if arg == '-n':
+                writeBootstrap = False
+                i += 1
+            elif arg == '-y':
+                writeBootstrap = True
+                i += 1
+            elif arg == '-steps':
+                maxSteps = int(args[i + 1])
+                i += 2
+            elif arg == '-until':
+                until.append(args[i + 1])
+                i += 2
+            elif arg == '-set':
+                address, value = args[i + 1].split('=')
+                sets.append((int(address), int(value)))
+                i += 2
+            elif arg == '-dump':
+                dumps.append(parseRange(args[i + 1]))
+                i += 2
+            elif arg == '-bench':
+                bench = True
+                i += 1
+            elif arg == '-resume':
+                resume = args[i + 1]
+                i += 2
+            elif arg == '-save':
+                save = args[i + 1]
+                i += 2
+            elif arg == '-native':
+                native = []
+                i += 1
+                if i < len(args) and not args[i].startswith('-'):
+                    native = args[i].split(',')
+                    i += 1
+            else:
+                raise ValueError(f"unknown option '{arg}'")
+    except (IndexError, ValueError) as e:
+        print(f"Error: {e}")
+        print(usage)
+        sys.exit(1)
+
+    try:
+        program = Program(listVMFiles(inputPath))
+        emulator = VMEmulator(program)
+        breakpoints = []
+        for name in until:
+            if name not in program.functions:
+                raise VMError(f"no function named '{name}'")
+            breakpoints.append(program.functions[name])
+        if native is not None:
+            from hvmos import NativeOS
+            nativeOS = NativeOS(emulator)
+            replaced = emulator.installNatives(nativeOS.functions(native or None))
+            print(f"Running {replaced} os call sites natively")
+        if resume:
+            # the snapshot stands in for the bootstrap, -set applies on top
+            emulator.loadSnapshot(resume)
+        for address, value in sets:
+            emulator.ram[address] = wrap(value)
+        if writeBootstrap and not resume:
+            if native is not None and 'Sys.init' not in program.functions:
+                # no os vm code at all: do Sys.init's work in python
+                nativeOS.boot()
+                emulator.bootstrap('Main.main')
+            else:
+                emulator.bootstrap()
+
+        start = time.perf_counter()
+        executed = emulator.run(maxSteps, breakpoints)
+        elapsed = time.perf_counter() - start
+    except (VMError, OSError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    where = program.names[emulator.pc] if emulator.pc < len(program.names) else None
+    print(f"Stopped at command {emulator.pc} ({where or 'end'}) after {executed} commands")
+    if save:
+        emulator.saveSnapshot(save)
+        print(f"Saved snapshot to '{save}'")
+    for first, last in dumps:
+        for address in range(first, last + 1):
+            print(f"RAM[{address}] = {emulator.ram[address]}")
+
+    if bench:
+        rate = executed / elapsed if elapsed > 0 else 0
+        print(f"Ran {executed} vm commands in {elapsed:.3f}s "
+              f"({rate:,.0f} commands/sec)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,634 @@
+from array import array
+
+from hvme import VMError, wrap
+
+# native python versions of the 12/ jack os
+#
+# each function is a line-by-line port of the jack code in 12/, using the
+# same static variables (at the ram addresses the program gave them) and
+# carving the same heap blocks, so a run with natives leaves the heap,
+# the screen and every os static exactly as the real os would. only the
+# scratch the vm code would have left behind differs: temp 0 and the
+# dead stack frames above SP.
+#
+# arithmetic follows hvm: + and - wrap to 16 bits and < / > compare the
+# wrapped difference, which is what the compiled os actually computes.
+
+MASK = 0x7FFF
+SCREEN = 16384
+KBD = 24576
+
+# Output.initMap's create() calls, in the order it makes them
+FONT = (
+    (0, 63, 63, 63, 63, 63, 63, 63, 63, 63, 0, 0),
+    (32, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0),
+    (33, 12, 30, 30, 30, 12, 12, 0, 12, 12, 0, 0),
+    (34, 54, 54, 20, 0, 0, 0, 0, 0, 0, 0, 0),
+    (35, 0, 18, 18, 63, 18, 18, 63, 18, 18, 0, 0),
+    (36, 12, 30, 51, 3, 30, 48, 51, 30, 12, 12, 0),
+    (37, 0, 0, 35, 51, 24, 12, 6, 51, 49, 0, 0),
+    (38, 12, 30, 30, 12, 54, 27, 27, 27, 54, 0, 0),
+    (39, 12, 12, 6, 0, 0, 0, 0, 0, 0, 0, 0),
+    (40, 24, 12, 6, 6, 6, 6, 6, 12, 24, 0, 0),
+    (41, 6, 12, 24, 24, 24, 24, 24, 12, 6, 0, 0),
+    (42, 0, 0, 0, 51, 30, 63, 30, 51, 0, 0, 0),
+    (43, 0, 0, 0, 12, 12, 63, 12, 12, 0, 0, 0),
+    (44, 0, 0, 0, 0, 0, 0, 0, 12, 12, 6, 0),
+    (45, 0, 0, 0, 0, 0, 63, 0, 0, 0, 0, 0),
+    (46, 0, 0, 0, 0, 0, 0, 0, 12, 12, 0, 0),
+    (47, 0, 0, 32, 48, 24, 12, 6, 3, 1, 0, 0),
+    (48, 12, 30, 51, 51, 51, 51, 51, 30, 12, 0, 0),
+    (49, 12, 14, 15, 12, 12, 12, 12, 12, 63, 0, 0),
+    (50, 30, 51, 48, 24, 12, 6, 3, 51, 63, 0, 0),
+    (51, 30, 51, 48, 48, 28, 48, 48, 51, 30, 0, 0),
+    (52, 16, 24, 28, 26, 25, 63, 24, 24, 60, 0, 0),
+    (53, 63, 3, 3, 31, 48, 48, 48, 51, 30, 0, 0),
+    (54, 28, 6, 3, 3, 31, 51, 51, 51, 30, 0, 0),
+    (55, 63, 49, 48, 48, 24, 12, 12, 12, 12, 0, 0),
+    (56, 30, 51, 51, 51, 30, 51, 51, 51, 30, 0, 0),
+    (57, 30, 51, 51, 51, 62, 48, 48, 24, 14, 0, 0),
+    (58, 0, 0, 12, 12, 0, 0, 12, 12, 0, 0, 0),
+    (59, 0, 0, 12, 12, 0, 0, 12, 12, 6, 0, 0),
+    (60, 0, 0, 24, 12, 6, 3, 6, 12, 24, 0, 0),
+    (61, 0, 0, 0, 63, 0, 0, 63, 0, 0, 0, 0),
+    (62, 0, 0, 3, 6, 12, 24, 12, 6, 3, 0, 0),
+    (64, 30, 51, 51, 59, 59, 59, 27, 3, 30, 0, 0),
+    (63, 30, 51, 51, 24, 12, 12, 0, 12, 12, 0, 0),
+    (65, 0, 0, 12, 30, 51, 51, 63, 51, 51, 51, 0),
+    (66, 31, 51, 51, 51, 31, 51, 51, 51, 31, 0, 0),
+    (67, 28, 54, 35, 3, 3, 3, 35, 54, 28, 0, 0),
+    (68, 15, 27, 51, 51, 51, 51, 51, 27, 15, 0, 0),
+    (69, 63, 51, 35, 11, 15, 11, 35, 51, 63, 0, 0),
+    (70, 63, 51, 35, 11, 15, 11, 3, 3, 3, 0, 0),
+    (71, 28, 54, 35, 3, 59, 51, 51, 54, 44, 0, 0),
+    (72, 51, 51, 51, 51, 63, 51, 51, 51, 51, 0, 0),
+    (73, 30, 12, 12, 12, 12, 12, 12, 12, 30, 0, 0),
+    (74, 60, 24, 24, 24, 24, 24, 27, 27, 14, 0, 0),
+    (75, 51, 51, 51, 27, 15, 27, 51, 51, 51, 0, 0),
+    (76, 3, 3, 3, 3, 3, 3, 35, 51, 63, 0, 0),
+    (77, 33, 51, 63, 63, 51, 51, 51, 51, 51, 0, 0),
+    (78, 51, 51, 55, 55, 63, 59, 59, 51, 51, 0, 0),
+    (79, 30, 51, 51, 51, 51, 51, 51, 51, 30, 0, 0),
+    (80, 31, 51, 51, 51, 31, 3, 3, 3, 3, 0, 0),
+    (81, 30, 51, 51, 51, 51, 51, 63, 59, 30, 48, 0),
+    (82, 31, 51, 51, 51, 31, 27, 51, 51, 51, 0, 0),
+    (83, 30, 51, 51, 6, 28, 48, 51, 51, 30, 0, 0),
+    (84, 63, 63, 45, 12, 12, 12, 12, 12, 30, 0, 0),
+    (85, 51, 51, 51, 51, 51, 51, 51, 51, 30, 0, 0),
+    (86, 51, 51, 51, 51, 51, 30, 30, 12, 12, 0, 0),
+    (87, 51, 51, 51, 51, 51, 63, 63, 63, 18, 0, 0),
+    (88, 51, 51, 30, 30, 12, 30, 30, 51, 51, 0, 0),
+    (89, 51, 51, 51, 51, 30, 12, 12, 12, 30, 0, 0),
+    (90, 63, 51, 49, 24, 12, 6, 35, 51, 63, 0, 0),
+    (91, 30, 6, 6, 6, 6, 6, 6, 6, 30, 0, 0),
+    (92, 0, 0, 1, 3, 6, 12, 24, 48, 32, 0, 0),
+    (93, 30, 24, 24, 24, 24, 24, 24, 24, 30, 0, 0),
+    (94, 8, 28, 54, 0, 0, 0, 0, 0, 0, 0, 0),
+    (95, 0, 0, 0, 0, 0, 0, 0, 0, 0, 63, 0),
+    (96, 6, 12, 24, 0, 0, 0, 0, 0, 0, 0, 0),
+    (97, 0, 0, 0, 14, 24, 30, 27, 27, 54, 0, 0),
+    (98, 3, 3, 3, 15, 27, 51, 51, 51, 30, 0, 0),
+    (99, 0, 0, 0, 30, 51, 3, 3, 51, 30, 0, 0),
+    (100, 48, 48, 48, 60, 54, 51, 51, 51, 30, 0, 0),
+    (101, 0, 0, 0, 30, 51, 63, 3, 51, 30, 0, 0),
+    (102, 28, 54, 38, 6, 15, 6, 6, 6, 15, 0, 0),
+    (103, 0, 0, 30, 51, 51, 51, 62, 48, 51, 30, 0),
+    (104, 3, 3, 3, 27, 55, 51, 51, 51, 51, 0, 0),
+    (105, 12, 12, 0, 14, 12, 12, 12, 12, 30, 0, 0),
+    (106, 48, 48, 0, 56, 48, 48, 48, 48, 51, 30, 0),
+    (107, 3, 3, 3, 51, 27, 15, 15, 27, 51, 0, 0),
+    (108, 14, 12, 12, 12, 12, 12, 12, 12, 30, 0, 0),
+    (109, 0, 0, 0, 29, 63, 43, 43, 43, 43, 0, 0),
+    (110, 0, 0, 0, 29, 51, 51, 51, 51, 51, 0, 0),
+    (111, 0, 0, 0, 30, 51, 51, 51, 51, 30, 0, 0),
+    (112, 0, 0, 0, 30, 51, 51, 51, 31, 3, 3, 0),
+    (113, 0, 0, 0, 30, 51, 51, 51, 62, 48, 48, 0),
+    (114, 0, 0, 0, 29, 55, 51, 3, 3, 7, 0, 0),
+    (115, 0, 0, 0, 30, 51, 6, 24, 51, 30, 0, 0),
+    (116, 4, 6, 6, 15, 6, 6, 6, 54, 28, 0, 0),
+    (117, 0, 0, 0, 27, 27, 27, 27, 27, 54, 0, 0),
+    (118, 0, 0, 0, 51, 51, 51, 51, 30, 12, 0, 0),
+    (119, 0, 0, 0, 51, 51, 51, 63, 63, 18, 0, 0),
+    (120, 0, 0, 0, 51, 30, 12, 12, 30, 51, 0, 0),
+    (121, 0, 0, 0, 51, 51, 51, 62, 48, 24, 15, 0),
+    (122, 0, 0, 0, 63, 27, 12, 6, 51, 63, 0, 0),
+    (123, 56, 12, 12, 12, 7, 12, 12, 12, 56, 0, 0),
+    (124, 12, 12, 12, 12, 12, 12, 12, 12, 12, 0, 0),
+    (125, 7, 12, 12, 12, 56, 12, 12, 12, 7, 0, 0),
+    (126, 38, 45, 25, 0, 0, 0, 0, 0, 0, 0, 0),
+)
+
+
+def lt(x, y):
+    return wrap(x - y) < 0
+
+
+def gt(x, y):
+    return wrap(x - y) > 0
+
+
+class NativeOS:
+    # the os functions for one emulator, keyed by jack name
+
+    NAMES = {
+        'Math.init': 'mathInit',
+        'Math.multiply': 'multiply',
+        'Math.bit': 'bit',
+        'Math.divide': 'divide',
+        'Math.sqrt': 'sqrt',
+        'Math.max': 'max',
+        'Math.min': 'min',
+        'Math.abs': 'abs',
+        'Memory.init': 'memoryInit',
+        'Memory.peek': 'peek',
+        'Memory.poke': 'poke',
+        'Memory.alloc': 'alloc',
+        'Memory.deAlloc': 'deAlloc',
+        'Array.new': 'alloc',
+        'Array.dispose': 'deAlloc',
+        'Screen.init': 'screenInit',
+        'Screen.clearScreen': 'clearScreen',
+        'Screen.setColor': 'setColor',
+        'Screen.drawPixel': 'drawPixel',
+        'Screen.drawLine': 'drawLine',
+        'Screen.drawRectangle': 'drawRectangle',
+        'Screen.drawCircle': 'drawCircle',
+        'Output.init': 'outputInit',
+        'Output.initMap': 'initMap',
+        'Output.create': 'create',
+        'Output.getMap': 'getMap',
+        'Output.moveCursor': 'moveCursor',
+        'Output.printChar': 'printChar',
+        'Output.printString': 'printString',
+        'Output.printInt': 'printInt',
+        'Output.println': 'println',
+        'Output.backSpace': 'backSpace',
+        'String.new': 'stringNew',
+        'String.dispose': 'stringDispose',
+        'String.length': 'length',
+        'String.charAt': 'charAt',
+        'String.setCharAt': 'setCharAt',
+        'String.appendChar': 'appendChar',
+        'String.eraseLastChar': 'eraseLastChar',
+        'String.intValue': 'intValue',
+        'String.setInt': 'setInt',
+        'String.int2String': 'int2String',
+        'String.newLine': 'newLine',
+        'String.backSpace': 'stringBackSpace',
+        'String.doubleQuote': 'doubleQuote',
+        'Keyboard.init': 'keyboardInit',
+        'Keyboard.keyPressed': 'keyPressed',
+        'Sys.halt': 'halt',
+        'Sys.wait': 'wait',
+        'Sys.error': 'error',
+    }
+
+    # Keyboard.read* and Sys.init stay in vm code: the first wait on
+    # the keyboard and the second has to call Main.main
+
+    def __init__(self, emulator):
+        self.emulator = emulator
+        self.ram = emulator.ram
+        static = emulator.program.staticAddress
+        self.memRam = static('Memory.0')
+        self.memHeap = static('Memory.1')
+        self.freeList = static('Memory.2')
+        self.heapBottom = static('Memory.3')
+        self.mathN = static('Math.0')
+        self.mathPowers = static('Math.1')
+        self.color = static('Screen.0')
+        self.screenPowers = static('Screen.1')
+        self.charMaps = static('Output.0')
+        self.cursorRow = static('Output.1')
+        self.cursorCol = static('Output.2')
+
+    def functions(self, classes=None):
+        # name -> bound method, optionally only for some os classes
+        table = {}
+        for name, method in self.NAMES.items():
+            if classes is None or name.split('.')[0] in classes:
+                table[name] = getattr(self, method)
+        return table
+
+    def boot(self):
+        # Sys.init up to calling Main.main
+        self.memoryInit()
+        self.mathInit()
+        self.screenInit()
+        self.outputInit()
+        self.keyboardInit()
+
+    # Memory
+
+    def memoryInit(self):
+        ram = self.ram
+        ram[self.memRam] = 0
+        ram[self.memHeap] = 2048
+        ram[self.heapBottom] = 16384
+        ram[self.freeList] = ram[self.memHeap]
+        heap = ram[self.memHeap]
+        ram[heap & MASK] = wrap(ram[self.heapBottom] - heap)
+        ram[(heap + 1) & MASK] = 0
+        return 0
+
+    def peek(self, address):
+        ram = self.ram
+        return ram[(ram[self.memRam] + address) & MASK]
+
+    def poke(self, address, value):
+        ram = self.ram
+        ram[(ram[self.memRam] + address) & MASK] = value
+        return 0
+
+    def alloc(self, size):
+        ram = self.ram
+        base = ram[self.memRam]
+        curr = ram[self.freeList]
+        while curr != 0:
+            length = ram[(base + curr) & MASK]
+            if gt(length, wrap(size + 2)):
+                ram[(base + curr) & MASK] = wrap(length - wrap(size + 1))
+                block = wrap(curr + ram[(base + curr) & MASK])
+                ram[(base + block) & MASK] = wrap(size + 1)
+                return wrap(block + 1)
+            curr = ram[(base + curr + 1) & MASK]
+        return 0
+
+    def deAlloc(self, o):
+        ram = self.ram
+        block = wrap(o - 1)
+        ram[(ram[self.memRam] + block + 1) & MASK] = ram[self.freeList]
+        ram[self.freeList] = block
+        return 0
+
+    # Math
+
+    def mathInit(self):
+        ram = self.ram
+        ram[self.mathN] = 16
+        powers = self.alloc(ram[self.mathN])
+        ram[self.mathPowers] = powers
+        val = 1
+        i = 0
+        while lt(i, ram[self.mathN]):
+            ram[(powers + i) & MASK] = val
+            val = wrap(val + val)
+            i += 1
+        return 0
+
+    def multiply(self, x, y):
+        # the shift-and-add loop over n = 16 bits is exactly x * y mod 2^16
+        return wrap(x * y)
+
+    def bit(self, x, i):
+        ram = self.ram
+        return -1 if x & ram[(ram[self.mathPowers] + i) & MASK] else 0
+
+    def divide(self, x, y):
+        if 0 <= x and 0 < y < 16384:
+            # no step of the recursion can overflow here, so it is floor
+            return x // y
+        if y == 0:
+            # the jack version recurses until the stack runs into the heap
+            raise VMError("Math.divide: division by zero")
+        neg = (x < 0) == (y > 0)
+        absX = self.abs(x)
+        absY = self.abs(y)
+        if gt(absY, absX):
+            return 0
+        if wrap(absY + absY) < 0:
+            q = 0
+        else:
+            q = self.divide(absX, wrap(absY + absY))
+        if lt(wrap(absX - wrap(wrap(2 * q) * absY)), absY):
+            result = wrap(q + q)
+        else:
+            result = wrap(q + q + 1)
+        if neg:
+            return wrap(-result)
+        return result
+
+    def sqrt(self, x):
+        ram = self.ram
+        powers = ram[self.mathPowers]
+        y = 0
+        j = 7
+        while j > -1:
+            approx = wrap(y + ram[(powers + j) & MASK])
+            approxSq = wrap(approx * approx)
+            if approxSq >= 0 and not gt(approxSq, x):
+                y = approx
+            j -= 1
+        return y
+
+    def max(self, a, b):
+        return a if gt(a, b) else b
+
+    def min(self, a, b):
+        return a if lt(a, b) else b
+
+    def abs(self, x):
+        return wrap(-x) if x < 0 else x
+
+    # Screen
+
+    def screenInit(self):
+        ram = self.ram
+        ram[self.color] = -1
+        powers = self.alloc(16)
+        ram[self.screenPowers] = powers
+        val = 1
+        for i in range(16):
+            ram[(powers + i) & MASK] = val
+            val = wrap(val + val)
+        return 0
+
+    def clearScreen(self):
+        ram = self.ram
+        base = ram[self.memRam]
+        if base == 0:
+            ram[SCREEN:KBD] = array('h', bytes(2 * (KBD - SCREEN)))
+        else:
+            for i in range(SCREEN, KBD):
+                ram[(base + i) & MASK] = 0
+        return 0
+
+    def setColor(self, b):
+        self.ram[self.color] = b
+        return 0
+
+    def drawPixel(self, x, y):
+        ram = self.ram
+        address = wrap(SCREEN + wrap(y * 32) + self.divide(x, 16))
+        value = self.peek(address)
+        mask = ram[(ram[self.screenPowers] + (x & 15)) & MASK]
+        if ram[self.color]:
+            value = value | mask
+        else:
+            value = value & ~mask
+        self.poke(address, value)
+        return 0
+
+    def drawLine(self, x1, y1, x2, y2):
+        if gt(x1, x2):
+            x1, x2 = x2, x1
+            y1, y2 = y2, y1
+        dx = wrap(x2 - x1)
+        dy = wrap(y2 - y1)
+        a = b = diff = 0
+
+        if dx == 0:
+            if gt(y1, y2):
+                y1, y2 = y2, y1
+            while not gt(y1, y2):
+                self.drawPixel(x1, y1)
+                y1 = wrap(y1 + 1)
+            return 0
+
+        if dy == 0:
+            while not gt(x1, x2):
+                self.drawPixel(x1, y1)
+                x1 = wrap(x1 + 1)
+            return 0
+
+        if dy > 0:
+            while not gt(a, dx) and not gt(b, dy):
+                self.drawPixel(wrap(x1 + a), wrap(y1 + b))
+                if diff < 0:
+                    a = wrap(a + 1)
+                    diff = wrap(diff + dy)
+                else:
+                    b = wrap(b + 1)
+                    diff = wrap(diff - dx)
+        else:
+            while not gt(a, dx) and not lt(b, dy):
+                self.drawPixel(wrap(x1 + a), wrap(y1 + b))
+                if diff < 0:
+                    a = wrap(a + 1)
+                    diff = wrap(diff - dy)
+                else:
+                    b = wrap(b - 1)
+                    diff = wrap(diff - dx)
+        return 0
+
+    def drawRectangle(self, x1, y1, x2, y2):
+        r = y1
+        while not gt(r, y2):
+            self.drawLine(x1, r, x2, r)
+            r = wrap(r + 1)
+        return 0
+
+    def drawCircle(self, x, y, r):
+        if gt(r, 181):
+            return 0
+        dy = wrap(-r)
+        r2 = wrap(r * r)
+        while not gt(dy, r):
+            halfWidth = self.sqrt(wrap(r2 - wrap(dy * dy)))
+            row = wrap(y + dy)
+            self.drawLine(wrap(x - halfWidth), row, wrap(x + halfWidth), row)
+            dy = wrap(dy + 1)
+        return 0
+
+    # Output
+
+    def outputInit(self):
+        self.initMap()
+        self.moveCursor(0, 0)
+        return 0
+
+    def initMap(self):
+        self.ram[self.charMaps] = self.alloc(127)
+        for row in FONT:
+            self.create(*row)
+        return 0
+
+    def create(self, index, *rows):
+        ram = self.ram
+        bitmap = self.alloc(11)
+        ram[(ram[self.charMaps] + index) & MASK] = bitmap
+        for i, value in enumerate(rows):
+            ram[(bitmap + i) & MASK] = value
+        return 0
+
+    def getMap(self, c):
+        ram = self.ram
+        if lt(c, 32) or gt(c, 126):
+            c = 0
+        return ram[(ram[self.charMaps] + c) & MASK]
+
+    def moveCursor(self, i, j):
+        self.ram[self.cursorRow] = i
+        self.ram[self.cursorCol] = j
+        return 0
+
+    def printChar(self, c):
+        ram = self.ram
+        bitmap = self.getMap(c)
+        col = ram[self.cursorCol]
+        address = wrap(SCREEN + wrap(ram[self.cursorRow] * 352) + self.divide(col, 2))
+        for i in range(11):
+            val = ram[(bitmap + i) & MASK]
+            target = wrap(address + i * 32)
+            if col & 1 == 0:
+                val = (self.peek(target) & -256) | val
+            else:
+                val = (self.peek(target) & 255) | wrap(val * 256)
+            self.poke(target, val)
+
+        col = wrap(col + 1)
+        ram[self.cursorCol] = col
+        if gt(col, 63):
+            ram[self.cursorCol] = 0
+            ram[self.cursorRow] = wrap(ram[self.cursorRow] + 1)
+            if gt(ram[self.cursorRow], 22):
+                ram[self.cursorRow] = 0
+        return 0
+
+    def printString(self, s):
+        i = 0
+        while lt(i, self.length(s)):
+            self.printChar(self.charAt(s, i))
+            i = wrap(i + 1)
+        return 0
+
+    def printInt(self, i):
+        s = self.stringNew(6)
+        self.setInt(s, i)
+        self.printString(s)
+        self.stringDispose(s)
+        return 0
+
+    def println(self):
+        ram = self.ram
+        ram[self.cursorCol] = 0
+        ram[self.cursorRow] = wrap(ram[self.cursorRow] + 1)
+        if gt(ram[self.cursorRow], 22):
+            ram[self.cursorRow] = 0
+        return 0
+
+    def backSpace(self):
+        ram = self.ram
+        if gt(ram[self.cursorCol], 0):
+            ram[self.cursorCol] = wrap(ram[self.cursorCol] - 1)
+        elif gt(ram[self.cursorRow], 0):
+            ram[self.cursorRow] = wrap(ram[self.cursorRow] - 1)
+            ram[self.cursorCol] = 63
+        return 0
+
+    # String, fields are buffer, length, maxLen
+
+    def stringNew(self, maxLength):
+        ram = self.ram
+        this = self.alloc(3)
+        if maxLength == 0:
+            maxLength = 1
+        if maxLength > 0:
+            ram[this & MASK] = self.alloc(maxLength)
+        ram[(this + 2) & MASK] = maxLength
+        ram[(this + 1) & MASK] = 0
+        return this
+
+    def stringDispose(self, this):
+        if self.ram[(this + 2) & MASK] > 0:
+            self.deAlloc(self.ram[this & MASK])
+        self.deAlloc(this)
+        return 0
+
+    def length(self, this):
+        return self.ram[(this + 1) & MASK]
+
+    def charAt(self, this, j):
+        ram = self.ram
+        return ram[(ram[this & MASK] + j) & MASK]
+
+    def setCharAt(self, this, j, c):
+        ram = self.ram
+        ram[(ram[this & MASK] + j) & MASK] = c
+        return 0
+
+    def appendChar(self, this, c):
+        ram = self.ram
+        length = ram[(this + 1) & MASK]
+        if lt(length, ram[(this + 2) & MASK]):
+            ram[(ram[this & MASK] + length) & MASK] = c
+            ram[(this + 1) & MASK] = wrap(length + 1)
+        return this
+
+    def eraseLastChar(self, this):
+        ram = self.ram
+        if gt(ram[(this + 1) & MASK], 0):
+            ram[(this + 1) & MASK] = wrap(ram[(this + 1) & MASK] - 1)
+        return 0
+
+    def intValue(self, this):
+        ram = self.ram
+        buffer = ram[this & MASK]
+        length = ram[(this + 1) & MASK]
+        val = 0
+        i = 0
+        neg = False
+        if gt(length, 0) and ram[buffer & MASK] == 45:
+            neg = True
+            i = 1
+        while lt(i, length):
+            d = wrap(ram[(buffer + i) & MASK] - 48)
+            if gt(d, -1) and lt(d, 10):
+                val = wrap(val * 10 + d)
+                i = wrap(i + 1)
+            else:
+                i = length
+        if neg:
+            return wrap(-val)
+        return val
+
+    def setInt(self, this, val):
+        self.ram[(this + 1) & MASK] = 0
+        if val < 0:
+            val = wrap(-val)
+            self.appendChar(this, 45)
+        self.int2String(this, val)
+        return 0
+
+    def int2String(self, this, val):
+        lastDigit = wrap(val - wrap(self.divide(val, 10) * 10))
+        c = wrap(lastDigit + 48)
+        if lt(val, 10):
+            self.appendChar(this, c)
+        else:
+            self.int2String(this, self.divide(val, 10))
+            self.appendChar(this, c)
+        return 0
+
+    def newLine(self):
+        return 128
+
+    def stringBackSpace(self):
+        return 129
+
+    def doubleQuote(self):
+        return 34
+
+    # Keyboard and Sys
+
+    def keyboardInit(self):
+        return 0
+
+    def keyPressed(self):
+        return self.peek(KBD)
+
+    def halt(self):
+        self.emulator.halted = True
+        return 0
+
+    def wait(self, duration):
+        # the jack version only burns time
+        return 0
+
+    def error(self, errorCode):
+        s = self.stringNew(3)
+        for c in b'ERR':
+            self.appendChar(s, c)
+        self.printString(s)
+        self.printInt(errorCode)
+        return self.halt()
@@ -1,199 +1,116 @@
 import os
+import re
 import sys
 
 
+# Jack language keywords
+KEYWORDS = frozenset(
+    [
+        "class",
+        "constructor",
+        "function",
+        "method",
+        "field",
+        "static",
+        "var",
+        "int",
+        "char",
+        "boolean",
+        "void",
+        "true",
+        "false",
+        "null",
+        "this",
+        "let",
+        "do",
+        "if",
+        "else",
+        "while",
+        "return",
+    ]
+)
+
+# every lexical element, each match skipping the whitespace and comments
+# before it. a string is matched as a whole before any comment can start,
+# so '//' inside a string literal stays in the string, and block comments
+# may span lines
+TOKEN_PATTERN = re.compile(
+    r"""
+    \s*(?:(?://[^\n]*|/\*[^*]*\*+(?:[^/*][^*]*\*+)*/)\s*)*
+    (?:
+        (?P<IDENTIFIER>[A-Za-z_]\w*)
+        | (?P<SYMBOL>[{}()\[\].,;+\-*&|<>=~]|/(?!\*))
+        | (?P<INT_CONST>\d+)
+        | "(?P<STRING_CONST>[^"\n]*)"
+        | (?P<end>\Z)
+        | (?P<error>/\*|"|.)
+    )
+    """,
+    re.VERBOSE,
+)
+
+# error messages for the error group
+UNTERMINATED = {"/*": "unterminated comment", '"': "unterminated string"}
+
+
+def tokenize(text, filename="<jack>"):
+    # scan the whole source once into (type, value, line, col) tokens
+    tokens = []
+    append = tokens.append
+    count = text.count
+    line = 1
+    lineStart = -1  # offset of the newline before the current line
+    last = 0
+    for m in TOKEN_PATTERN.finditer(text):
+        kind = m.lastgroup
+        start = m.start(kind)
+        newlines = count("\n", last, start)
+        if newlines:
+            line += newlines
+            lineStart = text.rfind("\n", last, start)
+        last = m.end()
+        value = m[kind]
+        if kind == "IDENTIFIER":
+            if value in KEYWORDS:
+                kind = "KEYWORD"
+        elif kind == "end":
+            break
+        elif kind == "error":
+            what = UNTERMINATED.get(value, f"unexpected character {value!r}")
+            raise ValueError(f"{filename}:{line}:{start - lineStart}: {what}")
+        append((kind, value, line, start - lineStart))
+    return tokens
+
+
 class JackTokenizer:
     # tokenizes Jack source code
 
     def __init__(self, filename):
-        # load and clean Jack file
-        self.lines = []
-        self.currentLine = ""
-        self.lineNumber = 0
-        self.inComment = False
+        # read the whole file and scan it once
+        with open(filename, "r") as file:
+            self.tokens = tokenize(file.read(), filename)
+        self.position = 0  # index of the next token
 
         # current token info
         self.currentToken = ""
         self.tokenType = ""
-
-        # Jack language keywords
-        self.keywords = {
-            "class",
-            "constructor",
-            "function",
-            "method",
-            "field",
-            "static",
-            "var",
-            "int",
-            "char",
-            "boolean",
-            "void",
-            "true",
-            "false",
-            "null",
-            "this",
-            "let",
-            "do",
-            "if",
-            "else",
-            "while",
-            "return",
-        }
-
-        # Jack language symbols
-        self.symbols = {
-            "{",
-            "}",
-            "(",
-            ")",
-            "[",
-            "]",
-            ".",
-            ",",
-            ";",
-            "+",
-            "-",
-            "*",
-            "/",
-            "&",
-            "|",
-            "<",
-            ">",
-            "=",
-            "~",
-        }
-
-        # read file
-        with open(filename, "r") as file:
-            self.lines = file.readlines()
+        self.line = 0
+        self.col = 0
 
     def hasMoreTokens(self):
         # check if more tokens available
-        # still have content on current line or more lines to process
-        return len(self.currentLine) > 0 or self.lineNumber < len(self.lines)
+        return self.position < len(self.tokens)
 
     def advance(self):
         # get next token from input
-        while True:
-            # check if current line is empty
-            if len(self.currentLine) == 0:
-                # get new line
-                if self.lineNumber >= len(self.lines):
-                    # end of file
-                    return False
-
-                self.currentLine = self.lines[self.lineNumber]
-                self.lineNumber += 1
-
-                # remove newline
-                if self.currentLine.endswith("\n"):
-                    self.currentLine = self.currentLine[:-1]
-
-                # handle comments
-                # remove inline comments
-                if "//" in self.currentLine:
-                    self.currentLine = self.currentLine[: self.currentLine.index("//")]
-
-                # handle multi-line comments
-                if self.inComment:
-                    # check for comment end
-                    if "*/" in self.currentLine:
-                        endIdx = self.currentLine.index("*/") + 2
-                        self.currentLine = self.currentLine[endIdx:]
-                        self.inComment = False
-                    else:
-                        # still in comment, skip this line
-                        self.currentLine = ""
-                        continue
-
-                # check for comment start
-                if "/*" in self.currentLine:
-                    startIdx = self.currentLine.index("/*")
-                    # check if comment ends on same line
-                    if "*/" in self.currentLine[startIdx:]:
-                        endIdx = self.currentLine.index("*/", startIdx) + 2
-                        self.currentLine = (
-                            self.currentLine[:startIdx]
-                            + " "
-                            + self.currentLine[endIdx:]
-                        )
-                    else:
-                        # comment continues to next line
-                        self.currentLine = self.currentLine[:startIdx]
-                        self.inComment = True
-
-                # replace tabs with spaces and strip
-                self.currentLine = self.currentLine.replace("\t", " ").strip()
-
-                # if line is empty after cleaning, get next line
-                if len(self.currentLine) == 0:
-                    continue
-
-            # parse token from current line
-            # skip leading spaces
-            self.currentLine = self.currentLine.lstrip()
-
-            if len(self.currentLine) == 0:
-                continue
-
-            # check first character
-            firstChar = self.currentLine[0]
-
-            # check if symbol
-            if firstChar in self.symbols:
-                self.currentToken = firstChar
-                self.tokenType = "SYMBOL"
-                self.currentLine = self.currentLine[1:]
-                return True
-
-            # check if string constant
-            if firstChar == '"':
-                # find closing quote
-                endIdx = self.currentLine.index('"', 1)
-                self.currentToken = self.currentLine[1:endIdx]
-                self.tokenType = "STRING_CONST"
-                self.currentLine = self.currentLine[endIdx + 1 :]
-                return True
-
-            # check if integer constant
-            if firstChar.isdigit():
-                # parse integer
-                endIdx = 0
-                while (
-                    endIdx < len(self.currentLine)
-                    and self.currentLine[endIdx].isdigit()
-                ):
-                    endIdx += 1
-                self.currentToken = self.currentLine[:endIdx]
-                self.tokenType = "INT_CONST"
-                self.currentLine = self.currentLine[endIdx:]
-                return True
-
-            # must be identifier or keyword
-            if firstChar.isalpha() or firstChar == "_":
-                # parse identifier
-                endIdx = 0
-                while endIdx < len(self.currentLine):
-                    char = self.currentLine[endIdx]
-                    if char.isalnum() or char == "_":
-                        endIdx += 1
-                    else:
-                        break
-
-                self.currentToken = self.currentLine[:endIdx]
-                self.currentLine = self.currentLine[endIdx:]
-
-                # check if keyword
-                if self.currentToken in self.keywords:
-                    self.tokenType = "KEYWORD"
-                else:
-                    self.tokenType = "IDENTIFIER"
-
-                return True
-
-            # shouldn't reach here with valid Jack code
-            self.currentLine = self.currentLine[1:]
+        if self.position >= len(self.tokens):
+            # end of file
+            return False
+        self.tokenType, self.currentToken, self.line, self.col = self.tokens[
+            self.position
+        ]
+        self.position += 1
+        return True
 
     def getTokenType(self):
         # return current token type
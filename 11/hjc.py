@@ -1,212 +1,149 @@
+import io
 import os
+import re
 import sys
 
 
-class JackTokenizer:
-    # tokenizes Jack source code
-
-    def __init__(self, filename):
-        # load and clean Jack file
-        self.lines = []
-        self.currentLine = ""
-        self.lineNumber = 0
-        self.inComment = False
-
-        # current token info
-        self.currentToken = ""
-        self.tokenType = ""
-
-        # Jack language keywords
-        self.keywords = {
-            "class",
-            "constructor",
-            "function",
-            "method",
-            "field",
-            "static",
-            "var",
-            "int",
-            "char",
-            "boolean",
-            "void",
-            "true",
-            "false",
-            "null",
-            "this",
-            "let",
-            "do",
-            "if",
-            "else",
-            "while",
-            "return",
-        }
-
-        # Jack language symbols
-        self.symbols = {
-            "{",
-            "}",
-            "(",
-            ")",
-            "[",
-            "]",
-            ".",
-            ",",
-            ";",
-            "+",
-            "-",
-            "*",
-            "/",
-            "&",
-            "|",
-            "<",
-            ">",
-            "=",
-            "~",
-        }
-
-        # read file
-        with open(filename, "r") as file:
-            self.lines = file.readlines()
+# Jack language keywords
+KEYWORDS = frozenset(
+    [
+        "class",
+        "constructor",
+        "function",
+        "method",
+        "field",
+        "static",
+        "var",
+        "int",
+        "char",
+        "boolean",
+        "void",
+        "true",
+        "false",
+        "null",
+        "this",
+        "let",
+        "do",
+        "if",
+        "else",
+        "while",
+        "return",
+    ]
+)
+
+# whitespace and comments, block comments may span lines
+SKIP = r"\s*(?:(?://[^\n]*|/\*[^*]*\*+(?:[^/*][^*]*\*+)*/)\s*)*"
+
+# every lexical element, each match skipping the whitespace and comments
+# before it. a string is matched as a whole before any comment can start,
+# so '//' inside a string literal stays in the string
+TOKEN_PATTERN = re.compile(
+    SKIP
+    + r"""
+    (?:
+        (?P<IDENTIFIER>[A-Za-z_]\w*)
+        | (?P<SYMBOL>[{}()\[\].,;+\-*&|<>=~]|/(?!\*))
+        | (?P<INT_CONST>[0-9]+)
+        | "(?P<STRING_CONST>[^"\n]*)"
+        | (?P<end>\Z)
+        | (?P<error>/\*|"|.)
+    )
+    """,
+    re.VERBOSE,
+)
+
+# the same scan capturing only the lexeme, strings with their quotes, so
+# findall can split a whole file without a match object per token.
+# anything it cannot classify is handed to tokenize() to report
+LEXEME_PATTERN = re.compile(SKIP + r'("[^"\n]*"|[A-Za-z_]\w*|[0-9]+|/\*|\S|\Z)')
+
+# parser kind of each keyword and symbol, the lexeme itself
+KINDS = {lexeme: lexeme for lexeme in KEYWORDS | frozenset("{}()[].,;+-*/&|<>=~")}
+
+# parser kind of any other lexeme, by its first character
+FIRST_CHAR_KINDS = {'"': "STRING_CONST"}
+FIRST_CHAR_KINDS.update((c, "INT_CONST") for c in "0123456789")
+FIRST_CHAR_KINDS.update(
+    (c, "IDENTIFIER") for c in "_abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+)
+
+# error messages for the error group
+UNTERMINATED = {"/*": "unterminated comment", '"': "unterminated string"}
+
+
+def tokenize(text, filename="<jack>"):
+    # scan the whole source once into (type, value, line, col) tokens
+    tokens = []
+    append = tokens.append
+    count = text.count
+    line = 1
+    lineStart = -1  # offset of the newline before the current line
+    last = 0
+    for m in TOKEN_PATTERN.finditer(text):
+        kind = m.lastgroup
+        start = m.start(kind)
+        newlines = count("\n", last, start)
+        if newlines:
+            line += newlines
+            lineStart = text.rfind("\n", last, start)
+        last = m.end()
+        value = m[kind]
+        if kind == "IDENTIFIER":
+            if value in KEYWORDS:
+                kind = "KEYWORD"
+        elif kind == "end":
+            break
+        elif kind == "error":
+            what = UNTERMINATED.get(value, f"unexpected character {value!r}")
+            raise ValueError(f"{filename}:{line}:{start - lineStart}: {what}")
+        append((kind, value, line, start - lineStart))
+    return tokens
 
-    def hasMoreTokens(self):
-        # check if more tokens available
-        # still have content on current line or more lines to process
-        return len(self.currentLine) > 0 or self.lineNumber < len(self.lines)
-
-    def advance(self):
-        # get next token from input
-        while True:
-            # check if current line is empty
-            if len(self.currentLine) == 0:
-                # get new line
-                if self.lineNumber >= len(self.lines):
-                    # end of file
-                    return False
-
-                self.currentLine = self.lines[self.lineNumber]
-                self.lineNumber += 1
-
-                # remove newline
-                if self.currentLine.endswith("\n"):
-                    self.currentLine = self.currentLine[:-1]
-
-                # handle comments
-                # remove inline comments
-                if "//" in self.currentLine:
-                    self.currentLine = self.currentLine[: self.currentLine.index("//")]
-
-                # handle multi-line comments
-
-                if self.inComment:
-                    if "*/" in self.currentLine:
-                        self.currentLine = self.currentLine[
-                            self.currentLine.index("*/") + 2 :
-                        ]
-                        self.inComment = False
-                    else:
-                        self.currentLine = ""
-                        continue
-
-                if "/*" in self.currentLine:
-                    if "*/" in self.currentLine:
-                        before = self.currentLine[: self.currentLine.index("/*")]
-                        after = self.currentLine[self.currentLine.index("*/") + 2 :]
-                        self.currentLine = before + after
-                    else:
-                        self.currentLine = self.currentLine[
-                            : self.currentLine.index("/*")
-                        ]
-                        self.inComment = True
-
-                self.currentLine = self.currentLine.strip()
-                if len(self.currentLine) == 0:
-                    continue
-
-            # skip whitespace
-            while len(self.currentLine) > 0 and self.currentLine[0] in " \t":
-                self.currentLine = self.currentLine[1:]
-
-            if len(self.currentLine) == 0:
-                continue
-
-            # check for string constant
-            if self.currentLine[0] == '"':
-                end = self.currentLine.index('"', 1)
-                self.currentToken = self.currentLine[1:end]
-                self.tokenType = "STRING_CONST"
-                self.currentLine = self.currentLine[end + 1 :]
-                return True
-
-            # check for symbols
-            if self.currentLine[0] in self.symbols:
-                self.currentToken = self.currentLine[0]
-                self.tokenType = "SYMBOL"
-                self.currentLine = self.currentLine[1:]
-                return True
-
-            # check for numbers
-            if self.currentLine[0].isdigit():
-                i = 0
-                while i < len(self.currentLine) and self.currentLine[i].isdigit():
-                    i += 1
-                self.currentToken = self.currentLine[:i]
-                self.tokenType = "INT_CONST"
-                self.currentLine = self.currentLine[i:]
-                return True
-
-            # check for identifiers/keywords
-            if self.currentLine[0].isalpha() or self.currentLine[0] == "_":
-                i = 0
-                while i < len(self.currentLine) and (
-                    self.currentLine[i].isalnum() or self.currentLine[i] == "_"
-                ):
-                    i += 1
-                self.currentToken = self.currentLine[:i]
-
-                if self.currentToken in self.keywords:
-                    self.tokenType = "KEYWORD"
-                else:
-                    self.tokenType = "IDENTIFIER"
-
-                self.currentLine = self.currentLine[i:]
-                return True
-
-            # shouldn't reach here with valid Jack code
-            self.currentLine = self.currentLine[1:]
-
-    def getTokenType(self):
-        # return current token type
-        return self.tokenType
-
-    def keyword(self):
-        # return keyword (only if token is keyword)
-        if self.tokenType == "KEYWORD":
-            return self.currentToken
-        return None
 
-    def symbol(self):
-        # return symbol (only if token is symbol)
-        if self.tokenType == "SYMBOL":
-            return self.currentToken
-        return None
+class JackTokenizer:
+    # tokenizes Jack source code into parallel token arrays
+    #
+    # kinds[i] is the text of a keyword or symbol, or the token type of an
+    # identifier or constant, so the parser can dispatch on one lookup.
+    # values[i] is the token itself, an int for integer constants. a
+    # trailing "EOF" entry lets the parser peek past the last token.
 
-    def identifier(self):
-        # return identifier (only if token is identifier)
-        if self.tokenType == "IDENTIFIER":
-            return self.currentToken
-        return None
+    __slots__ = ("filename", "text", "kinds", "values", "positions")
 
-    def intVal(self):
-        # return integer value (only if token is int)
-        if self.tokenType == "INT_CONST":
-            return int(self.currentToken)
-        return None
-
-    def stringVal(self):
-        # return string value (only if token is string)
-        if self.tokenType == "STRING_CONST":
-            return self.currentToken
-        return None
+    def __init__(self, filename):
+        # read the whole file and split it into lexemes in one call
+        with open(filename, "r") as file:
+            self.text = text = file.read()
+        self.filename = filename
+        self.positions = None
+
+        lexemes = LEXEME_PATTERN.findall(text)
+        while lexemes and not lexemes[-1]:
+            lexemes.pop()  # the empty matches at the end of the text
+        kinds = [
+            KINDS.get(lexeme) or FIRST_CHAR_KINDS.get(lexeme[0]) for lexeme in lexemes
+        ]
+        if None in kinds or '"' in lexemes:
+            # an unterminated comment or string, or a stray character
+            tokenize(text, filename)
+
+        self.kinds = kinds + ["EOF"]
+        self.values = [
+            int(lexeme)
+            if kind == "INT_CONST"
+            else lexeme[1:-1] if kind == "STRING_CONST" else lexeme
+            for kind, lexeme in zip(kinds, lexemes)
+        ] + ["end of file"]
+
+    def where(self, index):
+        # file:line:col of a token for error messages, positions are only
+        # worked out when first needed
+        if self.positions is None:
+            tokens = tokenize(self.text, self.filename)
+            self.positions = [token[2:] for token in tokens]
+            self.positions.append(self.positions[-1] if self.positions else (1, 1))
+        line, col = self.positions[index]
+        return f"{self.filename}:{line}:{col}"
 
 
 class SymbolTable:
@@ -298,7 +235,10 @@ class VMWriter:
     # emits VM commands into a file
 
     def __init__(self, output_file):
-        self.output = open(output_file, "w")
+        # output_file is a path, or a text stream to write to
+        if isinstance(output_file, str):
+            output_file = open(output_file, "w")
+        self.output = output_file
 
     def writePush(self, segment, index):
         # write a VM push command
@@ -341,666 +281,1965 @@ class VMWriter:
         self.output.close()
 
 
-class CompilationEngine:
-    # compiles Jack source code to VM code
-
-    def __init__(self, tokenizer, output_file):
-        self.tokenizer = tokenizer
-        self.vmWriter = VMWriter(output_file)
-        self.symbolTable = SymbolTable()
-        self.className = ""
-        self.labelCount = 0
-        self.whileLabelCount = 0
-        self.ifLabelCount = 0
-
-    def getNextWhileLabel(self):
-        # generate unique while labels
-        exp_label = f"WHILE_EXP{self.whileLabelCount}"
-        end_label = f"WHILE_END{self.whileLabelCount}"
-        self.whileLabelCount += 1
-        return exp_label, end_label
+class Node:
+    # base of the AST node classes
+    #
+    # nodes are plain records: the fields are listed in __slots__ and set
+    # positionally by the constructor, so a class is built and walked
+    # without per-instance dicts
 
-    def getNextIfLabel(self):
-        # generate unique if labels
-        true_label = f"IF_TRUE{self.ifLabelCount}"
-        false_label = f"IF_FALSE{self.ifLabelCount}"
-        end_label = f"IF_END{self.ifLabelCount}"
-        self.ifLabelCount += 1
-        return true_label, false_label, end_label
+    __slots__ = ()
 
-    def compileClass(self):
-        # compile a complete class
-        # 'class'
-        if not self.tokenizer.advance():
-            return
+    def __init__(self, *values):
+        for field, value in zip(self.__slots__, values):
+            setattr(self, field, value)
 
-        # className
-        if not self.tokenizer.advance():
-            return
-        self.className = self.tokenizer.identifier()
+    def __repr__(self):
+        fields = ", ".join(repr(getattr(self, field)) for field in self.__slots__)
+        return f"{type(self).__name__}({fields})"
 
-        # '{'
-        if not self.tokenizer.advance():
-            return
 
-        # classVarDec*
-        if not self.tokenizer.advance():
-            return
-        while (
-            self.tokenizer.getTokenType() == "KEYWORD"
-            and self.tokenizer.keyword() in ["static", "field"]
-        ):
-            self.compileClassVarDec()
+class ClassNode(Node):
+    # name: str, nFields: int, nStatics: int, subroutines: [SubroutineNode],
+    # dead: [statement], what dead code elimination removed
+    __slots__ = ("name", "nFields", "nStatics", "subroutines", "dead")
 
-        # subroutineDec*
-        while (
-            self.tokenizer.getTokenType() == "KEYWORD"
-            and self.tokenizer.keyword() in ["constructor", "function", "method"]
-        ):
-            self.compileSubroutine()
 
-        # '}'
-        # Already at the closing brace
-
-    def compileClassVarDec(self):
-        # compile a static or field declaration
-        # ('static' | 'field')
-        kind = "STATIC" if self.tokenizer.keyword() == "static" else "FIELD"
-
-        # type
-        self.tokenizer.advance()
-        type_name = self.tokenizer.currentToken
-
-        # varName
-        self.tokenizer.advance()
-        name = self.tokenizer.identifier()
-        self.symbolTable.define(name, type_name, kind)
-
-        # (',' varName)*
-        self.tokenizer.advance()
-        while (
-            self.tokenizer.getTokenType() == "SYMBOL" and self.tokenizer.symbol() == ","
-        ):
-            self.tokenizer.advance()  # ','
-            name = self.tokenizer.identifier()
-            self.symbolTable.define(name, type_name, kind)
-            self.tokenizer.advance()
+class SubroutineNode(Node):
+    # kind: 'constructor' | 'function' | 'method', returnType: str,
+    # name: str, nArgs: int (with 'this' for methods), nLocals: int,
+    # body: [statement]
+    __slots__ = ("kind", "returnType", "name", "nArgs", "nLocals", "body")
 
-        # ';'
-        self.tokenizer.advance()
 
-    def compileSubroutine(self):
-        # compile a method, function, or constructor
-        self.symbolTable.startSubroutine()
+class Let(Node):
+    # target: Var | Index, value: expression
+    __slots__ = ("target", "value")
 
-        # ('constructor' | 'function' | 'method')
-        subroutineType = self.tokenizer.keyword()
 
-        # If method, add 'this' as first argument
-        if subroutineType == "method":
-            self.symbolTable.define("this", self.className, "ARG")
+class If(Node):
+    # condition: expression, then: [statement], otherwise: [statement] or
+    # None when there is no else part
+    __slots__ = ("condition", "then", "otherwise")
 
-        # returnType
-        self.tokenizer.advance()
 
-        # subroutineName
-        self.tokenizer.advance()
-        subroutineName = self.tokenizer.identifier()
+class While(Node):
+    # condition: expression, body: [statement]
+    __slots__ = ("condition", "body")
 
-        # '('
-        self.tokenizer.advance()
 
-        # parameterList
-        self.tokenizer.advance()
-        self.compileParameterList()
+class Do(Node):
+    # call: Call, or the expression an inlined call was replaced with
+    __slots__ = ("call",)
 
-        # ')'
-        # Already past the closing parenthesis
 
-        # subroutineBody
-        self.compileSubroutineBody(subroutineType, subroutineName)
+class Return(Node):
+    # value: expression or None
+    __slots__ = ("value",)
 
-    def compileParameterList(self):
-        # compile a parameter list
-        if self.tokenizer.getTokenType() == "SYMBOL" and self.tokenizer.symbol() == ")":
-            return
 
-        # type
-        type_name = self.tokenizer.currentToken
+class Const(Node):
+    # value: int, an integer constant 0..32767
+    __slots__ = ("value",)
 
-        # varName
-        self.tokenizer.advance()
-        name = self.tokenizer.identifier()
-        self.symbolTable.define(name, type_name, "ARG")
 
-        # (',' type varName)*
-        self.tokenizer.advance()
-        while (
-            self.tokenizer.getTokenType() == "SYMBOL" and self.tokenizer.symbol() == ","
-        ):
-            self.tokenizer.advance()  # ','
-            type_name = self.tokenizer.currentToken
-            self.tokenizer.advance()
-            name = self.tokenizer.identifier()
-            self.symbolTable.define(name, type_name, "ARG")
-            self.tokenizer.advance()
-
-    def compileSubroutineBody(self, subroutineType, subroutineName):
-        # compile subroutine body
-        # '{'
-        self.tokenizer.advance()
-
-        # varDec* - need to advance to first token after '{'
-        if not (
-            self.tokenizer.getTokenType() == "KEYWORD"
-            and self.tokenizer.keyword() == "var"
-        ):
-            self.tokenizer.advance()
+class String(Node):
+    # value: str
+    __slots__ = ("value",)
 
-        while (
-            self.tokenizer.getTokenType() == "KEYWORD"
-            and self.tokenizer.keyword() == "var"
-        ):
-            self.compileVarDec()
 
-        # Write function declaration
-        nLocals = self.symbolTable.getVarCount("VAR")
-        functionName = f"{self.className}.{subroutineName}"
-        self.vmWriter.writeFunction(functionName, nLocals)
+class Keyword(Node):
+    # value: 'true' | 'false' | 'null' | 'this'
+    __slots__ = ("value",)
 
-        # Handle constructor/method setup
-        if subroutineType == "constructor":
-            # Allocate memory for object
-            nFields = self.symbolTable.getVarCount("FIELD")
-            self.vmWriter.writePush("constant", nFields)
-            self.vmWriter.writeCall("Memory.alloc", 1)
-            self.vmWriter.writePop("pointer", 0)
-        elif subroutineType == "method":
-            # Set 'this' pointer
-            self.vmWriter.writePush("argument", 0)
-            self.vmWriter.writePop("pointer", 0)
 
-        # statements
-        self.compileStatements()
+class Var(Node):
+    # name: str, segment: VM segment, index: int, type: str
+    __slots__ = ("name", "segment", "index", "type")
 
-        # '}'
-        if self.tokenizer.getTokenType() == "SYMBOL" and self.tokenizer.symbol() == "}":
-            self.tokenizer.advance()
-
-    def compileVarDec(self):
-        # compile a var declaration
-        # 'var'
-        self.tokenizer.advance()
-
-        # type
-        type_name = self.tokenizer.currentToken
-
-        # varName
-        self.tokenizer.advance()
-        name = self.tokenizer.identifier()
-        self.symbolTable.define(name, type_name, "VAR")
-
-        # (',' varName)*
-        self.tokenizer.advance()
-        while (
-            self.tokenizer.getTokenType() == "SYMBOL" and self.tokenizer.symbol() == ","
-        ):
-            self.tokenizer.advance()  # ','
-            name = self.tokenizer.identifier()
-            self.symbolTable.define(name, type_name, "VAR")
-            self.tokenizer.advance()
 
-        # ';'
-        if self.tokenizer.getTokenType() == "SYMBOL" and self.tokenizer.symbol() == ";":
-            self.tokenizer.advance()
-
-    def compileStatements(self):
-        # compile a sequence of statements
-        # We should already be positioned at the first statement token
-        while (
-            self.tokenizer.getTokenType() == "KEYWORD"
-            and self.tokenizer.keyword() in ["let", "if", "while", "do", "return"]
-        ):
-            keyword = self.tokenizer.keyword()
-            if keyword == "let":
-                self.compileLet()
-            elif keyword == "if":
-                self.compileIf()
-            elif keyword == "while":
-                self.compileWhile()
-            elif keyword == "do":
-                self.compileDo()
-            elif keyword == "return":
-                self.compileReturn()
+class Index(Node):
+    # array: Var, index: expression
+    __slots__ = ("array", "index")
 
-    def compileLet(self):
-        # compile a let statement
-        # 'let'
-        self.tokenizer.advance()
 
-        # varName
-        varName = self.tokenizer.identifier()
+class Call(Node):
+    # name: 'Class.subroutine', receiver: expression passed as 'this', or
+    # None for functions and constructors, args: [expression]
+    __slots__ = ("name", "receiver", "args")
 
-        # Check for array access
-        self.tokenizer.advance()
-        isArray = (
-            self.tokenizer.getTokenType() == "SYMBOL" and self.tokenizer.symbol() == "["
-        )
 
-        if isArray:
-            # Push array base address
-            self.pushIdentifier(varName)
+class Binary(Node):
+    # op: one of + - * / & | < > =, left, right: expression
+    __slots__ = ("op", "left", "right")
 
-            # '['
-            self.tokenizer.advance()
 
-            # expression (array index)
-            self.compileExpression()
+class Unary(Node):
+    # op: '-' | '~', operand: expression
+    __slots__ = ("op", "operand")
 
-            # ']'
-            self.tokenizer.advance()
 
-            # Add base + index
-            self.vmWriter.writeArithmetic("add")
+# VM segment of each symbol table kind
+SEGMENTS = {"STATIC": "static", "FIELD": "this", "ARG": "argument", "VAR": "local"}
 
-        # '='
-        self.tokenizer.advance()
 
-        # expression (value to assign)
-        self.compileExpression()
+class Parser:
+    # parses the tokens of one class into a ClassNode
+    #
+    # the parser walks the tokenizer's arrays with an index, so lookahead
+    # is a plain list lookup and no token ever has to be pushed back.
+    # variables are resolved against the symbol table as they are read,
+    # since Jack declares everything before its first use
 
-        if isArray:
-            # Pop value to temp, set that pointer, pop value to that 0
-            self.vmWriter.writePop("temp", 0)
-            self.vmWriter.writePop("pointer", 1)
-            self.vmWriter.writePush("temp", 0)
-            self.vmWriter.writePop("that", 0)
-        else:
-            # Simple assignment - pop the expression result to the variable
-            self.popIdentifier(varName)
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.kinds = tokenizer.kinds
+        self.values = tokenizer.values
+        self.pos = 0  # index of the current token
+        self.symbolTable = SymbolTable()
+        self.className = ""
 
-        # ';'
-        if self.tokenizer.getTokenType() == "SYMBOL" and self.tokenizer.symbol() == ";":
-            self.tokenizer.advance()
+    def peek(self, offset=0):
+        # kind of the token offset places ahead of the current one
+        return self.kinds[self.pos + offset]
 
-    def compileIf(self):
-        # compile an if statement
-        trueLabel, falseLabel, endLabel = self.getNextIfLabel()
+    def advance(self):
+        # return the current token's value and move past it
+        value = self.values[self.pos]
+        self.pos += 1
+        return value
 
-        # 'if'
-        self.tokenizer.advance()
+    def error(self, message):
+        # syntax error at the current token
+        raise ValueError(f"{self.tokenizer.where(self.pos)}: {message}")
 
-        # '('
-        self.tokenizer.advance()
+    def expect(self, kind):
+        # move past a required keyword or symbol
+        if self.kinds[self.pos] != kind:
+            self.error(f"expected '{kind}', found '{self.values[self.pos]}'")
+        self.pos += 1
 
-        # expression
-        self.compileExpression()
+    def identifier(self):
+        # return a required identifier and move past it
+        if self.kinds[self.pos] != "IDENTIFIER":
+            self.error(f"expected an identifier, found '{self.values[self.pos]}'")
+        return self.advance()
 
-        # ')'
-        self.tokenizer.advance()
+    def variable(self, name):
+        # Var node for a declared name
+        kind = self.symbolTable.kindOf(name)
+        if kind == "NONE":
+            self.pos -= 1
+            self.error(f"undefined variable '{name}'")
+        return Var(
+            name,
+            SEGMENTS[kind],
+            self.symbolTable.indexOf(name),
+            self.symbolTable.typeOf(name),
+        )
 
-        # Jump to true branch if condition is true
-        self.vmWriter.writeIf(trueLabel)
-        self.vmWriter.writeGoto(falseLabel)
-        self.vmWriter.writeLabel(trueLabel)
+    def parseClass(self):
+        # parse a complete class
+        # 'class' className '{'
+        self.expect("class")
+        self.className = self.identifier()
+        self.expect("{")
 
-        # '{'
-        self.tokenizer.advance()
+        # classVarDec*
+        while self.peek() in ("static", "field"):
+            self.parseClassVarDec()
+        nFields = self.symbolTable.getVarCount("FIELD")
 
-        # statements
-        self.compileStatements()
+        # subroutineDec*
+        subroutines = []
+        while self.peek() in ("constructor", "function", "method"):
+            subroutines.append(self.parseSubroutine())
 
         # '}'
-        self.tokenizer.advance()
-
-        # ('else' '{' statements '}')?
-        if (
-            self.tokenizer.getTokenType() == "KEYWORD"
-            and self.tokenizer.keyword() == "else"
-        ):
-            # Jump over else part
-            self.vmWriter.writeGoto(endLabel)
-            self.vmWriter.writeLabel(falseLabel)
-            self.tokenizer.advance()  # 'else'
-            self.tokenizer.advance()  # '{'
-            self.compileStatements()
-            self.tokenizer.advance()  # '}'
-            self.vmWriter.writeLabel(endLabel)
-        else:
-            self.vmWriter.writeLabel(falseLabel)
-
-    def compileWhile(self):
-        # compile a while statement
-        expLabel, endLabel = self.getNextWhileLabel()
-
-        # Start of loop
-        self.vmWriter.writeLabel(expLabel)
-
-        # 'while'
-        self.tokenizer.advance()
-
-        # '('
-        self.tokenizer.advance()
-
-        # expression
-        self.compileExpression()
+        self.expect("}")
+        if self.peek() != "EOF":
+            self.error("expected end of file after the class")
+        return ClassNode(
+            self.className,
+            nFields,
+            self.symbolTable.getVarCount("STATIC"),
+            subroutines,
+            [],
+        )
 
-        # ')'
-        self.tokenizer.advance()
+    def parseClassVarDec(self):
+        # parse a static or field declaration
+        # ('static' | 'field') type
+        kind = "STATIC" if self.advance() == "static" else "FIELD"
+        type_name = self.advance()
 
-        # Negate condition and jump to end
-        self.vmWriter.writeArithmetic("not")
-        self.vmWriter.writeIf(endLabel)
+        # varName (',' varName)*
+        self.symbolTable.define(self.identifier(), type_name, kind)
+        while self.peek() == ",":
+            self.pos += 1
+            self.symbolTable.define(self.identifier(), type_name, kind)
 
-        # '{'
-        self.tokenizer.advance()
+        # ';'
+        self.expect(";")
 
-        # statements
-        self.compileStatements()
+    def parseSubroutine(self):
+        # parse a method, function, or constructor
+        self.symbolTable.startSubroutine()
 
-        # '}'
-        self.tokenizer.advance()
+        # ('constructor' | 'function' | 'method')
+        subroutineType = self.advance()
 
-        # Jump back to start
-        self.vmWriter.writeGoto(expLabel)
+        # If method, add 'this' as first argument
+        if subroutineType == "method":
+            self.symbolTable.define("this", self.className, "ARG")
 
-        # End label
-        self.vmWriter.writeLabel(endLabel)
+        # returnType subroutineName
+        returnType = self.advance()
+        subroutineName = self.identifier()
+
+        # '(' parameterList ')'
+        self.expect("(")
+        self.parseParameterList()
+        self.expect(")")
+
+        # '{' varDec* statements '}'
+        self.expect("{")
+        while self.peek() == "var":
+            self.parseVarDec()
+        body = self.parseStatements()
+        self.expect("}")
+
+        return SubroutineNode(
+            subroutineType,
+            returnType,
+            subroutineName,
+            self.symbolTable.getVarCount("ARG"),
+            self.symbolTable.getVarCount("VAR"),
+            body,
+        )
 
-    def compileDo(self):
-        # compile a do statement
-        # 'do'
-        self.tokenizer.advance()
+    def parseParameterList(self):
+        # parse a parameter list
+        if self.peek() == ")":
+            return
 
-        # subroutineCall
-        self.compileSubroutineCall()
-
-        # Pop return value (do statements ignore return value)
-        self.vmWriter.writePop("temp", 0)
+        # type varName (',' type varName)*
+        type_name = self.advance()
+        self.symbolTable.define(self.identifier(), type_name, "ARG")
+        while self.peek() == ",":
+            self.pos += 1
+            type_name = self.advance()
+            self.symbolTable.define(self.identifier(), type_name, "ARG")
+
+    def parseVarDec(self):
+        # parse a var declaration
+        # 'var' type
+        self.expect("var")
+        type_name = self.advance()
+
+        # varName (',' varName)*
+        self.symbolTable.define(self.identifier(), type_name, "VAR")
+        while self.peek() == ",":
+            self.pos += 1
+            self.symbolTable.define(self.identifier(), type_name, "VAR")
 
         # ';'
-        if self.tokenizer.getTokenType() == "SYMBOL" and self.tokenizer.symbol() == ";":
-            self.tokenizer.advance()
-
-    def compileReturn(self):
-        # compile a return statement
-        # 'return'
-        self.tokenizer.advance()
+        self.expect(";")
 
-        # expression?
-        if not (
-            self.tokenizer.getTokenType() == "SYMBOL" and self.tokenizer.symbol() == ";"
-        ):
-            self.compileExpression()
-        else:
-            # Void function returns 0
-            self.vmWriter.writePush("constant", 0)
-
-        self.vmWriter.writeReturn()
-
-        # ';'
-        if self.tokenizer.getTokenType() == "SYMBOL" and self.tokenizer.symbol() == ";":
-            self.tokenizer.advance()
-
-    def compileExpression(self):
-        # compile an expression
-        # term
-        self.compileTerm()
-
-        # (op term)*
-        while self.tokenizer.getTokenType() == "SYMBOL" and self.tokenizer.symbol() in [
-            "+",
-            "-",
-            "*",
-            "/",
-            "&",
-            "|",
-            "<",
-            ">",
-            "=",
-        ]:
-            op = self.tokenizer.symbol()
-            self.tokenizer.advance()
-            self.compileTerm()
-
-            # Write arithmetic operation
-            if op == "+":
-                self.vmWriter.writeArithmetic("add")
-            elif op == "-":
-                self.vmWriter.writeArithmetic("sub")
-            elif op == "*":
-                self.vmWriter.writeCall("Math.multiply", 2)
-            elif op == "/":
-                self.vmWriter.writeCall("Math.divide", 2)
-            elif op == "&":
-                self.vmWriter.writeArithmetic("and")
-            elif op == "|":
-                self.vmWriter.writeArithmetic("or")
-            elif op == "<":
-                self.vmWriter.writeArithmetic("lt")
-            elif op == ">":
-                self.vmWriter.writeArithmetic("gt")
-            elif op == "=":
-                self.vmWriter.writeArithmetic("eq")
+    def parseStatements(self):
+        # parse a sequence of statements
+        statements = []
+        while True:
+            keyword = self.peek()
+            if keyword == "let":
+                statements.append(self.parseLet())
+            elif keyword == "if":
+                statements.append(self.parseIf())
+            elif keyword == "while":
+                statements.append(self.parseWhile())
+            elif keyword == "do":
+                statements.append(self.parseDo())
+            elif keyword == "return":
+                statements.append(self.parseReturn())
+            else:
+                return statements
+
+    def parseLet(self):
+        # parse a let statement
+        # 'let' varName ('[' expression ']')?
+        self.expect("let")
+        target = self.variable(self.identifier())
+        if self.peek() == "[":
+            self.pos += 1
+            target = Index(target, self.parseExpression())
+            self.expect("]")
+
+        # '=' expression ';'
+        self.expect("=")
+        value = self.parseExpression()
+        self.expect(";")
+        return Let(target, value)
+
+    def parseIf(self):
+        # parse an if statement
+        # 'if' '(' expression ')' '{' statements '}'
+        self.expect("if")
+        self.expect("(")
+        condition = self.parseExpression()
+        self.expect(")")
+        self.expect("{")
+        then = self.parseStatements()
+        self.expect("}")
 
-    def compileTerm(self):
-        # compile a term
-        if self.tokenizer.getTokenType() == "INT_CONST":
+        # ('else' '{' statements '}')?
+        otherwise = None
+        if self.peek() == "else":
+            self.pos += 1
+            self.expect("{")
+            otherwise = self.parseStatements()
+            self.expect("}")
+        return If(condition, then, otherwise)
+
+    def parseWhile(self):
+        # parse a while statement
+        # 'while' '(' expression ')' '{' statements '}'
+        self.expect("while")
+        self.expect("(")
+        condition = self.parseExpression()
+        self.expect(")")
+        self.expect("{")
+        body = self.parseStatements()
+        self.expect("}")
+        return While(condition, body)
+
+    def parseDo(self):
+        # parse a do statement
+        # 'do' subroutineCall ';'
+        self.expect("do")
+        call = self.parseSubroutineCall()
+        self.expect(";")
+        return Do(call)
+
+    def parseReturn(self):
+        # parse a return statement
+        # 'return' expression? ';'
+        self.expect("return")
+        value = None
+        if self.peek() != ";":
+            value = self.parseExpression()
+        self.expect(";")
+        return Return(value)
+
+    def parseExpression(self):
+        # parse an expression, operators group left to right
+        # term (op term)*
+        node = self.parseTerm()
+        while self.peek() in ("+", "-", "*", "/", "&", "|", "<", ">", "="):
+            op = self.advance()
+            node = Binary(op, node, self.parseTerm())
+        return node
+
+    def parseTerm(self):
+        # parse a term
+        kind = self.peek()
+
+        if kind == "INT_CONST":
             # integerConstant
-            self.vmWriter.writePush("constant", self.tokenizer.intVal())
-            self.tokenizer.advance()
+            value = self.advance()
+            if value > 32767:
+                self.pos -= 1
+                self.error(f"integer constant {value} is out of range")
+            return Const(value)
 
-        elif self.tokenizer.getTokenType() == "STRING_CONST":
+        elif kind == "STRING_CONST":
             # stringConstant
-            string = self.tokenizer.stringVal()
-            # Create string object
-            self.vmWriter.writePush("constant", len(string))
-            self.vmWriter.writeCall("String.new", 1)
-            # Append each character
-            for char in string:
-                self.vmWriter.writePush("constant", ord(char))
-                self.vmWriter.writeCall("String.appendChar", 2)
-            self.tokenizer.advance()
-
-        elif self.tokenizer.getTokenType() == "KEYWORD":
+            return String(self.advance())
+
+        elif kind in ("true", "false", "null", "this"):
             # keywordConstant
-            keyword = self.tokenizer.keyword()
-            if keyword == "true":
-                self.vmWriter.writePush("constant", 0)
-                self.vmWriter.writeArithmetic("not")
-            elif keyword in ["false", "null"]:
-                self.vmWriter.writePush("constant", 0)
-            elif keyword == "this":
-                self.vmWriter.writePush("pointer", 0)
-            self.tokenizer.advance()
+            self.pos += 1
+            return Keyword(kind)
 
-        elif self.tokenizer.getTokenType() == "IDENTIFIER":
+        elif kind == "IDENTIFIER":
             # varName | varName[expression] | subroutineCall
-            name = self.tokenizer.identifier()
-            self.tokenizer.advance()
-
-            if self.tokenizer.getTokenType() == "SYMBOL":
-                if self.tokenizer.symbol() == "[":
-                    # Array access
-                    self.pushIdentifier(name)
-                    self.tokenizer.advance()  # '['
-                    self.compileExpression()
-                    self.tokenizer.advance()  # ']'
-                    self.vmWriter.writeArithmetic("add")
-                    self.vmWriter.writePop("pointer", 1)
-                    self.vmWriter.writePush("that", 0)
-
-                elif self.tokenizer.symbol() in ["(", "."]:
-                    # Subroutine call - backtrack
-                    # This is a bit tricky - we need to handle the identifier we already consumed
-                    self.compileSubroutineCallFromName(name)
-
-                else:
-                    # Simple variable
-                    self.pushIdentifier(name)
+            following = self.peek(1)
+            if following == "[":
+                # Array access
+                array = self.variable(self.advance())
+                self.pos += 1  # '['
+                node = Index(array, self.parseExpression())
+                self.expect("]")
+                return node
+            elif following == "(" or following == ".":
+                return self.parseSubroutineCall()
             else:
                 # Simple variable
-                self.pushIdentifier(name)
+                return self.variable(self.advance())
 
-        elif (
-            self.tokenizer.getTokenType() == "SYMBOL" and self.tokenizer.symbol() == "("
-        ):
+        elif kind == "(":
             # '(' expression ')'
-            self.tokenizer.advance()  # '('
-            self.compileExpression()
-            self.tokenizer.advance()  # ')'
-
-        elif self.tokenizer.getTokenType() == "SYMBOL" and self.tokenizer.symbol() in [
-            "-",
-            "~",
-        ]:
+            self.pos += 1
+            node = self.parseExpression()
+            self.expect(")")
+            return node
+
+        elif kind == "-" or kind == "~":
             # unaryOp term
-            op = self.tokenizer.symbol()
-            self.tokenizer.advance()
-            self.compileTerm()
-            if op == "-":
-                self.vmWriter.writeArithmetic("neg")
-            elif op == "~":
-                self.vmWriter.writeArithmetic("not")
+            self.pos += 1
+            return Unary(kind, self.parseTerm())
 
-    def compileSubroutineCall(self):
-        # compile a subroutine call
-        # subroutineName | className.subroutineName | varName.subroutineName
-        name = self.tokenizer.identifier()
-        self.tokenizer.advance()
-        self.compileSubroutineCallFromName(name)
+        self.error(f"expected a term, found '{self.values[self.pos]}'")
 
-    def compileSubroutineCallFromName(self, name):
-        # compile subroutine call starting from identifier name
-        nArgs = 0
+    def parseSubroutineCall(self):
+        # parse a subroutine call
+        # subroutineName | className.subroutineName | varName.subroutineName
+        name = self.identifier()
 
-        if self.tokenizer.getTokenType() == "SYMBOL" and self.tokenizer.symbol() == ".":
+        if self.peek() == ".":
             # className.subroutineName or varName.subroutineName
-            self.tokenizer.advance()  # '.'
-            subroutineName = self.tokenizer.identifier()
-            self.tokenizer.advance()
+            self.pos += 1
+            subroutineName = self.identifier()
 
             # Check if name is a variable (object method call)
             if self.symbolTable.kindOf(name) != "NONE":
-                # Object method call - push object reference as first argument
-                self.pushIdentifier(name)  # Push object reference
-                nArgs = 1
-                className = self.symbolTable.typeOf(name)
-                fullName = f"{className}.{subroutineName}"
+                receiver = self.variable(name)
+                fullName = f"{receiver.type}.{subroutineName}"
             else:
                 # Static method call - no implicit 'this' argument
+                receiver = None
                 fullName = f"{name}.{subroutineName}"
         else:
             # Method call on current object
-            self.vmWriter.writePush("pointer", 0)  # Push 'this'
-            nArgs = 1
+            receiver = Keyword("this")
             fullName = f"{self.className}.{name}"
 
-        # '('
-        self.tokenizer.advance()
+        # '(' expressionList ')'
+        self.expect("(")
+        args = self.parseExpressionList()
+        self.expect(")")
+        return Call(fullName, receiver, args)
+
+    def parseExpressionList(self):
+        # parse a possibly empty, comma separated expression list
+        if self.peek() == ")":
+            return []
+
+        # expression (',' expression)*
+        args = [self.parseExpression()]
+        while self.peek() == ",":
+            self.pos += 1
+            args.append(self.parseExpression())
+        return args
+
+
+# most VM commands an inlined multiplication by a constant may take
+# before Math.multiply is called instead
+MULTIPLY_CHAIN_LIMIT = 40
+
+# asm instructions the translator saves on a push and on a pop of a static
+# instead of an argument, and spends copying an argument into a static at
+# function entry (08/hvm.py moves push/pop static pairs through D)
+SLOT_PUSH_SAVING = 3
+SLOT_POP_SAVING = 7
+SLOT_COPY_COST = 6
+
+# how many times an access inside a loop is counted when weighing whether
+# to copy an argument into a slot
+SLOT_LOOP_WEIGHT = 8
+
+# VM command of each binary operator, * and / are OS calls
+BINARY_COMMANDS = {
+    "+": "add",
+    "-": "sub",
+    "&": "and",
+    "|": "or",
+    "<": "lt",
+    ">": "gt",
+    "=": "eq",
+}
+
+
+class CodeGenerator:
+    # writes the VM code of a ClassNode
+    #
+    # with no optimizations this is exactly the code the single pass
+    # compiler used to write, labels and all. the optimizations set
+    # switches on the code generator features listed in OPTIMIZATIONS
+
+    def __init__(self, vmWriter, optimizations=frozenset()):
+        self.vmWriter = vmWriter
+        self.optimizations = optimizations
+        self.className = ""
+        self.whileLabelCount = 0
+        self.ifLabelCount = 0
+        self.divideLabelCount = 0
+        self.stringLabelCount = 0
+        self.conditionLabelCount = 0
+        self.stringSlots = {}  # pooled string literal -> static index
+        self.nStatics = 0
+        self.thatBase = None  # address expression held in THAT, if known
+        self.madeCall = False  # whether the current subroutine calls out
+        self.deadJumps = 0  # gotos over else parts left out as unreachable
+        self.leafSlots = []  # statics shared by the leaf functions' variables
+        self.statementGenerators = {
+            Let: self.generateLet,
+            If: self.generateIf,
+            While: self.generateWhile,
+            Do: self.generateDo,
+            Return: self.generateReturn,
+        }
+        self.expressionGenerators = {
+            Const: self.generateConst,
+            String: self.generateString,
+            Keyword: self.generateKeyword,
+            Var: self.generateVar,
+            Index: self.generateIndex,
+            Call: self.generateCall,
+            Binary: self.generateBinary,
+            Unary: self.generateUnary,
+        }
 
-        # expressionList
-        nArgs += self.compileExpressionList()
+    def getNextWhileLabel(self):
+        # generate unique while labels
+        exp_label = f"WHILE_EXP{self.whileLabelCount}"
+        end_label = f"WHILE_END{self.whileLabelCount}"
+        body_label = f"WHILE_BODY{self.whileLabelCount}"
+        self.whileLabelCount += 1
+        return exp_label, end_label, body_label
 
-        # ')'
-        self.tokenizer.advance()
+    def getNextIfLabel(self):
+        # generate unique if labels
+        true_label = f"IF_TRUE{self.ifLabelCount}"
+        false_label = f"IF_FALSE{self.ifLabelCount}"
+        end_label = f"IF_END{self.ifLabelCount}"
+        self.ifLabelCount += 1
+        return true_label, false_label, end_label
 
-        # Call function
-        self.vmWriter.writeCall(fullName, nArgs)
+    def writeLabel(self, label):
+        # control can reach a label from another path, so THAT is unknown
+        self.thatBase = None
+        self.vmWriter.writeLabel(label)
 
-    def compileExpressionList(self):
-        # compile expression list and return argument count
-        nArgs = 0
+    def writeCall(self, name, nArgs):
+        # the callee's return restores THAT, but the callee may change the
+        # statics and fields its address was computed from
+        if self.thatBase is not None and not survivesCalls(self.thatBase):
+            self.thatBase = None
+        self.madeCall = True
+        self.vmWriter.writeCall(name, nArgs)
+
+    def generateClass(self, node):
+        # write every subroutine of a class
+        self.className = node.name
+        self.nStatics = node.nStatics
+        for subroutine in node.subroutines:
+            self.generateSubroutine(subroutine, node)
+
+    def generateSubroutine(self, node, classNode):
+        # write a function declaration and its body
+        if "leaves" not in self.optimizations:
+            self.writeSubroutine(node, classNode)
+            return
+        # whether a function calls anything is only known once its code is
+        # written, so it goes to a buffer first
+        output = self.vmWriter.output
+        self.vmWriter.output = buffer = io.StringIO()
+        self.madeCall = False
+        try:
+            self.writeSubroutine(node, classNode)
+        finally:
+            self.vmWriter.output = output
+        code = buffer.getvalue()
+        if not self.madeCall:
+            code = self.promoteToSlots(code)
+        output.write(code)
+
+    def promoteToSlots(self, code):
+        # the VM code of a leaf function with its locals, and the arguments
+        # used often enough to pay for the copy, in static slots. a leaf
+        # function calls nothing, so it is never active twice and no two
+        # leaf functions are active at once: the slots are shared by all
+        # the leaf functions of the class
+        lines = [line.split() for line in code.splitlines()]
+        _, name, nLocals = lines[0]
+        body = lines[1:]
+
+        # lines between a label and a jump back to it are in a loop
+        labels = {}
+        weights = [1] * len(body)
+        for position, line in enumerate(body):
+            if line[0] == "label":
+                labels[line[1]] = position
+            elif line[0] in ("goto", "if-goto") and line[1] in labels:
+                for inside in range(labels[line[1]], position + 1):
+                    weights[inside] = SLOT_LOOP_WEIGHT
+
+        savings = {}
+        for line, weight in zip(body, weights):
+            if line[0] in ("push", "pop") and line[1] == "argument":
+                saving = SLOT_PUSH_SAVING if line[0] == "push" else SLOT_POP_SAVING
+                key = int(line[2])
+                savings[key] = savings.get(key, 0) + saving * weight
+        arguments = sorted(
+            index for index, saving in savings.items() if saving > SLOT_COPY_COST
+        )
+        variables = [("local", index) for index in range(int(nLocals))]
+        variables += [("argument", index) for index in arguments]
+        while len(self.leafSlots) < len(variables):
+            self.leafSlots.append(self.nStatics)
+            self.nStatics += 1
+        slots = dict(zip(variables, map(str, self.leafSlots)))
+
+        # a local needs zeroing unless it is set before any jump or label,
+        # ahead of its first read
+        assigned = set()
+        for line in body:
+            if line[0] in ("label", "goto", "if-goto", "return"):
+                break
+            if line[0] in ("push", "pop") and line[1] == "local":
+                if line[0] == "pop":
+                    assigned.add(int(line[2]))
+                elif int(line[2]) not in assigned:
+                    break
+
+        result = [f"function {name} 0"]
+        for index in arguments:
+            result.append(f"push argument {index}")
+            result.append(f"pop static {slots['argument', index]}")
+        for index in range(int(nLocals)):
+            if index not in assigned:
+                result.append("push constant 0")
+                result.append(f"pop static {slots['local', index]}")
+        for line in body:
+            if line[0] in ("push", "pop") and (line[1], int(line[2])) in slots:
+                line = [line[0], "static", slots[line[1], int(line[2])]]
+            result.append(" ".join(line))
+        return "".join(f"{line}\n" for line in result)
+
+    def writeSubroutine(self, node, classNode):
+        # write the function command, the this setup and the body
+        self.vmWriter.writeFunction(f"{classNode.name}.{node.name}", node.nLocals)
+        self.thatBase = None
 
-        if not (
-            self.tokenizer.getTokenType() == "SYMBOL" and self.tokenizer.symbol() == ")"
-        ):
-            # expression
-            self.compileExpression()
-            nArgs = 1
-
-            # (',' expression)*
-            while (
-                self.tokenizer.getTokenType() == "SYMBOL"
-                and self.tokenizer.symbol() == ","
+        # Handle constructor/method setup
+        if node.kind == "constructor":
+            # Allocate memory for object
+            self.vmWriter.writePush("constant", classNode.nFields)
+            self.writeCall("Memory.alloc", 1)
+            self.vmWriter.writePop("pointer", 0)
+        elif node.kind == "method":
+            # Set 'this' pointer
+            self.vmWriter.writePush("argument", 0)
+            self.vmWriter.writePop("pointer", 0)
+
+        self.generateStatements(node.body)
+
+    def generateStatements(self, statements):
+        # write a sequence of statements
+        generators = self.statementGenerators
+        for statement in statements:
+            generators[type(statement)](statement)
+
+    def generateLet(self, node):
+        # write a let statement
+        target = node.target
+        if type(target) is Index and "arrays" in self.optimizations:
+            self.generateArrayLet(node)
+        elif type(target) is Index:
+            # base + index, then the value through temp 0 into that 0
+            self.generateExpression(target.array)
+            self.generateExpression(target.index)
+            self.vmWriter.writeArithmetic("add")
+            self.generateExpression(node.value)
+            self.vmWriter.writePop("temp", 0)
+            self.vmWriter.writePop("pointer", 1)
+            self.vmWriter.writePush("temp", 0)
+            self.vmWriter.writePop("that", 0)
+        else:
+            self.generateExpression(node.value)
+            self.vmWriter.writePop(target.segment, target.index)
+            if self.thatBase is not None and any(
+                sameExpression(target, child) for child in allExpressions(self.thatBase)
             ):
-                self.tokenizer.advance()  # ','
-                self.compileExpression()
-                nArgs += 1
+                self.thatBase = None
+
+    def generateArrayLet(self, node):
+        # a[i] = value with that k addressing. the value only needs to go
+        # through temp 0 when reading it moves THAT and the address has to
+        # be computed first
+        base, offset = arrayAddress(node.target)
+        value = node.value
+        reads = [child for child in allExpressions(value) if type(child) is Index]
+        if not reads or (
+            isCacheable(base)
+            and isPure(value)
+            and all(sameExpression(base, arrayAddress(read)[0]) for read in reads)
+        ):
+            # THAT stays on the address while the value is computed
+            self.generateThat(base)
+            self.generateExpression(value)
+            self.vmWriter.writePop("that", offset)
+            return
+        if isCacheable(base) and (isPure(value) or survivesCalls(base)):
+            # the value cannot change the address, so it can go first
+            self.generateExpression(value)
+            self.generateThat(base)
+            self.vmWriter.writePop("that", offset)
+            return
+        self.generateExpression(base)
+        self.generateExpression(node.value)
+        self.vmWriter.writePop("temp", 0)
+        self.vmWriter.writePop("pointer", 1)
+        self.vmWriter.writePush("temp", 0)
+        self.vmWriter.writePop("that", offset)
+        self.thatBase = None
+
+    def generateThat(self, base):
+        # point THAT at an address unless it already holds it
+        if self.thatBase is not None and sameExpression(base, self.thatBase):
+            return
+        self.generateExpression(base)
+        self.vmWriter.writePop("pointer", 1)
+        self.thatBase = base if isCacheable(base) else None
 
-        return nArgs
+    def generateIf(self, node):
+        # write an if statement
+        trueLabel, falseLabel, endLabel = self.getNextIfLabel()
 
-    def pushIdentifier(self, name):
-        # push identifier value onto stack
-        kind = self.symbolTable.kindOf(name)
-        index = self.symbolTable.indexOf(name)
+        if "branches" in self.optimizations:
+            # branch straight past the part that does not run
+            if not node.otherwise:
+                self.generateCondition(node.condition, endLabel, False)
+                self.generateStatements(node.then)
+            elif not node.then:
+                self.generateCondition(node.condition, endLabel, True)
+                self.generateStatements(node.otherwise)
+            else:
+                self.generateCondition(node.condition, falseLabel, False)
+                self.generateStatements(node.then)
+                self.writeSkipElse(node, endLabel)
+                self.writeLabel(falseLabel)
+                self.generateStatements(node.otherwise)
+            self.writeLabel(endLabel)
+            return
 
-        if kind == "STATIC":
-            self.vmWriter.writePush("static", index)
-        elif kind == "FIELD":
-            self.vmWriter.writePush("this", index)
-        elif kind == "ARG":
-            self.vmWriter.writePush("argument", index)
-        elif kind == "VAR":
-            self.vmWriter.writePush("local", index)
+        # Jump to true branch if condition is true
+        self.generateExpression(node.condition)
+        self.vmWriter.writeIf(trueLabel)
+        self.vmWriter.writeGoto(falseLabel)
+        self.writeLabel(trueLabel)
+        self.generateStatements(node.then)
 
-    def popIdentifier(self, name):
-        # pop value from stack to identifier
-        kind = self.symbolTable.kindOf(name)
-        index = self.symbolTable.indexOf(name)
+        if node.otherwise is not None:
+            # Jump over else part
+            self.writeSkipElse(node, endLabel)
+            self.writeLabel(falseLabel)
+            self.generateStatements(node.otherwise)
+            self.writeLabel(endLabel)
+        else:
+            self.writeLabel(falseLabel)
 
-        if kind == "STATIC":
-            self.vmWriter.writePop("static", index)
-        elif kind == "FIELD":
-            self.vmWriter.writePop("this", index)
-        elif kind == "ARG":
-            self.vmWriter.writePop("argument", index)
-        elif kind == "VAR":
-            self.vmWriter.writePop("local", index)
+    def writeSkipElse(self, node, endLabel):
+        # the jump from the end of the then part over the else part, left
+        # out when the then part cannot get there
+        if "dead" not in self.optimizations or reachesEnd(node.then):
+            self.vmWriter.writeGoto(endLabel)
+        else:
+            self.deadJumps += 1
+
+    def generateWhile(self, node):
+        # write a while statement
+        expLabel, endLabel, bodyLabel = self.getNextWhileLabel()
+
+        if "branches" in self.optimizations:
+            # test at the bottom, jumping back while the condition holds
+            self.vmWriter.writeGoto(expLabel)
+            self.writeLabel(bodyLabel)
+            self.generateStatements(node.body)
+            self.writeLabel(expLabel)
+            self.generateCondition(node.condition, bodyLabel, True)
+            return
 
-    def close(self):
-        # close compilation
-        self.vmWriter.close()
+        # Negate condition and jump to end
+        self.writeLabel(expLabel)
+        self.generateExpression(node.condition)
+        self.vmWriter.writeArithmetic("not")
+        self.vmWriter.writeIf(endLabel)
 
+        # Body, then back to the start
+        self.generateStatements(node.body)
+        self.vmWriter.writeGoto(expLabel)
+        self.writeLabel(endLabel)
+
+    def generateCondition(self, node, label, jumpIf):
+        # jump to label if the condition is jumpIf (True or False), fall
+        # through otherwise. a Jack condition is true when nonzero
+        value = constantValue(node)
+        if value is not None:
+            if (value != 0) == jumpIf:
+                self.vmWriter.writeGoto(label)
+            return
 
-def compileFile(input_file):
-    # compile a single Jack file
-    output_file = input_file.replace(".jack", ".vm")
+        kind = type(node)
+        if kind is Unary and node.op == "~" and isBoolean(node.operand):
+            self.generateCondition(node.operand, label, not jumpIf)
+            return
+        if kind is Binary:
+            if node.op == "=" and not jumpIf:
+                # a = b is false exactly when a - b is nonzero
+                self.generateExpression(node.left)
+                self.generateExpression(node.right)
+                self.vmWriter.writeArithmetic("sub")
+                self.vmWriter.writeIf(label)
+                return
+            if (
+                (node.op == "&" or node.op == "|")
+                and isBoolean(node.left)
+                and isBoolean(node.right)
+                and isPure(node.right)
+            ):
+                # the right side only needs evaluating when the left side
+                # does not decide the jump on its own
+                if (node.op == "&") != jumpIf:
+                    self.generateCondition(node.left, label, jumpIf)
+                    self.generateCondition(node.right, label, jumpIf)
+                else:
+                    skip = f"COND_SKIP{self.conditionLabelCount}"
+                    self.conditionLabelCount += 1
+                    self.generateCondition(node.left, skip, not jumpIf)
+                    self.generateCondition(node.right, label, jumpIf)
+                    self.writeLabel(skip)
+                return
+
+        self.generateExpression(node)
+        if not jumpIf:
+            # not only negates true and false, any other value is
+            # compared with 0
+            if isBoolean(node):
+                self.vmWriter.writeArithmetic("not")
+            else:
+                self.vmWriter.writePush("constant", 0)
+                self.vmWriter.writeArithmetic("eq")
+        self.vmWriter.writeIf(label)
 
+    def generateDo(self, node):
+        # write a do statement, the return value is ignored
+        self.generateExpression(node.call)
+        self.vmWriter.writePop("temp", 0)
+
+    def generateReturn(self, node):
+        # write a return statement, void subroutines return 0
+        if node.value is not None:
+            self.generateExpression(node.value)
+        else:
+            self.vmWriter.writePush("constant", 0)
+        self.vmWriter.writeReturn()
+
+    def generateExpression(self, node):
+        # write code leaving the value of an expression on the stack
+        self.expressionGenerators[type(node)](node)
+
+    def generateConst(self, node):
+        self.vmWriter.writePush("constant", node.value)
+
+    def generateString(self, node):
+        if "strings" in self.optimizations:
+            self.generatePooledString(node)
+            return
+        # Create string object and append each character
+        self.vmWriter.writePush("constant", len(node.value))
+        self.writeCall("String.new", 1)
+        for char in node.value:
+            self.vmWriter.writePush("constant", ord(char))
+            self.writeCall("String.appendChar", 2)
+
+    def generatePooledString(self, node):
+        # each distinct literal of the class gets a static slot after the
+        # declared statics, built the first time it is evaluated and
+        # shared from then on
+        slot = self.stringSlots.get(node.value)
+        if slot is None:
+            slot = self.stringSlots[node.value] = self.nStatics
+            self.nStatics += 1
+        label = f"STRING_READY{self.stringLabelCount}"
+        self.stringLabelCount += 1
+
+        self.vmWriter.writePush("static", slot)
+        self.vmWriter.writeIf(label)
+        self.vmWriter.writePush("constant", len(node.value))
+        self.writeCall("String.new", 1)
+        for char in node.value:
+            self.vmWriter.writePush("constant", ord(char))
+            self.writeCall("String.appendChar", 2)
+        self.vmWriter.writePop("static", slot)
+        self.writeLabel(label)
+        self.vmWriter.writePush("static", slot)
+
+    def generateKeyword(self, node):
+        if node.value == "true":
+            self.vmWriter.writePush("constant", 0)
+            self.vmWriter.writeArithmetic("not")
+        elif node.value == "this":
+            self.vmWriter.writePush("pointer", 0)
+        else:
+            self.vmWriter.writePush("constant", 0)
+
+    def generateVar(self, node):
+        self.vmWriter.writePush(node.segment, node.index)
+
+    def generateIndex(self, node):
+        # base + index into that pointer, then read that 0
+        if "arrays" in self.optimizations:
+            base, offset = arrayAddress(node)
+            self.generateThat(base)
+            self.vmWriter.writePush("that", offset)
+            return
+        self.generateExpression(node.array)
+        self.generateExpression(node.index)
+        self.vmWriter.writeArithmetic("add")
+        self.vmWriter.writePop("pointer", 1)
+        self.vmWriter.writePush("that", 0)
+
+    def generateCall(self, node):
+        # the receiver goes first as the hidden 'this' argument
+        nArgs = len(node.args)
+        if node.receiver is not None:
+            self.generateExpression(node.receiver)
+            nArgs += 1
+        for arg in node.args:
+            self.generateExpression(arg)
+        self.writeCall(node.name, nArgs)
+
+    def generateBinary(self, node):
+        if (
+            (node.op == "*" or node.op == "/")
+            and "strength" in self.optimizations
+            and self.generateStrengthReduced(node)
+        ):
+            return
+        self.generateExpression(node.left)
+        self.generateExpression(node.right)
+        if node.op == "*":
+            self.writeCall("Math.multiply", 2)
+        elif node.op == "/":
+            self.writeCall("Math.divide", 2)
+        else:
+            self.vmWriter.writeArithmetic(BINARY_COMMANDS[node.op])
+
+    def generateUnary(self, node):
+        self.generateExpression(node.operand)
+        self.vmWriter.writeArithmetic("neg" if node.op == "-" else "not")
+
+    def generateStrengthReduced(self, node):
+        # x * constant and x / constant without the OS call where that is
+        # cheaper, False if the node needs Math.multiply or Math.divide
+        if node.op == "/":
+            divisor = constantValue(node.right)
+            if divisor is None:
+                return False
+            return self.generateDivideByPowerOfTwo(node.left, divisor)
+        factor = constantValue(node.right)
+        operand = node.left
+        if factor is None:
+            # constants have no side effects, so 3 * x may become x * 3
+            factor = constantValue(node.left)
+            operand = node.right
+        if factor is None:
+            return False
+        return self.generateMultiplyByConstant(operand, factor)
+
+    def generateMultiplyByConstant(self, operand, factor):
+        # x * factor as a double-and-add chain over the bits of the factor,
+        # from the top bit down. x is read from its variable, or from
+        # temp 1 if it has to be computed; temp 2 holds the running value
+        # while it is doubled
+        magnitude = abs(factor)
+        if magnitude == 0 or magnitude > 32767:
+            return False
+        bits = bin(magnitude)[3:]  # the bits below the top one
+        simple = type(operand) is Var or type(operand) is Const
+        cost = (0 if simple else 1) + 1 + 4 * len(bits) - 2 * (len(bits) > 0)
+        cost += 2 * bits.count("1")
+        if cost > MULTIPLY_CHAIN_LIMIT:
+            return False
+
+        if type(operand) is Var:
+            source = (operand.segment, operand.index)
+        elif type(operand) is Const:
+            source = ("constant", operand.value)
+        else:
+            self.generateExpression(operand)
+            self.vmWriter.writePop("temp", 1)
+            source = ("temp", 1)
+
+        self.vmWriter.writePush(*source)
+        for position, bit in enumerate(bits):
+            if position:
+                self.vmWriter.writePop("temp", 2)
+                self.vmWriter.writePush("temp", 2)
+                self.vmWriter.writePush("temp", 2)
+            else:
+                self.vmWriter.writePush(*source)
+            self.vmWriter.writeArithmetic("add")
+            if bit == "1":
+                self.vmWriter.writePush(*source)
+                self.vmWriter.writeArithmetic("add")
+        if factor < 0:
+            self.vmWriter.writeArithmetic("neg")
+        return True
+
+    def generateDivideByPowerOfTwo(self, dividend, divisor):
+        # x / +-2^k by collecting the bits of x from bit k up into a
+        # result, stopping once the bit is past x. temp 1 holds x, temp 2
+        # the bit, temp 3 the result bit and temp 4 the result. a dividend
+        # not known to be non-negative is divided by its magnitude and the
+        # sign put back. -32768 has no magnitude, so it goes to Math.divide
+        # like at -O0, which is what evaluateBinary leaves it to as well
+        magnitude = abs(divisor)
+        if magnitude < 2 or magnitude > 16384 or magnitude & (magnitude - 1):
+            return False
+        n = self.divideLabelCount
+        self.divideLabelCount += 1
+        signed = not isNonNegative(dividend)
+
+        self.generateExpression(dividend)
+        self.vmWriter.writePop("temp", 1)
+        if signed:
+            # temp 5 = x < 0, x = |x|, and -x still negative means -32768
+            self.vmWriter.writePush("temp", 1)
+            self.vmWriter.writePush("constant", 0)
+            self.vmWriter.writeArithmetic("lt")
+            self.vmWriter.writePop("temp", 5)
+            self.vmWriter.writePush("temp", 5)
+            self.vmWriter.writeArithmetic("not")
+            self.vmWriter.writeIf(f"DIV_POSITIVE{n}")
+            self.vmWriter.writePush("temp", 1)
+            self.vmWriter.writeArithmetic("neg")
+            self.vmWriter.writePop("temp", 1)
+            self.vmWriter.writePush("temp", 1)
+            self.vmWriter.writePush("constant", 0)
+            self.vmWriter.writeArithmetic("lt")
+            self.vmWriter.writeIf(f"DIV_SLOW{n}")
+            self.writeLabel(f"DIV_POSITIVE{n}")
+
+        self.vmWriter.writePush("constant", magnitude)
+        self.vmWriter.writePop("temp", 2)
+        self.vmWriter.writePush("constant", 1)
+        self.vmWriter.writePop("temp", 3)
+        self.vmWriter.writePush("constant", 0)
+        self.vmWriter.writePop("temp", 4)
+
+        # while bit <= x (the bit turns negative past 2^14, which also ends it)
+        self.writeLabel(f"DIV_LOOP{n}")
+        self.vmWriter.writePush("temp", 2)
+        self.vmWriter.writePush("temp", 1)
+        self.vmWriter.writeArithmetic("gt")
+        self.vmWriter.writeIf(f"DIV_DONE{n}")
+        # if x & bit then result = result | result bit
+        self.vmWriter.writePush("temp", 1)
+        self.vmWriter.writePush("temp", 2)
+        self.vmWriter.writeArithmetic("and")
+        self.vmWriter.writePush("constant", 0)
+        self.vmWriter.writeArithmetic("eq")
+        self.vmWriter.writeIf(f"DIV_NEXT{n}")
+        self.vmWriter.writePush("temp", 4)
+        self.vmWriter.writePush("temp", 3)
+        self.vmWriter.writeArithmetic("or")
+        self.vmWriter.writePop("temp", 4)
+        self.writeLabel(f"DIV_NEXT{n}")
+        # double the bit and the result bit
+        for index in (2, 3):
+            self.vmWriter.writePush("temp", index)
+            self.vmWriter.writePush("temp", index)
+            self.vmWriter.writeArithmetic("add")
+            self.vmWriter.writePop("temp", index)
+        self.vmWriter.writeGoto(f"DIV_LOOP{n}")
+        self.writeLabel(f"DIV_DONE{n}")
+
+        self.vmWriter.writePush("temp", 4)
+        if signed:
+            self.vmWriter.writePush("temp", 5)
+            self.vmWriter.writeArithmetic("not")
+            self.vmWriter.writeIf(f"DIV_END{n}")
+            self.vmWriter.writeArithmetic("neg")
+            self.writeLabel(f"DIV_END{n}")
+        if divisor < 0:
+            self.vmWriter.writeArithmetic("neg")
+        if signed:
+            self.vmWriter.writeGoto(f"DIV_EXIT{n}")
+            self.writeLabel(f"DIV_SLOW{n}")
+            self.vmWriter.writePush("temp", 1)
+            self.vmWriter.writePush("constant", magnitude)
+            if divisor < 0:
+                self.vmWriter.writeArithmetic("neg")
+            self.writeCall("Math.divide", 2)
+            self.writeLabel(f"DIV_EXIT{n}")
+        return True
+
+
+def wrap(value):
+    # wrap a python int to a signed 16-bit hack word
+    return ((value + 32768) & 0xFFFF) - 32768
+
+
+def subexpressions(node):
+    # the expressions directly inside an expression node
+    kind = type(node)
+    if kind is Binary:
+        return (node.left, node.right)
+    if kind is Unary:
+        return (node.operand,)
+    if kind is Index:
+        return (node.array, node.index)
+    if kind is Call:
+        if node.receiver is None:
+            return node.args
+        return (node.receiver, *node.args)
+    return ()
+
+
+def allExpressions(node):
+    # an expression and every expression inside it
+    yield node
+    for child in subexpressions(node):
+        yield from allExpressions(child)
+
+
+def isPure(node):
+    # true if evaluating an expression has no side effects: no calls and
+    # no string literals, which allocate
+    kind = type(node)
+    if kind is Call or kind is String:
+        return False
+    return all(isPure(child) for child in subexpressions(node))
+
+
+def sameExpression(a, b):
+    # true if two expressions are written the same way
+    if type(a) is not type(b):
+        return False
+    if type(a) is Var:
+        return a.segment == b.segment and a.index == b.index
+    for field in a.__slots__:
+        x, y = getattr(a, field), getattr(b, field)
+        if isinstance(x, Node) or isinstance(y, Node):
+            if not sameExpression(x, y):
+                return False
+        elif isinstance(x, list):
+            if len(x) != len(y) or not all(map(sameExpression, x, y)):
+                return False
+        elif x != y:
+            return False
+    return True
+
+
+def walkStatements(statements):
+    # every statement of a statement list, nested blocks included
+    for statement in statements:
+        yield statement
+        kind = type(statement)
+        if kind is If:
+            yield from walkStatements(statement.then)
+            if statement.otherwise is not None:
+                yield from walkStatements(statement.otherwise)
+        elif kind is While:
+            yield from walkStatements(statement.body)
+
+
+def statementExpressions(statement):
+    # the expressions a statement evaluates itself, not those of the
+    # statements nested in it
+    kind = type(statement)
+    if kind is Let:
+        if type(statement.target) is Index:
+            return (statement.target.array, statement.target.index, statement.value)
+        return (statement.value,)
+    if kind is If or kind is While:
+        return (statement.condition,)
+    if kind is Do:
+        return (statement.call,)
+    if statement.value is not None:
+        return (statement.value,)
+    return ()
+
+
+def mapExpressions(statements, function):
+    # replace every expression of a statement list, nested blocks included,
+    # with function(expression); the statements are changed in place
+    for statement in statements:
+        kind = type(statement)
+        if kind is Let:
+            target = statement.target
+            if type(target) is Index:
+                statement.target = Index(target.array, function(target.index))
+            statement.value = function(statement.value)
+        elif kind is If:
+            statement.condition = function(statement.condition)
+            mapExpressions(statement.then, function)
+            if statement.otherwise is not None:
+                mapExpressions(statement.otherwise, function)
+        elif kind is While:
+            statement.condition = function(statement.condition)
+            mapExpressions(statement.body, function)
+        elif kind is Do:
+            statement.call = function(statement.call)
+        elif kind is Return and statement.value is not None:
+            statement.value = function(statement.value)
+    return statements
+
+
+def constantValue(node):
+    # the 16-bit value of a constant expression, None if it is not one
+    kind = type(node)
+    if kind is Const:
+        return node.value
+    if kind is Keyword:
+        return {"true": -1, "false": 0, "null": 0}.get(node.value)
+    if kind is Unary:
+        value = constantValue(node.operand)
+        if value is not None:
+            return wrap(-value) if node.op == "-" else ~value
+    return None
+
+
+def isBoolean(node):
+    # true if an expression is always true (-1) or false (0)
+    kind = type(node)
+    if kind is Keyword:
+        return node.value != "this"
+    if kind is Unary:
+        return node.op == "~" and isBoolean(node.operand)
+    if kind is Binary:
+        if node.op in ("<", ">", "="):
+            return True
+        if node.op == "&" or node.op == "|":
+            return isBoolean(node.left) and isBoolean(node.right)
+    return False
+
+
+def isCacheable(node):
+    # true if an address expression gives the same value until one of its
+    # variables is assigned or a call changes a static or field. division
+    # is left out since the OS halts on a zero divisor
+    kind = type(node)
+    if kind is Var or kind is Const or kind is Keyword:
+        return True
+    if kind is Binary:
+        return node.op != "/" and isCacheable(node.left) and isCacheable(node.right)
+    if kind is Unary:
+        return isCacheable(node.operand)
+    return False
+
+
+def survivesCalls(node):
+    # true if no call can change the value of an address expression
+    return all(
+        child.segment == "local" or child.segment == "argument"
+        for child in allExpressions(node)
+        if type(child) is Var
+    )
+
+
+def arrayAddress(node):
+    # split an Index into (base address expression, constant offset) for
+    # that k addressing: a[3] is a and 3, a[i + 1] is a + i and 1. the
+    # translator's that k costs the same for every k, so any offset goes
+    index = node.index
+    if type(index) is Const:
+        return node.array, index.value
+    if type(index) is Binary and index.op == "+":
+        if type(index.right) is Const:
+            return Binary("+", node.array, index.left), index.right.value
+        if type(index.left) is Const:
+            return Binary("+", node.array, index.right), index.left.value
+    return Binary("+", node.array, index), 0
+
+
+def isNonNegative(node):
+    # true if an expression is known to be 0..32767 whatever its inputs
+    kind = type(node)
+    if kind is Const:
+        return True
+    if kind is Keyword:
+        return node.value == "false" or node.value == "null"
+    if kind is Binary:
+        if node.op == "&":
+            return isNonNegative(node.left) or isNonNegative(node.right)
+        if node.op == "|" or node.op == "/":
+            return isNonNegative(node.left) and isNonNegative(node.right)
+    return False
+
+
+def constantNode(value):
+    # the shortest expression pushing a 16-bit value
+    if value >= 0:
+        return Const(value)
+    if value == -1:
+        return Keyword("true")
+    if value == -32768:
+        return Unary("~", Const(32767))
+    return Unary("-", Const(-value))
+
+
+def evaluateBinary(op, a, b):
+    # a op b the way the VM and the OS compute it, None when division is
+    # not worth predicting (by zero, or of -32768 which Math.abs leaves
+    # negative)
+    if op == "+":
+        return wrap(a + b)
+    if op == "-":
+        return wrap(a - b)
+    if op == "*":
+        return wrap(a * b)  # Math.multiply keeps the low 16 bits
+    if op == "/":
+        if b == 0 or a == -32768 or b == -32768:
+            return None
+        quotient = abs(a) // abs(b)  # Math.divide truncates toward zero
+        return -quotient if (a < 0) != (b < 0) else quotient
+    if op == "&":
+        return a & b
+    if op == "|":
+        return a | b
+    # comparisons test the wrapped difference, like the VM does
+    difference = wrap(a - b)
+    if op == "<":
+        return -1 if difference < 0 else 0
+    if op == ">":
+        return -1 if difference > 0 else 0
+    return -1 if difference == 0 else 0
+
+
+def foldExpression(node):
+    # an expression with its constant parts computed and trivial
+    # operations (x + 0, x * 1, x - x, ...) removed
+    kind = type(node)
+    if kind is Binary:
+        return foldBinary(
+            node.op, foldExpression(node.left), foldExpression(node.right)
+        )
+    if kind is Unary:
+        operand = foldExpression(node.operand)
+        value = constantValue(operand)
+        if value is not None:
+            return constantNode(wrap(-value) if node.op == "-" else ~value)
+        if type(operand) is Unary and operand.op == node.op:
+            return operand.operand  # --x and ~~x
+        return Unary(node.op, operand)
+    if kind is Index:
+        return Index(node.array, foldExpression(node.index))
+    if kind is Call:
+        receiver = node.receiver
+        if receiver is not None:
+            receiver = foldExpression(receiver)
+        return Call(node.name, receiver, [foldExpression(arg) for arg in node.args])
+    return node
+
+
+def foldBinary(op, left, right):
+    # left op right, computed if both sides are constant, simplified if
+    # one side is an identity or absorbing element. an operand is only
+    # dropped when evaluating it has no side effects
+    a = constantValue(left)
+    b = constantValue(right)
+    if a is not None and b is not None:
+        value = evaluateBinary(op, a, b)
+        if value is not None:
+            return constantNode(value)
+
+    if op == "+":
+        if a == 0:
+            return right
+        if b == 0:
+            return left
+    elif op == "-":
+        if b == 0:
+            return left
+        if a == 0:
+            return Unary("-", right)
+        if isPure(left) and sameExpression(left, right):
+            return Const(0)
+    elif op == "*":
+        if a == 1:
+            return right
+        if b == 1:
+            return left
+        if (a == 0 and isPure(right)) or (b == 0 and isPure(left)):
+            return Const(0)
+    elif op == "&":
+        if a == -1:
+            return right
+        if b == -1:
+            return left
+        if (a == 0 and isPure(right)) or (b == 0 and isPure(left)):
+            return Const(0)
+    elif op == "|":
+        if a == 0:
+            return right
+        if b == 0:
+            return left
+        if (a == -1 and isPure(right)) or (b == -1 and isPure(left)):
+            return Keyword("true")
+    return Binary(op, left, right)
+
+
+def foldConstants(tree, program=None):
+    # constant folding pass
+    for subroutine in tree.subroutines:
+        mapExpressions(subroutine.body, foldExpression)
+    return tree
+
+
+class Subroutine(Node):
+    # a subroutine as calls from other classes see it in whole program
+    # mode. kind: 'constructor' | 'function' | 'method', nArgs: int (with
+    # 'this' for methods), size: int, statement and expression nodes in the
+    # body, inline: what a call can be replaced with, a constant node, the
+    # field Var a getter returns, or None
+    __slots__ = ("kind", "nArgs", "size", "inline")
+
+
+def bodySize(statements):
+    # the number of statement and expression nodes in a statement list
+    size = 0
+    for statement in walkStatements(statements):
+        size += 1
+        for expression in statementExpressions(statement):
+            size += sum(1 for _ in allExpressions(expression))
+    return size
+
+
+def subroutineTable(tree):
+    # {'Class.subroutine': Subroutine} for the subroutines of a ClassNode
+    table = {}
+    for subroutine in tree.subroutines:
+        inline = None
+        body = subroutine.body
+        if (
+            subroutine.kind != "constructor"
+            and len(body) == 1
+            and type(body[0]) is Return
+            and body[0].value is not None
+        ):
+            returned = body[0].value
+            value = constantValue(foldExpression(returned))
+            if value is not None:
+                inline = constantNode(value)
+            elif subroutine.kind == "method" and type(returned) is Var:
+                if returned.segment == "this":
+                    inline = returned
+        table[f"{tree.name}.{subroutine.name}"] = Subroutine(
+            subroutine.kind, subroutine.nArgs, bodySize(body), inline
+        )
+    return table
+
+
+def checkCalls(tree, program):
+    # raise ValueError for the first call of a ClassNode that does not fit
+    # the subroutine it calls. calls into classes outside the program, the
+    # OS when it is not compiled along, are not checked
+    classes = {name.partition(".")[0] for name in program}
+    for subroutine in tree.subroutines:
+        caller = f"{tree.name}.{subroutine.name}"
+        for statement in walkStatements(subroutine.body):
+            for expression in statementExpressions(statement):
+                for node in allExpressions(expression):
+                    if type(node) is not Call:
+                        continue
+                    className, _, name = node.name.partition(".")
+                    if className not in classes:
+                        continue
+                    callee = program.get(node.name)
+                    if callee is None:
+                        raise ValueError(
+                            f"in {caller}: {className} has no subroutine {name}"
+                        )
+                    isMethod = node.receiver is not None
+                    if isMethod != (callee.kind == "method"):
+                        how = "method" if isMethod else "function"
+                        raise ValueError(
+                            f"in {caller}: {node.name} is a {callee.kind},"
+                            f" called as a {how}"
+                        )
+                    expected = callee.nArgs - isMethod
+                    if len(node.args) != expected:
+                        raise ValueError(
+                            f"in {caller}: {node.name} takes {expected}"
+                            f" arguments, called with {len(node.args)}"
+                        )
+
+
+def inlineExpression(node, program):
+    # an expression with calls to getters and constant functions replaced
+    # by the field or constant they return
+    kind = type(node)
+    if kind is Binary:
+        return Binary(
+            node.op,
+            inlineExpression(node.left, program),
+            inlineExpression(node.right, program),
+        )
+    if kind is Unary:
+        return Unary(node.op, inlineExpression(node.operand, program))
+    if kind is Index:
+        return Index(node.array, inlineExpression(node.index, program))
+    if kind is not Call:
+        return node
+    receiver = node.receiver
+    if receiver is not None:
+        receiver = inlineExpression(receiver, program)
+    args = [inlineExpression(arg, program) for arg in node.args]
+    callee = program.get(node.name)
+    inline = callee.inline if callee is not None else None
+    if type(inline) is Var:
+        # the getter reads a field of its receiver
+        if type(receiver) is Keyword:
+            return inline
+        if type(receiver) is Var:
+            return Index(receiver, Const(inline.index))
+    elif inline is not None:
+        # the arguments are dropped, so they must not do anything
+        if all(isPure(arg) for arg in args) and (
+            receiver is None or isPure(receiver)
+        ):
+            return inline
+    return Call(node.name, receiver, args)
+
+
+def inlineCalls(tree, program=None):
+    # inlining pass, whole program mode only
+    if program is not None:
+        for subroutine in tree.subroutines:
+            mapExpressions(
+                subroutine.body, lambda node: inlineExpression(node, program)
+            )
+    return tree
+
+
+def reachesEnd(statements):
+    # false if running a statement list always ends in a return or in a
+    # loop that never exits, Jack having no break
+    for statement in statements:
+        kind = type(statement)
+        if kind is Return:
+            return False
+        if kind is If and statement.otherwise is not None:
+            if not reachesEnd(statement.then) and not reachesEnd(statement.otherwise):
+                return False
+        if kind is While and constantValue(statement.condition):
+            return False
+    return True
+
+
+def removeDeadStatements(statements, dead):
+    # a statement list without the statements that can never run: those
+    # after a return or an endless loop, the parts of ifs on constant
+    # conditions and loops on a false one. nested blocks are done too.
+    # what is removed is added to dead, ifs with the branch they keep
+    # emptied
+    result = []
+    for i, statement in enumerate(statements):
+        start = len(result)
+        kind = type(statement)
+        if kind is If:
+            value = constantValue(statement.condition)
+            if value is not None:
+                # constants have no side effects, the branch that runs is
+                # spliced in, Jack blocks having no variables of their own
+                if value:
+                    branch = statement.then
+                    dead.append(If(statement.condition, [], statement.otherwise))
+                else:
+                    branch = statement.otherwise
+                    dead.append(If(statement.condition, statement.then, []))
+                result.extend(removeDeadStatements(branch or [], dead))
+            else:
+                statement.then = removeDeadStatements(statement.then, dead)
+                if statement.otherwise is not None:
+                    statement.otherwise = removeDeadStatements(
+                        statement.otherwise, dead
+                    )
+                if statement.then or statement.otherwise:
+                    result.append(statement)
+                elif not isPure(statement.condition):
+                    result.append(statement)
+                else:
+                    dead.append(statement)
+        elif kind is While:
+            if constantValue(statement.condition) != 0:
+                statement.body = removeDeadStatements(statement.body, dead)
+                result.append(statement)
+            else:
+                dead.append(statement)
+        else:
+            result.append(statement)
+        if not reachesEnd(result[start:]):
+            dead.extend(statements[i + 1 :])
+            break
+    return result
+
+
+def removeDeadCode(tree, program=None):
+    # dead code elimination pass, keeping what it removes in tree.dead
+    for subroutine in tree.subroutines:
+        subroutine.body = removeDeadStatements(subroutine.body, tree.dead)
+    return tree
+
+
+# OS calls with no side effects that always return, and whose result only
+# depends on their arguments and on the object they are called on
+PURE_CALLS = frozenset(
+    ("String.length", "String.charAt", "Math.abs", "Math.min", "Math.max", "Math.sqrt")
+)
+
+
+def mapSubexpressions(node, function):
+    # an expression with the expressions directly inside it replaced by
+    # function(expression)
+    kind = type(node)
+    if kind is Binary:
+        return Binary(node.op, function(node.left), function(node.right))
+    if kind is Unary:
+        return Unary(node.op, function(node.operand))
+    if kind is Index:
+        return Index(node.array, function(node.index))
+    if kind is Call:
+        receiver = node.receiver
+        if receiver is not None:
+            receiver = function(receiver)
+        return Call(node.name, receiver, [function(arg) for arg in node.args])
+    return node
+
+
+def loopEffects(loop):
+    # what running a While can change: (the (segment, index) of every
+    # variable it assigns, whether it writes into arrays, whether it makes
+    # a call other than through PURE_CALLS). string literals call String,
+    # the Math calls behind * and / change nothing
+    assigned = set()
+    writesArrays = False
+    calls = False
+    expressions = [loop.condition]
+    for statement in walkStatements(loop.body):
+        if type(statement) is Let:
+            target = statement.target
+            if type(target) is Index:
+                writesArrays = True
+            else:
+                assigned.add((target.segment, target.index))
+        expressions.extend(statementExpressions(statement))
+    for expression in expressions:
+        for node in allExpressions(expression):
+            kind = type(node)
+            if (kind is Call and node.name not in PURE_CALLS) or kind is String:
+                calls = True
+    return assigned, writesArrays, calls
+
+
+def isInvariant(node, effects):
+    # true if an expression has the same value on every pass through a
+    # loop with the given effects. any call may reach code that changes a
+    # static, a field, an array or the object behind a PURE_CALLS method
+    assigned, writesArrays, calls = effects
+    kind = type(node)
+    if kind is Const or kind is Keyword:
+        return True
+    if kind is Var:
+        if (node.segment, node.index) in assigned:
+            return False
+        return node.segment in ("local", "argument") or not calls
+    if kind is Index:
+        if writesArrays or calls:
+            return False
+    elif kind is Call:
+        if node.name not in PURE_CALLS or writesArrays:
+            return False
+        if node.receiver is not None and calls:
+            return False
+    elif kind is not Binary and kind is not Unary:
+        return False
+    return all(isInvariant(child, effects) for child in subexpressions(node))
+
+
+def isSafeToSpeculate(node):
+    # true if evaluating an invariant expression before a loop that might
+    # not have evaluated it cannot fail. Math.divide by zero, and calls
+    # such as String.charAt out of range or Math.sqrt of a negative, end
+    # in Sys.error
+    for child in allExpressions(node):
+        kind = type(child)
+        if kind is Call:
+            return False
+        if kind is Binary and child.op == "/":
+            if not constantValue(child.right):
+                return False
+    return True
+
+
+def hoistExpression(node, speculative, loop):
+    # an expression of a loop with its largest invariant parts replaced by
+    # new locals. loop is (effects, subroutine, hoisted), hoisted
+    # collecting the (local, expression) pairs to compute ahead of it
+    effects, subroutine, hoisted = loop
+    kind = type(node)
+    if (
+        kind is not Var
+        and kind is not Const
+        and kind is not Keyword
+        and constantValue(node) is None
+        and isInvariant(node, effects)
+        and (not speculative or isSafeToSpeculate(node))
+    ):
+        for local, expression in hoisted:
+            if sameExpression(node, expression):
+                return local
+        index = subroutine.nLocals
+        local = Var(f"$loop{index}", "local", index, "int")
+        subroutine.nLocals += 1
+        hoisted.append((local, node))
+        return local
+    return mapSubexpressions(
+        node, lambda child: hoistExpression(child, speculative, loop)
+    )
+
+
+def hoistInvariants(statements, subroutine):
+    # a statement list with the invariant expressions of its loops, nested
+    # loops included, computed into new locals just ahead of the loop
+    result = []
+    for statement in statements:
+        kind = type(statement)
+        if kind is If:
+            statement.then = hoistInvariants(statement.then, subroutine)
+            if statement.otherwise is not None:
+                statement.otherwise = hoistInvariants(statement.otherwise, subroutine)
+        elif kind is While:
+            hoisted = []
+            loop = (loopEffects(statement), subroutine, hoisted)
+            # the condition is evaluated at least once, the body maybe never
+            statement.condition = hoistExpression(statement.condition, False, loop)
+            mapExpressions(
+                statement.body, lambda node: hoistExpression(node, True, loop)
+            )
+            result.extend(Let(local, expression) for local, expression in hoisted)
+            statement.body = hoistInvariants(statement.body, subroutine)
+        result.append(statement)
+    return result
+
+
+def hoistLoopInvariants(tree, program=None):
+    # loop invariant code motion pass
+    for subroutine in tree.subroutines:
+        subroutine.body = hoistInvariants(subroutine.body, subroutine)
+    return tree
+
+
+# optimizations by name, with the -O level that turns each one on. AST
+# passes (those in PASSES) run between parsing and code generation in this
+# order, the others switch on code generator features
+OPTIMIZATIONS = {
+    # calls to getters and constant functions of other classes, -w only
+    "inline": 1,
+    "fold": 1,  # constant folding and algebraic identities
+    "dead": 1,  # unreachable statements and constant branches removed
+    # loop invariant expressions computed once ahead of the loop, trusting
+    # that nothing but a call changes statics, fields and the objects behind
+    # PURE_CALLS, which raw pointers into them could
+    "licm": 2,
+    "strength": 1,  # * and / by constants without the OS calls
+    "branches": 1,  # if/while jump on their condition directly
+    "arrays": 1,  # that k addressing, THAT reused, no needless temp 0
+    # string literals built once and shared, so code that changes or
+    # disposes a literal sees the change on its next evaluation
+    "strings": 2,
+    # locals of functions that call nothing, and the arguments they use
+    # most, in statics. costs static RAM, which sits below the stack
+    "leaves": 2,
+}
+
+# AST pass of each optimization that rewrites the tree, pass(classNode,
+# program) returns the rewritten ClassNode. program is the subroutine
+# table of whole program mode, None when files compile on their own
+PASSES = {
+    "inline": inlineCalls,
+    "fold": foldConstants,
+    "dead": removeDeadCode,
+    "licm": hoistLoopInvariants,
+}
+
+
+def optimizationsFor(level, enable=(), disable=()):
+    # the set of optimizations for an -O level and -f/-fno- overrides
+    unknown = [name for name in (*enable, *disable) if name not in OPTIMIZATIONS]
+    if unknown:
+        raise ValueError(f"unknown optimization '{unknown[0]}'")
+    chosen = {name for name, needed in OPTIMIZATIONS.items() if needed <= level}
+    return frozenset((chosen | set(enable)) - set(disable))
+
+
+def optimize(tree, optimizations, program=None):
+    # run the enabled AST passes over a ClassNode
+    for name in OPTIMIZATIONS:
+        if name in optimizations and name in PASSES:
+            tree = PASSES[name](tree, program)
+    return tree
+
+
+def readSubroutines(input_file):
+    # the subroutine table of a single Jack file for whole program mode,
+    # empty if it does not parse; compileFile reports the error
     try:
-        tokenizer = JackTokenizer(input_file)
-        engine = CompilationEngine(tokenizer, output_file)
+        return subroutineTable(Parser(JackTokenizer(input_file)).parseClass())
+    except (OSError, ValueError):
+        return {}
 
-        # Start compilation
-        engine.compileClass()
-        engine.close()
 
-        print(f"Compiled {input_file} -> {output_file}")
+def generateCode(tree, optimizations):
+    # the VM code of an optimized ClassNode, and the number of jumps dead
+    # code elimination left out of it
+    code = io.StringIO()
+    generator = CodeGenerator(VMWriter(code), optimizations)
+    generator.generateClass(tree)
+    return code.getvalue(), generator.deadJumps
+
+
+def commandCount(statements, optimizations):
+    # the number of VM commands a statement list compiles to
+    code = io.StringIO()
+    CodeGenerator(VMWriter(code), optimizations).generateStatements(statements)
+    return code.getvalue().count("\n")
+
+
+def compileFile(input_file, optimizations=frozenset(), program=None):
+    # compile a single Jack file, returns (input, output, error message,
+    # removed), removed being the number of VM commands dead code
+    # elimination left out, None when it is off. program, the subroutine
+    # table of every class in whole program mode, has the calls checked
+    # and lets the passes look into other classes
+    output_file = input_file[: -len(".jack")] + ".vm"
+    removed = None
+
+    try:
+        tree = Parser(JackTokenizer(input_file)).parseClass()
+        if program is not None:
+            checkCalls(tree, program)
+        tree = optimize(tree, optimizations, program)
+        code, deadJumps = generateCode(tree, optimizations)
+        if "dead" in optimizations:
+            removed = commandCount(tree.dead, optimizations) + deadJumps
+        with open(output_file, "w") as file:
+            file.write(code)
+    except (OSError, ValueError) as e:
+        return input_file, output_file, str(e), removed
     except Exception as e:
-        print(f"ERROR: Failed to compile {input_file}: {e}")
         import traceback
 
-        traceback.print_exc()
+        error = f"{e}\n{traceback.format_exc().rstrip()}"
+        return input_file, output_file, error, removed
+    return input_file, output_file, None, removed
+
+
+def listJackFiles(source):
+    # the .jack files of a file or directory, sorted so the output order
+    # does not depend on the file system
+    if os.path.isfile(source) and source.endswith(".jack"):
+        return [source]
+    if os.path.isdir(source):
+        return sorted(
+            os.path.join(source, file)
+            for file in os.listdir(source)
+            if file.endswith(".jack")
+        )
+    raise ValueError(f"{source} is not a valid .jack file or directory")
 
 
 def main():
-    if len(sys.argv) != 2:
-        print("Usage: python JackCompilerFinal.py <source>")
+    usage = "Usage: python hjc.py <source>... [-w] [-j N] [-O LEVEL] [-f[no-]NAME]..."
+    if len(sys.argv) < 2:
+        print(usage)
         print("  <source> can be a .jack file or a directory containing .jack files")
+        print("  -w compiles the sources as one program, checking calls between")
+        print("     classes and inlining across them")
+        print("  -j N compiles N files at a time (default: one per CPU)")
+        print("  -O LEVEL picks the optimizations (default 0, none)")
+        print("  -fNAME / -fno-NAME turn a single optimization on or off")
         sys.exit(1)
 
-    source = sys.argv[1]
+    sources = []
+    jobs = os.cpu_count() or 1
+    whole = False
+    level = 0
+    enable = []
+    disable = []
 
-    if os.path.isfile(source) and source.endswith(".jack"):
-        # Single file
-        compileFile(source)
-    elif os.path.isdir(source):
-        # Directory
-        for file in os.listdir(source):
-            if file.endswith(".jack"):
-                compileFile(os.path.join(source, file))
-    else:
-        print(f"Error: {source} is not a valid .jack file or directory")
+    args = sys.argv[1:]
+    i = 0
+    try:
+        while i < len(args):
+            arg = args[i]
+            if arg == "-w":
+                whole = True
+                i += 1
+            elif arg == "-j":
+                jobs = int(args[i + 1])
+                i += 2
+            elif arg.startswith("-O"):
+                level = int(arg[2:] or args[i + 1])
+                i += 1 if arg[2:] else 2
+            elif arg.startswith("-fno-"):
+                disable.append(arg[5:])
+                i += 1
+            elif arg.startswith("-f"):
+                enable.append(arg[2:])
+                i += 1
+            elif arg.startswith("-"):
+                raise ValueError(f"unknown option '{arg}'")
+            else:
+                sources.append(arg)
+                i += 1
+        optimizations = optimizationsFor(level, enable, disable)
+        files = [file for source in sources for file in listJackFiles(source)]
+    except (IndexError, ValueError) as e:
+        print(f"Error: {e}")
+        print(usage)
+        sys.exit(1)
+
+    # every class compiles on its own, so files are spread over a process
+    # pool; map keeps the results in file order. whole program mode first
+    # reads the subroutines of every file, then compiles them all against
+    # that table
+    pool = None
+    if jobs > 1 and len(files) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        pool = ProcessPoolExecutor(min(jobs, len(files)))
+    mapFiles = pool.map if pool is not None else map
+    try:
+        program = None
+        if whole:
+            program = {}
+            for table in mapFiles(readSubroutines, files):
+                program.update(table)
+        n = len(files)
+        results = list(mapFiles(compileFile, files, [optimizations] * n, [program] * n))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    failed = 0
+    for input_file, output_file, error, removed in results:
+        if error is None and removed:
+            plural = "" if removed == 1 else "s"
+            print(
+                f"Compiled {input_file} -> {output_file}"
+                f" ({removed} dead VM command{plural} removed)"
+            )
+        elif error is None:
+            print(f"Compiled {input_file} -> {output_file}")
+        else:
+            print(f"ERROR: Failed to compile {input_file}: {error}")
+            failed += 1
+    if failed:
+        print(f"{failed} of {len(results)} files failed to compile")
         sys.exit(1)
 
 